@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+
+'''Benchmarks for the omegat_tools scripts.
+
+The benchmarks import the scripts as modules, and must therefore be run
+from the omegat_tools folder, for example:
+
+    python -m benchmarks.glossary_dedup
+    python -m benchmarks.suite --output results.json
+
+The suite module times the main stages of the scripts on inputs
+generated by the corpus module, and saves the results as JSON.
+'''
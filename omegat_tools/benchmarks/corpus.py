@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+'''Generate synthetic inputs for the benchmarks.
+
+The generators create files that look like the real thing, at any size:
+
+  - TMX files of OmegaT team projects, with several translators, some
+    alternative translations and some translations revised by another
+    translator;
+  - OmegaT glossaries in tab-separated format, with a given proportion
+    of duplicate entries and of entries with a note;
+  - folder trees of OmegaT projects, some of them team projects with a
+    ".repositories" folder holding a copy of the project.
+
+Every generator takes a seed, so that the same parameters always produce
+the same files and results can be compared from one release to the next.
+'''
+
+import random
+from xml.sax.saxutils import escape, quoteattr
+
+# Constants
+SOURCE_LANG = 'EN-US'
+TARGET_LANG = 'JA'
+SOURCE_WORDS = ('the', 'translation', 'memory', 'project', 'file', 'term',
+                'glossary', 'segment', 'review', 'source', 'target', 'team',
+                'update', 'folder', 'client', 'document', 'version', 'new',
+                'check', 'text', 'with', 'for', 'and', 'of', 'is', 'a')
+TARGET_WORDS = ('翻訳', 'メモリ', 'プロジェクト', 'ファイル', '用語', '集',
+                'セグメント', 'レビュー', '原文', '訳文', 'チーム', '更新',
+                'フォルダー', '顧客', '文書', 'バージョン', '新しい', '確認',
+                'テキスト', 'の', 'を', 'に', 'は', 'が', 'と', 'で')
+TMX_HEADER = f'''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE tmx SYSTEM "tmx11.dtd">
+<tmx version="1.1">
+  <header creationtool="OmegaT" o-tmf="OmegaT TMX" adminlang="EN-US" datatype="plaintext" creationtoolversion="6.0.0" segtype="sentence" srclang="{SOURCE_LANG}"/>
+  <body>
+'''
+TMX_FOOTER = '''  </body>
+</tmx>
+'''
+PROJECT_FILE = '''<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<omegat>
+  <project version="1.0">
+    <source_dir>__DEFAULT__</source_dir>
+    <target_dir>__DEFAULT__</target_dir>
+    <tm_dir>__DEFAULT__</tm_dir>
+    <glossary_dir>__DEFAULT__</glossary_dir>
+    <glossary_file>__DEFAULT__</glossary_file>
+    <source_lang>{source}</source_lang>
+    <target_lang>{target}</target_lang>
+  </project>
+</omegat>
+'''
+
+
+def make_text(rng, words, minimum=4, maximum=20):
+    '''Build a random sentence from a list of words.'''
+
+    length = rng.randint(minimum, maximum)
+    separator = '' if words is TARGET_WORDS else ' '
+
+    return separator.join(rng.choice(words) for _ in range(length))
+
+
+def make_translators(count):
+    '''Name the translators and give each one a two-letter code.
+
+    The codes start at "TA" so that they can never be mistaken for the
+    target language code in the names of the files created.
+    '''
+
+    translators = {}
+    for number in range(count):
+        code = chr(ord('T') + number // 26) + chr(ord('A') + number % 26)
+        translators[f'Translator {number}'] = code
+
+    return translators
+
+
+def make_date(rng, year=2024):
+    '''Build a random date in the format used in TMX files.'''
+
+    return (f'{year}{rng.randint(1, 12):02}{rng.randint(1, 28):02}T'
+            f'{rng.randint(0, 23):02}{rng.randint(0, 59):02}'
+            f'{rng.randint(0, 59):02}Z')
+
+
+def format_tu(source, target, creationid, changeid, creationdate,
+              changedate, context=None):
+    '''Write a tu element the way OmegaT does.'''
+
+    lines = ['    <tu>\n']
+
+    if context is not None:
+        for prop_type, value in context:
+            lines.append(f'      <prop type="{prop_type}">{escape(value)}'
+                         '</prop>\n')
+
+    lines.append(f'      <tuv lang="{SOURCE_LANG}">\n'
+                 f'        <seg>{escape(source)}</seg>\n'
+                 '      </tuv>\n')
+    lines.append(f'      <tuv lang="{TARGET_LANG}" '
+                 f'changeid={quoteattr(changeid)} changedate="{changedate}" '
+                 f'creationid={quoteattr(creationid)} '
+                 f'creationdate="{creationdate}">\n'
+                 f'        <seg>{escape(target)}</seg>\n'
+                 '      </tuv>\n')
+    lines.append('    </tu>\n')
+
+    return ''.join(lines)
+
+
+def write_team_tmx(tmxfile, tu_count, translators, alternative_ratio=0.05,
+                   revised_ratio=0.2, seed=0):
+    '''Write the TMX file of a team project.
+
+    Each translation is made by one of the translators, and a proportion
+    of them is then revised by another translator. Alternative
+    translations are written after the default translations, as in the
+    files saved by OmegaT. Returns the number of revised translations.
+    '''
+
+    rng = random.Random(seed)
+    names = list(translators)
+    revised = 0
+    alternatives = []
+
+    with open(tmxfile, 'w', encoding='utf-8', newline='\n') as tf:
+        tf.write(TMX_HEADER)
+
+        for number in range(tu_count):
+            source = f'{make_text(rng, SOURCE_WORDS)} ({number})'
+            target = make_text(rng, TARGET_WORDS)
+            creationid = rng.choice(names)
+            creationdate = make_date(rng, 2023)
+            changeid = creationid
+            changedate = creationdate
+
+            if len(names) > 1 and rng.random() < revised_ratio:
+                changeid = rng.choice([name for name in names
+                                       if name != creationid])
+                changedate = make_date(rng, 2024)
+                revised += 1
+
+            context = None
+            if rng.random() < alternative_ratio:
+                context = [('file', f'source/document{number % 50}.docx'),
+                           ('prev', make_text(rng, SOURCE_WORDS)),
+                           ('next', make_text(rng, SOURCE_WORDS))]
+
+            tu = format_tu(source, target, creationid, changeid,
+                           creationdate, changedate, context)
+
+            if context is None:
+                tf.write(tu)
+            else:
+                alternatives.append(tu)
+
+        tf.writelines(alternatives)
+        tf.write(TMX_FOOTER)
+
+    return revised
+
+
+def make_glossary_entries(count, duplicate_ratio=0.3, note_ratio=0.2,
+                          seed=0):
+    '''Generate glossary entries, some of them duplicates.
+
+    A duplicate repeats the terms of an earlier entry, either exactly or
+    with a note added or removed, so that it is found redundant when the
+    glossaries are merged.
+    '''
+
+    rng = random.Random(seed)
+    entries = []
+
+    for number in range(count):
+        if entries and rng.random() < duplicate_ratio:
+            source, target, _ = rng.choice(entries)
+        else:
+            source = f'{make_text(rng, SOURCE_WORDS, 1, 4)} {number}'
+            target = make_text(rng, TARGET_WORDS, 1, 4)
+
+        note = make_text(rng, SOURCE_WORDS, 2, 6) \
+               if rng.random() < note_ratio else ''
+        entries.append((source, target, note))
+
+    return entries
+
+
+def write_glossaries(folder, file_count, entry_count, duplicate_ratio=0.3,
+                     note_ratio=0.2, seed=0):
+    '''Spread glossary entries over several glossary files.
+
+    Returns the list of glossary files written.
+    '''
+
+    folder.mkdir(parents=True, exist_ok=True)
+    entries = make_glossary_entries(entry_count, duplicate_ratio,
+                                    note_ratio, seed)
+    glossaries = []
+
+    for number in range(file_count):
+        glossary = folder/f'glossary{number:03}.txt'
+        with open(glossary, 'w', encoding='utf-8', newline='\n') as gf:
+            for source, target, note in entries[number::file_count]:
+                gf.write('\t'.join(filter(None, (source, target, note)))
+                         + '\n')
+        glossaries.append(glossary)
+
+    return glossaries
+
+
+def write_project(project, memory_tus, glossary_entries, team=False,
+                  seed=0):
+    '''Create an OmegaT project folder with a memory and a glossary.
+
+    Team projects also get a ".repositories" folder holding a copy of
+    the project, as OmegaT does, which the project search must skip.
+    '''
+
+    rng = random.Random(seed)
+
+    for folder in ('omegat', 'glossary', 'source', 'target', 'tm'):
+        (project/folder).mkdir(parents=True, exist_ok=True)
+
+    (project/'omegat.project').write_text(
+        PROJECT_FILE.format(source=SOURCE_LANG, target=TARGET_LANG),
+        encoding='utf-8')
+    write_team_tmx(project/'omegat'/'project_save.tmx', memory_tus,
+                   make_translators(2), seed=seed)
+    write_glossaries(project/'glossary', 1, glossary_entries, seed=seed)
+    (project/'glossary'/'glossary000.txt').rename(
+        project/'glossary'/'glossary.txt')
+
+    for number in range(rng.randint(1, 5)):
+        (project/'source'/f'document{number}.txt').write_text(
+            make_text(rng, SOURCE_WORDS, 50, 200), encoding='utf-8')
+
+    if team:
+        copy = project/'.repositories'/'example.com_team'/project.name
+        write_project(copy, memory_tus, glossary_entries, seed=seed)
+
+
+def write_project_tree(root, project_count, team_ratio=0.3, depth=2,
+                       memory_tus=20, glossary_entries=20, seed=0):
+    '''Create a folder tree of OmegaT projects grouped in subfolders.
+
+    The projects are spread over nested client and year folders, along
+    with folders that hold no project at all. Returns the list of
+    project folders created.
+    '''
+
+    rng = random.Random(seed)
+    projects = []
+
+    for number in range(project_count):
+        parents = [f'group{rng.randint(0, 9)}' for _ in range(depth)]
+        project = root.joinpath(*parents, f'project{number:05}')
+        write_project(project, memory_tus, glossary_entries,
+                      rng.random() < team_ratio, seed + number)
+        projects.append(project)
+
+        if rng.random() < 0.2:
+            other = root.joinpath(*parents, f'archive{number:05}')
+            other.mkdir(parents=True, exist_ok=True)
+            (other/'notes.txt').write_text('Not a project',
+                                           encoding='utf-8')
+
+    return projects
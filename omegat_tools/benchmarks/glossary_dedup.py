@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+'''Measure how the glossary deduplication scales with the number of entries.
+
+Synthetic glossary entries are generated for increasingly large sizes,
+and the time taken by remove_redundant_pairs is reported for each one,
+along with the time per entry. With linear behaviour, the time per entry
+stays roughly constant as the number of entries grows.
+
+Usage (from the omegat_tools folder):
+
+    python -m benchmarks.glossary_dedup [size ...]
+'''
+
+import random
+import sys
+import time
+
+from merge_omegat_glossaries import remove_redundant_pairs
+
+# Default sizes, up to a few million entries
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 4_000_000]
+
+# Proportion of pairs that appear both with and without a note
+DUPLICATE_RATIO = 0.2
+
+
+def make_entries(size, seed=0):
+    '''Generate unique glossary entries, some of them redundant pairs.'''
+
+    rng = random.Random(seed)
+    entries = []
+
+    while len(entries) < size:
+        pair = (f'source term {len(entries)}', f'target term {len(entries)}')
+
+        if rng.random() < DUPLICATE_RATIO:
+            entries.append(pair + ('',))
+            entries.append(pair + ('note',))
+        else:
+            entries.append(pair + (rng.choice(['', 'note']),))
+
+    entries = entries[:size]
+    rng.shuffle(entries)
+
+    return entries
+
+
+def time_dedup(entries):
+    '''Time a single call to remove_redundant_pairs.'''
+
+    start = time.perf_counter()
+    glossary = remove_redundant_pairs(entries)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, len(glossary)
+
+
+def run(sizes):
+    '''Run the benchmark for each size and print the results.'''
+
+    print(f'{"entries":>10} {"kept":>10} {"seconds":>10} {"µs/entry":>10}')
+
+    for size in sizes:
+        entries = make_entries(size)
+        elapsed, kept = time_dedup(entries)
+        per_entry = elapsed / size * 1_000_000
+
+        print(f'{size:>10} {kept:>10} {elapsed:>10.3f} {per_entry:>10.3f}')
+
+
+if __name__ == '__main__':
+
+    sizes = [int(size) for size in sys.argv[1:]] or DEFAULT_SIZES
+    run(sizes)
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+'''Time the main stages of the scripts on synthetic inputs.
+
+A synthetic corpus is generated in a temporary folder (see the corpus
+module), and each of the following functions is then timed on it:
+
+  - sort_unrevised_tus, on the TMX file of a team project;
+  - remove_redundant_pairs, on the entries of a folder of glossaries;
+  - make_project_list, on a folder tree of projects;
+  - copy_project_data, on the projects found, first to an empty folder,
+    then again with sync enabled once the files are up to date.
+
+Each benchmark runs in a separate process, so that the peak memory use
+(resident set size) recorded is that of the benchmark alone. The results
+are printed and saved as JSON along with the parameters of the corpus,
+so that they can be compared from one release to the next.
+
+Usage (from the omegat_tools folder):
+
+    python -m benchmarks.suite --scale medium --output results.json
+    python -m benchmarks.suite --tus 500000 --translators 8 --only sort_unrevised_tus
+'''
+
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import common
+from benchmarks import corpus
+
+# Corpus sizes for each scale
+SCALES = {'small':{'tus':10_000, 'translators':4, 'glossary_files':20,
+                   'glossary_entries':50_000, 'projects':50},
+          'medium':{'tus':100_000, 'translators':6, 'glossary_files':100,
+                    'glossary_entries':500_000, 'projects':500},
+          'large':{'tus':1_000_000, 'translators':10, 'glossary_files':500,
+                   'glossary_entries':4_000_000, 'projects':5_000}
+         }
+DEFAULT_RATIOS = {'alternative_ratio':0.05, 'revised_ratio':0.2,
+                  'duplicate_ratio':0.3, 'note_ratio':0.2, 'team_ratio':0.3}
+
+
+def bench_sort_unrevised_tus(inputs, workdir):
+    '''Time the sorting of a team project memory by translator.'''
+
+    import extract_segments as extract
+
+    tmxdata = extract.read_tmx_data(extract.parse_tmx_tree(inputs['tmx']))
+
+    # Use the generated translators rather than the configuration file.
+    tmxdata['translators'] = inputs['translators']
+
+    start = time.perf_counter()
+    sorted_tmxes = extract.sort_unrevised_tus(tmxdata)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, {'files':len(sorted_tmxes)}
+
+
+def bench_remove_redundant_pairs(inputs, workdir):
+    '''Time the removal of redundant pairs from glossary entries.'''
+
+    import merge_omegat_glossaries as merge
+
+    entries = [entry for glossary in inputs['glossaries']
+               for entry in merge.get_glossary_entries(Path(glossary))]
+    entries = list(dict.fromkeys(entries))
+
+    start = time.perf_counter()
+    glossary = merge.remove_redundant_pairs(entries)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, {'entries':len(entries), 'kept':len(glossary)}
+
+
+def set_project_settings(collect):
+    '''Load the project settings without the discovery index.'''
+
+    collect.project_settings = collect.get_project_settings()
+    collect.project_settings['discovery_index'] = None
+
+
+def bench_make_project_list(inputs, workdir):
+    '''Time the search for projects in a folder tree.'''
+
+    import collect_omegat_project_data as collect
+
+    set_project_settings(collect)
+
+    start = time.perf_counter()
+    projects = collect.make_project_list(Path(inputs['projects']))
+    elapsed = time.perf_counter() - start
+
+    return elapsed, {'projects':len(projects)}
+
+
+def copy_projects(inputs, destination, sync):
+    '''Time the copy of the data of every project to a folder.'''
+
+    import collect_omegat_project_data as collect
+
+    set_project_settings(collect)
+    collect.project_settings['sync'] = sync
+    project_data = collect.collate_project_data(
+        collect.make_project_list(Path(inputs['projects'])))
+
+    start = time.perf_counter()
+    collect.copy_project_data(project_data, destination)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, {'projects':len(project_data)}
+
+
+def bench_copy_project_data(inputs, workdir):
+    '''Time the copy of the project data to an empty folder.'''
+
+    destination = Path(tempfile.mkdtemp(dir=workdir))
+
+    return copy_projects(inputs, destination, sync=False)
+
+
+def bench_copy_project_data_sync(inputs, workdir):
+    '''Time a sync of the project data to an up to date folder.'''
+
+    destination = Path(tempfile.mkdtemp(dir=workdir))
+    copy_projects(inputs, destination, sync=False)
+
+    return copy_projects(inputs, destination, sync=True)
+
+
+BENCHMARKS = {'sort_unrevised_tus':bench_sort_unrevised_tus,
+              'remove_redundant_pairs':bench_remove_redundant_pairs,
+              'make_project_list':bench_make_project_list,
+              'copy_project_data':bench_copy_project_data,
+              'copy_project_data_sync':bench_copy_project_data_sync
+             }
+
+
+def run_benchmark(name, inputs, workdir):
+    '''Run a single benchmark and measure its time and memory use.
+
+    The console output of the scripts is discarded, so that it does
+    not interfere with the results.
+    '''
+
+    stdout = sys.stdout
+    with open(Path(workdir, f'{name}.log'), 'w', encoding='utf-8') as log:
+        sys.stdout = log
+        try:
+            elapsed, details = BENCHMARKS[name](inputs, workdir)
+        finally:
+            sys.stdout = stdout
+
+    return {'name':name,
+            'wall_time':elapsed,
+            'peak_rss':common.get_peak_rss(),
+            'details':details}
+
+
+def generate_corpus(folder, parameters, seed=0):
+    '''Write the synthetic inputs of the benchmarks to a folder.'''
+
+    translators = corpus.make_translators(parameters['translators'])
+
+    tmxfile = Path(folder, 'team', 'project_save.tmx')
+    tmxfile.parent.mkdir(parents=True)
+    corpus.write_team_tmx(tmxfile, parameters['tus'], translators,
+                          parameters['alternative_ratio'],
+                          parameters['revised_ratio'], seed)
+
+    glossaries = corpus.write_glossaries(Path(folder, 'glossaries'),
+                                         parameters['glossary_files'],
+                                         parameters['glossary_entries'],
+                                         parameters['duplicate_ratio'],
+                                         parameters['note_ratio'], seed)
+
+    projects = Path(folder, 'projects')
+    corpus.write_project_tree(projects, parameters['projects'],
+                              parameters['team_ratio'], seed=seed)
+
+    return {'tmx':str(tmxfile),
+            'translators':translators,
+            'glossaries':[str(glossary) for glossary in glossaries],
+            'projects':str(projects)}
+
+
+def run(names, parameters, repeat=1, seed=0, tempdir=None):
+    '''Generate the corpus and run each benchmark in a new process.
+
+    With several repeats, the shortest time and the largest peak
+    memory use of the runs are kept.
+    '''
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+
+    with tempfile.TemporaryDirectory(dir=tempdir) as folder:
+        start = time.perf_counter()
+        inputs = generate_corpus(folder, parameters, seed)
+        print(f'Corpus generated in {time.perf_counter() - start:.1f} s')
+
+        for name in names:
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1,
+                                         mp_context=context) as executor:
+                    runs.append(executor.submit(run_benchmark, name, inputs,
+                                                folder).result())
+
+            result = min(runs, key=lambda run: run['wall_time'])
+            peaks = [run['peak_rss'] for run in runs
+                     if run['peak_rss'] is not None]
+            result['peak_rss'] = max(peaks) if peaks else None
+            result['repeat'] = repeat
+            results.append(result)
+
+            peak = 'n/a' if result['peak_rss'] is None \
+                   else f"{result['peak_rss'] / 2**20:.1f} MiB"
+            print(f"{name:<24} {result['wall_time']:>10.3f} s {peak:>12}")
+
+    return results
+
+
+def parse_arguments():
+    '''Read the command line arguments.'''
+
+    parser = argparse.ArgumentParser(description='Benchmark the scripts on '
+                                                 'synthetic inputs.')
+    parser.add_argument('--scale', choices=SCALES, default='small',
+                        help='preset corpus size')
+    for name in SCALES['small']:
+        parser.add_argument('--' + name.replace('_', '-'), type=int,
+                            dest=name, help='override the preset size')
+    for name in DEFAULT_RATIOS:
+        parser.add_argument('--' + name.replace('_', '-'), type=float,
+                            dest=name, default=DEFAULT_RATIOS[name],
+                            help=f'default: {DEFAULT_RATIOS[name]}')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS,
+                        default=list(BENCHMARKS),
+                        help='benchmarks to run')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='number of runs of each benchmark')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the corpus generator')
+    parser.add_argument('--tempdir', type=Path,
+                        help='folder in which to generate the corpus')
+    parser.add_argument('--output', type=Path,
+                        help='JSON file to save the results to')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    arguments = parse_arguments()
+
+    parameters = dict(SCALES[arguments.scale])
+    for name in list(SCALES['small']) + list(DEFAULT_RATIOS):
+        if getattr(arguments, name) is not None:
+            parameters[name] = getattr(arguments, name)
+
+    results = run(arguments.only, parameters, arguments.repeat,
+                  arguments.seed, arguments.tempdir)
+
+    report = {'date':datetime.now(timezone.utc).isoformat(),
+              'python':platform.python_version(),
+              'platform':platform.platform(),
+              'scale':arguments.scale,
+              'parameters':parameters,
+              'seed':arguments.seed,
+              'results':results}
+
+    if arguments.output is not None:
+        with open(arguments.output, 'w', encoding='utf-8') as rf:
+            json.dump(report, rf, indent=2)
@@ -10,6 +10,15 @@ into other CAT tools.
 The script creates subfolders with the original project name into a
 user-selected central folder, and also renames both the memory and glossary
 files to match the name of the project.
+
+The folder to search and the destination folder can also be passed on the
+command line, in which case no dialog is shown, for scheduled runs:
+
+    python collect_omegat_project_data.py --sync ~/OmegaT_Projects /backup
+
+The copies are compressed, with the compression suffix added to their
+name, if the "compression" option of the "Files" section of the
+configuration file is set.
 '''
 
 ###########################################################################
@@ -33,9 +42,15 @@ files to match the name of the project.
 #     dialog.
 ###########################################################################
 
+import argparse
+import json
+import os
 import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import common
+from snapshot_store import SnapshotStore
 
 def get_project_settings():
     '''Load OmegaT project information from the configuration file'''
@@ -43,9 +58,38 @@ def get_project_settings():
     project_settings = {'configpath':common.config['Paths']['projects'],
                         'project_file':common.config['Files']['project_file'],
                         'main_memory':common.config['Files']['main_memory'],
-                        'main_glossary':common.config['Files']['main_glossary']
+                        'main_glossary':common.config['Files']['main_glossary'],
+                        'sync':common.config.getboolean('Collect', 'sync',
+                                                        fallback=False),
+                        'workers':common.config.getint('Collect', 'workers',
+                                                       fallback=8),
+                        'prune':common.config.get('Collect', 'prune_folders',
+                                                  fallback='.repositories'),
+                        'store':common.config.getboolean('Collect', 'store',
+                                                         fallback=False),
+                        'compression':common.config.get('Collect',
+                                                        'store_compression',
+                                                        fallback='auto'),
+                        'level':common.config.getint('Collect',
+                                                     'store_level',
+                                                     fallback=None)
                        }
 
+    # Use every available core unless a positive number was set.
+    project_settings['workers'] = common.normalize_workers(
+        project_settings['workers'])
+
+    # Split the list of folders to skip when searching for projects.
+    project_settings['prune'] = {folder.strip() for folder
+                                 in project_settings['prune'].split(',')
+                                 if folder.strip()}
+
+    # The discovery index is optional, and only used if its path is set.
+    if common.config.has_option('Paths', 'discovery_index'):
+        project_settings['discovery_index'] = common.config['Paths']['discovery_index']
+    else:
+        project_settings['discovery_index'] = None
+
     return project_settings
 
 
@@ -58,21 +102,127 @@ def set_projects_path():
     return projects_path
 
 
+def scan_folder(folder, project_file):
+    '''Check whether a folder is a project and list its subfolders.'''
+
+    is_project = False
+    subfolders = []
+
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name == project_file and entry.is_file():
+                is_project = True
+            elif entry.is_dir(follow_symlinks=False):
+                subfolders.append(entry.name)
+
+    return is_project, sorted(subfolders)
+
+
+def load_discovery_index(index_file, project_file):
+    '''Read the folders recorded during the previous search.
+
+    The index is ignored if it cannot be read or if it was built
+    for a different project file name.
+    '''
+
+    try:
+        with open(index_file, 'r', encoding='utf-8') as jf:
+            index = json.load(jf)
+    except (OSError, ValueError):
+        return {}
+
+    if index.get('project_file') != project_file:
+        return {}
+
+    return index.get('folders', {})
+
+
+def save_discovery_index(index_file, project_file, folders):
+    '''Save the folders found during the search for the next one.'''
+
+    index_file = common.Path(index_file)
+    temp_file = index_file.with_name(index_file.name + '.tmp')
+
+    with open(temp_file, 'w', encoding='utf-8') as jf:
+        json.dump({'project_file':project_file, 'folders':folders}, jf)
+
+    os.replace(temp_file, index_file)
+
+
+def find_projects(searchpath, project_file, prune, index=None):
+    '''Search a folder tree for the root folders of projects.
+
+    The search does not go further down once the root of a project
+    is found, and skips the folders to prune without looking inside.
+    If an index of a previous search is provided, folders whose
+    modification time has not changed since are not read again.
+    Folders that cannot be read are left out, as Path.rglob does.
+
+    Returns the list of projects and the index of the folders read.
+    '''
+
+    if index is None:
+        index = {}
+
+    projects = []
+    folders = {}
+    pending = [str(searchpath)]
+
+    while pending:
+        folder = pending.pop()
+
+        # Adding or removing a file or subfolder changes the modification
+        # time of a folder, but changes further down do not, so the
+        # subfolders are still searched in either case. Folders that
+        # cannot be read, or were removed during the search, are skipped.
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+            record = index.get(folder)
+            if record is not None and record['mtime'] == mtime:
+                is_project = record['project']
+                subfolders = record['subfolders']
+            else:
+                is_project, subfolders = scan_folder(folder, project_file)
+        except OSError:
+            continue
+
+        folders[folder] = {'mtime':mtime,
+                           'project':is_project,
+                           'subfolders':subfolders}
+
+        if is_project:
+            projects.append(common.Path(folder))
+            continue
+
+        pending.extend(os.path.join(folder, subfolder)
+                       for subfolder in reversed(subfolders)
+                       if subfolder not in prune)
+
+    return projects, folders
+
+
 def make_project_list(searchpath):
     '''Build a list of all OmegaT projects in the search path.
        
 
     The list excludes duplicate data in the ".repositories" folder
-    of team projects
+    of team projects, which is found inside the project itself,
+    and any other folders to prune set in the configuration file.
     '''
 
     PROJECT = project_settings['project_file']
+    index_file = project_settings['discovery_index']
 
-    # In team projects, the '.repositories' subfolder is two levels
-    # above the 'omegat.project' file, hence the need for two 'parent'
-    # attributes.
-    projects = [omt.parent for omt in searchpath.rglob(PROJECT)
-                if not omt.parent.parent.stem == '.repositories']
+    with common.profile_stage('make_project_list') as stage:
+        if index_file is None:
+            projects, _ = find_projects(searchpath, PROJECT,
+                                        project_settings['prune'])
+        else:
+            index = load_discovery_index(index_file, PROJECT)
+            projects, folders = find_projects(searchpath, PROJECT,
+                                              project_settings['prune'], index)
+            save_discovery_index(index_file, PROJECT, folders)
+        stage.items = len(projects)
                     
     return projects
 
@@ -95,15 +245,31 @@ def collate_project_data(projects):
     return project_data
 
 
-def copy_project_data(project_data):
+def copy_project_data(project_data, destination=None):
     '''Create a subfolder for each project in the destination folder.
        
     Copy the corresponding memory and glossary files there, and
-    rename them to match the project name.
+    rename them to match the project name. The user is asked for
+    the destination folder if none was passed.
     '''
 
-    title = 'Select destination folder'
-    destination = common.select_folder(projects_path, title)
+    if destination is None:
+        title = 'Select destination folder'
+        destination = common.select_folder(projects_path, title)
+
+    if project_settings['store']:
+        with common.profile_stage('store_project_data') as stage:
+            summary = store_project_data(project_data, destination,
+                                         project_settings['workers'])
+            stage.items = sum(totals['files'] for totals in summary.values())
+        return
+
+    if project_settings['sync']:
+        with common.profile_stage('sync_project_data') as stage:
+            summary = sync_project_data(project_data, destination,
+                                        project_settings['workers'])
+            stage.items = sum(totals['files'] for totals in summary.values())
+        return
        
     for name, data in project_data.items():
 
@@ -116,18 +282,254 @@ def copy_project_data(project_data):
             # Make sure the file is valid, give it the same name as the
             # project, and keep its original extension.
             if data_file.exists():
-                new_file = common.Path(project_folder, name+data_file.suffix)
+                new_file = common.add_compression_suffix(
+                    common.Path(project_folder, name+data_file.suffix))
                 print('Copying '+str(data_file)+' to '+' '+str(new_file))
-                shutil.copy(data_file, new_file)
+                with common.profile_stage('copy_project_data', 1):
+                    copy_file(data_file, new_file)
+
+
+def list_copy_jobs(project_data, destination):
+    '''Pair each existing project file with its destination file.'''
+
+    jobs = []
+    for name, data in project_data.items():
+        project_folder = common.Path(destination/name)
+
+        for data_file in data:
+            if data_file.exists():
+                new_file = common.add_compression_suffix(
+                    common.Path(project_folder, name+data_file.suffix))
+                jobs.append((data_file, new_file))
+
+    return jobs
+
+
+def copy_file(data_file, new_file, compression=None):
+    '''Copy a file, compressing it if the destination name has a
+    compression suffix, or with the compression suffix passed.
+
+    The modification time is preserved, as with shutil.copy2.
+    '''
+
+    if compression is None:
+        compression = common.get_compression_suffix(new_file)
+    if not compression:
+        shutil.copy2(data_file, new_file)
+        return
+
+    with open(data_file, 'rb') as df, \
+         common.open_file(new_file, 'wb', compression=compression) as nf:
+        shutil.copyfileobj(df, nf, common.IO_BUFFER_SIZE)
+    shutil.copystat(data_file, new_file)
+
+
+def is_up_to_date(data_file, new_file):
+    '''Check whether the destination file already matches the original.
 
-if __name__ == '__main__':    
+    Files of the same size are considered identical if they have the
+    same modification time, or failing that, the same contents, in
+    which case the copy is given the modification time of the original
+    for the next runs. The size of compressed copies differs from that
+    of the original, so they are only compared by modification time.
+    '''
+
+    if not new_file.exists():
+        return False
+
+    data_stat = data_file.stat()
+    new_stat = new_file.stat()
+
+    if common.is_compressed(new_file):
+        return data_stat.st_mtime_ns == new_stat.st_mtime_ns
+
+    if data_stat.st_size != new_stat.st_size:
+        return False
+    if data_stat.st_mtime_ns == new_stat.st_mtime_ns:
+        return True
+    if common.hash_file(data_file) != common.hash_file(new_file):
+        return False
+
+    # Give the copy the modification time of the original, so that
+    # later runs do not have to compare the contents again.
+    try:
+        os.utime(new_file, ns=(data_stat.st_atime_ns, data_stat.st_mtime_ns))
+    except OSError:
+        pass
+
+    return True
+
+
+def copy_atomically(data_file, new_file):
+    '''Copy a file through a temporary file renamed once complete.
+
+    The destination file is therefore never left half-written if the
+    copy is interrupted. The modification time is preserved so that
+    later runs can recognize the file as up to date.
+    '''
+
+    new_file.parent.mkdir(parents=True, exist_ok=True)
+    handle, temp_name = tempfile.mkstemp(prefix='.'+new_file.name,
+                                         suffix='.tmp', dir=new_file.parent)
+    os.close(handle)
+
+    try:
+        copy_file(data_file, temp_name,
+                  common.get_compression_suffix(new_file))
+        os.replace(temp_name, new_file)
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+
+def sync_file(data_file, new_file):
+    '''Copy a file unless the destination is already up to date.
+
+    Returns whether the file was copied or skipped, and its size.
+    '''
+
+    size = data_file.stat().st_size
+
+    if is_up_to_date(data_file, new_file):
+        return ('skipped', size)
+
+    copy_atomically(data_file, new_file)
+
+    return ('copied', size)
+
+
+def get_file_size(data_file):
+    '''Return the size of a file, or 0 if it cannot be read.'''
+
+    try:
+        return data_file.stat().st_size
+    except OSError:
+        return 0
+
+
+def sync_project_data(project_data, destination, workers):
+    '''Copy only the memory and glossary files that changed.
+
+    The files are checked and copied by a pool of threads, and a summary
+    of the files and bytes copied, skipped and failed is printed once
+    all the files have been processed.
+    '''
+
+    jobs = list_copy_jobs(project_data, destination)
+    summary = {status:{'files':0, 'bytes':0}
+               for status in ('copied', 'skipped', 'failed')}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(sync_file, data_file, new_file):
+                   (data_file, new_file) for data_file, new_file in jobs}
+
+        for future in as_completed(futures):
+            data_file, new_file = futures[future]
+            try:
+                status, size = future.result()
+            except OSError as error:
+                status, size = ('failed', get_file_size(data_file))
+                print('Failed to copy '+str(data_file)+': '+str(error))
+            else:
+                if status == 'copied':
+                    print('Copied '+str(data_file)+' to '+str(new_file))
+
+            summary[status]['files'] += 1
+            summary[status]['bytes'] += size
+
+    for status, totals in summary.items():
+        print(f"{status.capitalize()}: {totals['files']} files, "
+              f"{totals['bytes']} bytes")
+
+    return summary
+
+
+def store_project_data(project_data, destination, workers, store=None,
+                       update=False):
+    '''Add the memory and glossary files to a snapshot store.
+
+    Each different file is only stored once, and the run is recorded
+    in a manifest with the usual names of the copied files. A summary
+    of the files stored, linked and skipped is printed once all the
+    files have been processed. With update enabled, the files of the
+    projects given replace theirs in the last run added to the store
+    given, and the other projects are kept as they were.
+    '''
+
+    # The store compresses the files itself, so the names recorded
+    # never have a compression suffix.
+    if store is None:
+        store = SnapshotStore(destination, project_settings['compression'],
+                              project_settings['level'])
+    jobs = [(data_file, common.strip_compression_suffix(new_file)
+                        .relative_to(destination).as_posix())
+            for data_file, new_file in list_copy_jobs(project_data,
+                                                      destination)]
+
+    run, summary = store.add_run(jobs, workers, update)
+
+    print(f'Recorded run {run} in {destination}')
+    for status, totals in summary.items():
+        print(f"{status.capitalize()}: {totals['files']} files, "
+              f"{totals['bytes']} bytes")
+
+    return summary
+
+
+def parse_arguments(args=None):
+    '''Read the command line arguments.'''
+
+    parser = argparse.ArgumentParser(description='Copy the memory and '
+                                                 'glossary files of OmegaT '
+                                                 'projects to another folder.')
+    parser.add_argument('searchpath', type=common.Path, nargs='?',
+                        help='folder to search for OmegaT projects')
+    parser.add_argument('destination', type=common.Path, nargs='?',
+                        help='folder to copy the project data to')
+    parser.add_argument('--config', type=common.Path,
+                        help='configuration file to use')
+    parser.add_argument('--sync', action='store_true', default=None,
+                        help='only copy the files that changed')
+    parser.add_argument('--store', action='store_true', default=None,
+                        help='add the files to a snapshot store in the '
+                             'destination folder')
+    parser.add_argument('--workers', type=int,
+                        help='number of threads used to sync the files')
+    common.add_profile_arguments(parser)
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    '''Collect the project data, asking for any folder not passed.'''
+
+    global project_settings, projects_path
+
+    arguments = parse_arguments(args)
+    common.start_profiling(arguments)
+    if arguments.config is not None:
+        common.load_config(arguments.config)
 
     # Retrieve configuration information for OmegaT projects
     project_settings = get_project_settings()
-    
-    askfolder = 'Select the folder to search for OmegaT projects'
-    projects_path = common.select_folder(set_projects_path(), askfolder)
-                         
+    if arguments.sync is not None:
+        project_settings['sync'] = arguments.sync
+    if arguments.store is not None:
+        project_settings['store'] = arguments.store
+    if arguments.workers is not None:
+        project_settings['workers'] = common.normalize_workers(
+            arguments.workers)
+
+    if arguments.searchpath is None:
+        askfolder = 'Select the folder to search for OmegaT projects'
+        projects_path = common.select_folder(set_projects_path(), askfolder)
+    else:
+        projects_path = arguments.searchpath
+
     projects = make_project_list(projects_path)
     project_data = collate_project_data(projects)
-    copy_project_data(project_data)
+    copy_project_data(project_data, arguments.destination)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,66 @@
 # -*- coding: utf-8 -*-
 
-'''Module that defines file-related dialogs used across scripts.'''
+'''Module that defines file-related dialogs used across scripts.
 
-import tkinter as tk
-from tkinter import filedialog
+The configuration file is only read the first time "common.config" is
+used, and tkinter is only imported when a dialog is actually shown, so
+that the scripts start quickly and can run on machines without a display
+when every path is passed on the command line.
+
+Files are read and written through "open_file", which decompresses or
+compresses them transparently according to the suffix of their name, so
+that every script can work on "project_save.tmx.gz" as on the plain file.
+
+The module also records the time and memory used by each stage of a run
+when profiling is enabled, with the --profile option of the scripts or
+the OMEGAT_TOOLS_PROFILE environment variable. The scripts mark their
+stages with "profile_stage", which does nothing when profiling is off.
+'''
+
+import atexit
+import bz2
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import os
+import sys
+import time
+from datetime import datetime, timezone
 from pathlib import Path
 from configparser import ConfigParser
 
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the peak RSS is not recorded.
+    resource = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # Constants
-CONFIGFILE = Path('./config/omegat-tools.conf')
+CONFIGFILE = Path(__file__).parent/'config'/'omegat-tools.conf'
 USER_HOME = Path.home()
 DEFAULT_DOCHOME = Path(USER_HOME/'Documents')
+HASH_BLOCK_SIZE = 1024 * 1024
+IO_BUFFER_SIZE = 1024 * 1024
+COMPRESSION_SUFFIXES = ('.gz', '.bz2', '.xz', '.zst')
+DEFAULT_LEVELS = {'.gz':6, '.bz2':9, '.xz':6, '.zst':3}
+PROFILE_VARIABLE = 'OMEGAT_TOOLS_PROFILE'
+CPROFILE_VARIABLE = 'OMEGAT_TOOLS_CPROFILE'
+
+# Configuration and dialog root window, created on first use
+config_file = CONFIGFILE
+_config = None
+_root_window = None
+
+# Profiler of the current run, if profiling is enabled
+_profiler = None
+
 
 def read_config(configfile):
     '''Load the configuration file'''
@@ -22,6 +72,43 @@ def read_config(configfile):
     return parser
 
 
+def load_config(configfile=None):
+    '''Read the configuration file used by the scripts.
+
+    The default configuration file is used unless another file is
+    passed, and the settings read replace any that were loaded before.
+    The file read is kept in "config_file", so that worker processes
+    can load the same settings.
+    '''
+
+    global _config, config_file
+
+    if configfile is None:
+        configfile = CONFIGFILE
+    _config = read_config(configfile)
+    config_file = configfile
+
+    return _config
+
+
+def get_config():
+    '''Return the configuration, reading it the first time.'''
+
+    if _config is None:
+        load_config()
+
+    return _config
+
+
+def __getattr__(name):
+    '''Load the configuration the first time it is needed.'''
+
+    if name == 'config':
+        return get_config()
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
 def set_basepath(configpath):
     '''Define the default starting path for documents.
        
@@ -47,17 +134,193 @@ def set_basepath(configpath):
     return basepath
 
 
+def is_inside(path, folder):
+    '''Check whether a path is in a folder or its subfolders.'''
+
+    try:
+        Path(path).relative_to(folder)
+    except ValueError:
+        return False
+
+    return True
+
+
+def normalize_workers(workers):
+    '''Use every available core unless a positive number of workers
+    is set.'''
+
+    if workers is None or workers < 1:
+        return os.cpu_count() or 1
+
+    return workers
+
+
+def hash_file(filepath):
+    '''Compute a hash of the contents of a file.'''
+
+    filehash = hashlib.blake2b(digest_size=20)
+
+    with open(filepath, 'rb') as hf:
+        for block in iter(lambda: hf.read(HASH_BLOCK_SIZE), b''):
+            filehash.update(block)
+
+    return filehash.hexdigest()
+
+
+def get_compression_suffix(path):
+    '''Return the compression suffix of a file name, or "" if none.'''
+
+    suffix = Path(path).suffix.lower()
+
+    return suffix if suffix in COMPRESSION_SUFFIXES else ''
+
+
+def is_compressed(path):
+    '''Check whether a file is compressed, according to its name.'''
+
+    return get_compression_suffix(path) != ''
+
+
+def strip_compression_suffix(path):
+    '''Remove the compression suffix, if any, from a file name.
+
+    The suffix left is the one of the data, such as ".tmx" for
+    "project_save.tmx.gz".
+    '''
+
+    path = Path(path)
+
+    return path.with_suffix('') if is_compressed(path) else path
+
+
+def get_output_compression():
+    '''Read the compression suffix of the output files from the
+    configuration file, or "" if they are not compressed.'''
+
+    compression = get_config().get('Files', 'compression', fallback='none')
+    compression = compression.strip().lower().lstrip('.')
+    if compression in ('', 'none'):
+        return ''
+
+    suffix = '.' + compression
+    if suffix not in COMPRESSION_SUFFIXES:
+        raise ValueError(f'Unknown compression "{compression}"')
+
+    return suffix
+
+
+def add_compression_suffix(path):
+    '''Add the compression suffix set in the configuration file to the
+    name of an output file, unless it already has one.'''
+
+    path = Path(path)
+    if is_compressed(path):
+        return path
+
+    return path.with_name(path.name + get_output_compression())
+
+
+def get_compression_level(suffix):
+    '''Return the compression level to use for a compression suffix.
+
+    The level set in the configuration file only applies to the
+    compression set there, since each one has its own range of levels.
+    '''
+
+    if (suffix == get_output_compression()
+            and get_config().has_option('Files', 'compression_level')):
+        return get_config().getint('Files', 'compression_level')
+
+    return DEFAULT_LEVELS[suffix]
+
+
+def open_compressed(path, mode, suffix, level=None):
+    '''Open the binary stream of a compressed file.
+
+    The level is only used when writing.
+    '''
+
+    if suffix == '.zst' and zstandard is None:
+        raise RuntimeError(f'The zstandard module is needed for {path}')
+
+    if 'r' in mode:
+        if suffix == '.gz':
+            return gzip.GzipFile(path, mode)
+        if suffix == '.bz2':
+            return bz2.BZ2File(path, mode)
+        if suffix == '.xz':
+            return lzma.LZMAFile(path, mode)
+        return zstandard.ZstdDecompressor().stream_reader(open(path, mode),
+                                                          closefd=True)
+
+    if suffix == '.gz':
+        return gzip.GzipFile(path, mode, compresslevel=level)
+    if suffix == '.bz2':
+        return bz2.BZ2File(path, mode, compresslevel=level)
+    if suffix == '.xz':
+        return lzma.LZMAFile(path, mode, preset=level)
+    return zstandard.ZstdCompressor(level=level).stream_writer(
+        open(path, mode), closefd=True)
+
+
+def open_file(path, mode='rb', level=None, encoding=None, errors=None,
+              newline=None, compression=None):
+    '''Open a file, decompressing or compressing it on the fly.
+
+    The compression is chosen by the suffix of the file name (.gz, .bz2,
+    .xz or .zst) unless a compression suffix, or "" for none, is passed.
+    The data is read and written in large blocks, and never through a
+    temporary file, so that lxml and csv can parse it straight from the
+    decompressor. The mode and text arguments are those of "open".
+    '''
+
+    if compression is None:
+        compression = get_compression_suffix(path)
+    if not compression:
+        return open(path, mode, buffering=IO_BUFFER_SIZE, encoding=encoding,
+                    errors=errors, newline=newline)
+
+    binary_mode = mode.replace('t', '').replace('b', '') + 'b'
+    if level is None and 'r' not in mode:
+        level = get_compression_level(compression)
+
+    stream = open_compressed(path, binary_mode, compression, level)
+    if 'r' in mode:
+        stream = io.BufferedReader(stream, IO_BUFFER_SIZE)
+    else:
+        stream = io.BufferedWriter(stream, IO_BUFFER_SIZE)
+
+    if 'b' in mode:
+        return stream
+
+    return io.TextIOWrapper(stream, encoding=encoding, errors=errors,
+                            newline=newline)
+
+
 def set_root_window():
-    '''Define a root window file dialog.'''
-    
-    rootWin = tk.Tk()
-    rootWin.attributes('-topmost', True)
-    rootWin.withdraw()
+    '''Define a root window file dialog.
+
+    The window is only created for the first dialog, and then reused
+    by all the dialogs that follow.
+    '''
+
+    global _root_window
+
+    if _root_window is None:
+        import tkinter as tk
+
+        _root_window = tk.Tk()
+        _root_window.attributes('-topmost', True)
+        _root_window.withdraw()
+
+    return _root_window
 
 
 def select_folder(basepath, title):
     '''Ask user to choose a folder.'''
 
+    from tkinter import filedialog
+
     set_root_window()
     selected_folder = Path(filedialog.askdirectory(initialdir=basepath,
                                                    title=title))
@@ -68,6 +331,8 @@ def select_folder(basepath, title):
 def select_file(basepath, filetype, title):
     '''Ask the user to select a single file'''
 
+    from tkinter import filedialog
+
     set_root_window()
     selected_file = Path(filedialog.askopenfilename(initialdir=basepath,
                                                     filetypes=filetype,
@@ -79,6 +344,8 @@ def select_file(basepath, filetype, title):
 def get_save_file_name(basepath, filetypes, title):
     '''Ask for the name of the file to save.'''
 
+    from tkinter import filedialog
+
     set_root_window()
     save_file_name = Path(filedialog.asksaveasfilename(initialdir=basepath,
                           filetypes = filetypes, title=title))
@@ -86,4 +353,239 @@ def get_save_file_name(basepath, filetypes, title):
     return save_file_name
 
 
-config = read_config(CONFIGFILE)
\ No newline at end of file
+def get_peak_rss():
+    '''Return the peak resident set size of the process in bytes.'''
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, but macOS reports bytes.
+    if sys.platform != 'darwin':
+        peak *= 1024
+
+    return peak
+
+
+class Stage():
+    '''Class for a single stage of a profiled run.
+
+    Set the "items" attribute within the stage to record the number of
+    items processed, from which the throughput is computed.
+    '''
+
+    def __init__(self, profiler, name, items=None):
+        self.profiler = profiler
+        self.name = name
+        self.items = items
+        self.child_peak = 0
+        self.start_memory = 0
+        self.start_peak = 0
+
+
+    def __enter__(self):
+        self.profiler.enter_stage(self)
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.profiler.exit_stage(self)
+
+
+class NullStage():
+    '''Stand-in for a stage when profiling is disabled.'''
+
+    items = None
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+    def __setattr__(self, name, value):
+        # Nothing is recorded, so the number of items is ignored.
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+class Profiler():
+    '''Class for the time and memory measurements of a run.
+
+    Each stage records its wall time, the number of items processed,
+    the peak memory allocated by Python during the stage (traced with
+    tracemalloc) and the peak resident set size of the process at the
+    end of the stage. Stages with the same name, such as the reading of
+    each file, are added up. Stages can be nested, and the peak memory
+    of a stage includes that of the stages within it.
+
+    Stages that run in worker processes are not recorded, so the stages
+    are marked around the work given to the workers.
+
+    Before Python 3.9, tracemalloc cannot reset its peak, so the peak of
+    a stage is only known when it is the highest of the run so far.
+    Otherwise, the highest memory in use at the start and end of the
+    stage and of the stages within it is recorded instead.
+    '''
+
+    def __init__(self, report_file, cprofile_file=None):
+        '''Start measuring the run.'''
+
+        import tracemalloc
+
+        self.report_file = Path(report_file)
+        self.cprofile_file = cprofile_file
+        self.tracemalloc = tracemalloc
+        self.stages = {}
+        self.active = []
+        self.started = datetime.now(timezone.utc)
+        self.start_time = time.perf_counter()
+
+        tracemalloc.start()
+
+        self.cprofile = None
+        if cprofile_file is not None:
+            import cProfile
+
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+
+    def get_stage_peak(self, stage):
+        '''Return the peak memory allocated since a stage started.'''
+
+        current, peak = self.tracemalloc.get_traced_memory()
+        if not hasattr(self.tracemalloc, 'reset_peak') and \
+           peak <= stage.start_peak:
+            return max(stage.start_memory, current)
+
+        return peak
+
+
+    def enter_stage(self, stage):
+        '''Start measuring a stage.'''
+
+        # The peak memory is reset for each stage, so the peak so far
+        # is kept with the enclosing stage first.
+        if self.active:
+            parent = self.active[-1]
+            parent.child_peak = max(parent.child_peak,
+                                    self.get_stage_peak(parent))
+
+        if hasattr(self.tracemalloc, 'reset_peak'):
+            self.tracemalloc.reset_peak()
+        stage.start_memory, stage.start_peak = \
+            self.tracemalloc.get_traced_memory()
+        self.active.append(stage)
+        stage.start_time = time.perf_counter()
+
+
+    def exit_stage(self, stage):
+        '''Record the measurements of a stage.'''
+
+        elapsed = time.perf_counter() - stage.start_time
+        peak = max(stage.child_peak, self.get_stage_peak(stage))
+        self.active.pop()
+
+        if self.active:
+            parent = self.active[-1]
+            parent.child_peak = max(parent.child_peak, peak)
+
+        record = self.stages.setdefault(stage.name, {'calls':0,
+                                                     'wall_time':0.0,
+                                                     'items':None,
+                                                     'peak_memory':0})
+        record['calls'] += 1
+        record['wall_time'] += elapsed
+        record['peak_memory'] = max(record['peak_memory'], peak)
+        record['peak_rss'] = get_peak_rss()
+
+        if stage.items is not None:
+            record['items'] = (record['items'] or 0) + stage.items
+
+
+    def report(self):
+        '''Gather the measurements of the run.'''
+
+        stages = []
+        for name, record in self.stages.items():
+            stage = dict(name=name, **record)
+            stage['throughput'] = None
+            if record['items'] is not None and record['wall_time'] > 0:
+                stage['throughput'] = record['items'] / record['wall_time']
+            stages.append(stage)
+
+        return {'command':sys.argv,
+                'started':self.started.isoformat(),
+                'wall_time':time.perf_counter() - self.start_time,
+                'peak_memory':self.tracemalloc.get_traced_memory()[1],
+                'peak_rss':get_peak_rss(),
+                'stages':stages}
+
+
+    def save(self):
+        '''Save the report, and the cProfile statistics if enabled.'''
+
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.cprofile_file)
+
+        with open(self.report_file, 'w', encoding='utf-8') as rf:
+            json.dump(self.report(), rf, indent=2)
+
+        self.tracemalloc.stop()
+
+
+def enable_profiling(report_file, cprofile_file=None):
+    '''Start profiling the run, and save the report when it ends.'''
+
+    global _profiler
+
+    if _profiler is None:
+        _profiler = Profiler(report_file, cprofile_file)
+        atexit.register(_profiler.save)
+
+    return _profiler
+
+
+def profile_stage(name, items=None):
+    '''Mark a stage of the run to be measured when profiling.
+
+    Use the result as a context manager around the stage:
+
+        with common.profile_stage('parse') as stage:
+            ...
+            stage.items = count
+    '''
+
+    if _profiler is None:
+        return NULL_STAGE
+
+    return Stage(_profiler, name, items)
+
+
+def add_profile_arguments(parser):
+    '''Add the profiling options to the arguments of a script.'''
+
+    parser.add_argument('--profile', type=Path, metavar='REPORT',
+                        default=os.environ.get(PROFILE_VARIABLE),
+                        help='save the time and memory used by each stage '
+                             'to a JSON file')
+    parser.add_argument('--cprofile', type=Path, metavar='STATS',
+                        default=os.environ.get(CPROFILE_VARIABLE),
+                        help='also save cProfile statistics to a file')
+
+
+def start_profiling(arguments):
+    '''Enable profiling if it was requested on the command line.'''
+
+    if arguments.cprofile is not None and arguments.profile is None:
+        raise SystemExit('The --cprofile option needs a --profile report '
+                         'file as well.')
+    if arguments.profile is not None:
+        enable_profiling(arguments.profile, arguments.cprofile)
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+'''Search previous translations in a folder of collected TMX files.
+
+This script reads every TMX file in a folder (typically the destination
+folder of the "collect_omegat_project_data" script) once, and builds a
+persistent index of the source and target segments in a SQLite database.
+The index is made of character trigrams, so that any part of a segment
+can be found, whether or not the language separates words with spaces.
+
+Updating the index only reads the TMX files that were added or changed
+since the last update, and removes the segments of files that no longer
+exist. Searching the index returns the matching segments along with the
+project, translator and date of each translation.
+
+Searches of at least three characters use the trigram index. Shorter
+searches, such as the many two-character terms of Chinese and Japanese,
+use a second index of the single characters and pairs of characters of
+each segment, so that they do not go through all the segments either.
+
+Usage examples:
+
+    python concordance.py update /path/to/collected/projects
+    python concordance.py search "translation memory"
+    python concordance.py search --target 翻訳メモリ --limit 50
+
+Requires:
+  - Python 3.7 or higher
+  - lxml
+  - SQLite 3.34 or higher with FTS5 (included with most Python versions)
+'''
+
+###########################################################################
+#
+# TMX Concordance
+# ---------------------------
+# Version 0.1
+# License: GPL3+
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+###########################################################################
+
+import argparse
+import sqlite3
+
+import common
+from tmxhelpers import find_tmx_files, iter_translations
+
+# Constants
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files
+    (id INTEGER PRIMARY KEY,
+     path TEXT UNIQUE,
+     project TEXT,
+     size INTEGER,
+     mtime INTEGER);
+CREATE TABLE IF NOT EXISTS segments
+    (id INTEGER PRIMARY KEY,
+     file_id INTEGER,
+     source TEXT,
+     target TEXT,
+     translator TEXT,
+     date TEXT);
+CREATE INDEX IF NOT EXISTS file_segments ON segments(file_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS segment_index
+    USING fts5(source, target, content='segments', content_rowid='id',
+               tokenize='trigram');
+CREATE VIRTUAL TABLE IF NOT EXISTS short_index
+    USING fts5(source, target, content='', tokenize='ascii');
+'''
+MEMORY_NAME = 'project_save.tmx'
+BATCH_SIZE = 10000
+MIN_INDEXED_LENGTH = 3
+
+
+def get_index_file():
+    '''Read the path of the concordance index from the configuration file.'''
+
+    if common.config.has_option('Paths', 'concordance'):
+        return common.Path(common.config['Paths']['concordance'])
+
+    return None
+
+
+def get_short_grams(text):
+    '''List the characters and pairs of characters of a text as tokens.
+
+    Each character is written as six hexadecimal digits, so that the
+    tokens of single characters and pairs are plain ASCII words of 6
+    and 12 characters. The text is lowercased, since the trigram index
+    is not case sensitive either.
+    '''
+
+    if not text:
+        return ''
+
+    codes = [format(ord(character), '06x') for character in text.lower()]
+    grams = set(codes)
+    grams.update(first + second for first, second in zip(codes, codes[1:]))
+
+    return ' '.join(sorted(grams))
+
+
+def open_index(index_file):
+    '''Open the concordance index, creating it if necessary.
+
+    The index of short searches is filled from the segments already
+    indexed when it is added to an index created without it.
+    '''
+
+    connection = sqlite3.connect(index_file)
+    connection.create_function('short_grams', 1, get_short_grams)
+
+    has_short_index = connection.execute('''SELECT count(*) FROM sqlite_master
+                                            WHERE name = 'short_index'
+                                         ''').fetchone()[0]
+    connection.executescript(SCHEMA)
+
+    if not has_short_index:
+        connection.execute('''INSERT INTO short_index (rowid, source, target)
+                              SELECT id, short_grams(source),
+                                     short_grams(target)
+                              FROM segments''')
+        connection.commit()
+
+    return connection
+
+
+def get_project_name(tmxfile):
+    '''Identify the project a TMX file comes from.
+
+    Collected memories are named after their project, but memories
+    still in their project are found in its "omegat" subfolder.
+    '''
+
+    tmxfile = common.strip_compression_suffix(tmxfile)
+    if tmxfile.name == MEMORY_NAME:
+        return tmxfile.parent.parent.name
+
+    return tmxfile.stem
+
+
+def read_segments(tmxfile):
+    '''Stream the source and target segments of a TMX file.
+
+    Yields the source, target, translator and date of each translation.
+    '''
+
+    for source, target, translation in iter_translations(tmxfile):
+        yield (source, target,
+               translation.get('changeid', translation.get('creationid')),
+               translation.get('changedate', translation.get('creationdate')))
+
+
+def remove_file(connection, file_id):
+    '''Remove the segments of a TMX file from the index.'''
+
+    # The index only refers to the segments table, so each segment
+    # has to be removed from the index with its original contents.
+    connection.execute('''INSERT INTO segment_index
+                          (segment_index, rowid, source, target)
+                          SELECT 'delete', id, source, target
+                          FROM segments WHERE file_id = ?''', (file_id,))
+    connection.execute('''INSERT INTO short_index
+                          (short_index, rowid, source, target)
+                          SELECT 'delete', id, short_grams(source),
+                                 short_grams(target)
+                          FROM segments WHERE file_id = ?''', (file_id,))
+    connection.execute('DELETE FROM segments WHERE file_id = ?', (file_id,))
+    connection.execute('DELETE FROM files WHERE id = ?', (file_id,))
+
+
+def add_file(connection, tmxfile):
+    '''Read the segments of a TMX file and add them to the index.'''
+
+    stat = tmxfile.stat()
+    cursor = connection.execute('''INSERT INTO files
+                                   (path, project, size, mtime)
+                                   VALUES (?, ?, ?, ?)''',
+                                (str(tmxfile), get_project_name(tmxfile),
+                                 stat.st_size, stat.st_mtime_ns))
+    file_id = cursor.lastrowid
+
+    first_id = connection.execute('''SELECT coalesce(max(id), 0) + 1
+                                     FROM segments''').fetchone()[0]
+
+    batch = []
+    for segment in read_segments(tmxfile):
+        batch.append((file_id,) + segment)
+        if len(batch) >= BATCH_SIZE:
+            connection.executemany('''INSERT INTO segments
+                                      (file_id, source, target, translator,
+                                       date)
+                                      VALUES (?, ?, ?, ?, ?)''', batch)
+            batch = []
+
+    if batch:
+        connection.executemany('''INSERT INTO segments
+                                  (file_id, source, target, translator, date)
+                                  VALUES (?, ?, ?, ?, ?)''', batch)
+
+    # Index all the new segments at once.
+    connection.execute('''INSERT INTO segment_index (rowid, source, target)
+                          SELECT id, source, target FROM segments
+                          WHERE id >= ? AND file_id = ?''',
+                       (first_id, file_id))
+    connection.execute('''INSERT INTO short_index (rowid, source, target)
+                          SELECT id, short_grams(source), short_grams(target)
+                          FROM segments
+                          WHERE id >= ? AND file_id = ?''',
+                       (first_id, file_id))
+
+
+def update_index(connection, tmxpath):
+    '''Bring the index up to date with the TMX files in a folder.
+
+    Plain and compressed TMX files are indexed under their absolute
+    path. Files whose size and modification time have not changed are
+    left as they are, and files that no longer exist are removed.
+
+    Returns the number of files read and removed.
+    '''
+
+    searchroot = common.Path(tmxpath).resolve()
+    tmxfiles = find_tmx_files([searchroot])
+    records = {path:(file_id, size, mtime) for file_id, path, size, mtime
+               in connection.execute('SELECT id, path, size, mtime FROM files')}
+
+    read = 0
+    for tmxfile in tmxfiles:
+        stat = tmxfile.stat()
+        record = records.pop(str(tmxfile), None)
+
+        if record is not None:
+            if record[1:] == (stat.st_size, stat.st_mtime_ns):
+                continue
+            remove_file(connection, record[0])
+
+        print('Indexing '+str(tmxfile))
+        add_file(connection, tmxfile)
+        connection.commit()
+        read += 1
+
+    # The remaining records are files that were not found.
+    removed = 0
+    for path, record in records.items():
+        if common.is_inside(path, searchroot):
+            remove_file(connection, record[0])
+            removed += 1
+
+    connection.commit()
+
+    return read, removed
+
+
+def search_index(connection, text, column='source', limit=20):
+    '''Find the segments containing the text in the source or target.
+
+    Returns the project, translator, date, source and target of each
+    matching translation, most recent first.
+    '''
+
+    columns = '''files.project, segments.translator, segments.date,
+                 segments.source, segments.target'''
+
+    if not text:
+        return []
+
+    if len(text) >= MIN_INDEXED_LENGTH:
+        # Search the text as a phrase in a single column of the index.
+        phrase = '"' + text.replace('"', '""') + '"'
+        query = f'''SELECT {columns}
+                    FROM segment_index
+                    JOIN segments ON segments.id = segment_index.rowid
+                    JOIN files ON files.id = segments.file_id
+                    WHERE segment_index MATCH ?
+                    ORDER BY segments.date DESC
+                    LIMIT ?'''
+        parameters = (f'{column} : {phrase}', limit)
+    else:
+        # Text too short for the trigram index, so look up the token
+        # of the character or pair of characters in the short index.
+        token = ''.join(format(ord(character), '06x')
+                        for character in text.lower())
+        query = f'''SELECT {columns}
+                    FROM short_index
+                    JOIN segments ON segments.id = short_index.rowid
+                    JOIN files ON files.id = segments.file_id
+                    WHERE short_index MATCH ?
+                    ORDER BY segments.date DESC
+                    LIMIT ?'''
+        parameters = (f'{column} : {token}', limit)
+
+    return connection.execute(query, parameters).fetchall()
+
+
+def parse_arguments():
+    '''Read the command line arguments.'''
+
+    parser = argparse.ArgumentParser(description='Search previous '
+                                                 'translations in TMX files.')
+    parser.add_argument('--index', type=common.Path,
+                        help='concordance index file (default: set in the '
+                             'configuration file)')
+    parser.add_argument('--config', type=common.Path,
+                        help='configuration file to use')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    update = commands.add_parser('update', help='update the index')
+    update.add_argument('tmxpath', type=common.Path,
+                        help='folder containing the TMX files')
+
+    search = commands.add_parser('search', help='search the index')
+    search.add_argument('text', help='text to search')
+    search.add_argument('--target', action='store_const', const='target',
+                        default='source', dest='column',
+                        help='search the target segments')
+    search.add_argument('--limit', type=int, default=20,
+                        help='maximum number of results')
+
+    common.add_profile_arguments(parser)
+
+    arguments = parser.parse_args()
+    if arguments.config is not None:
+        common.load_config(arguments.config)
+    if arguments.index is None:
+        arguments.index = get_index_file()
+    if arguments.index is None:
+        parser.error('no index set in the configuration file, use --index')
+
+    return arguments
+
+
+if __name__ == '__main__':
+
+    arguments = parse_arguments()
+    common.start_profiling(arguments)
+    connection = open_index(arguments.index)
+
+    if arguments.command == 'update':
+        with common.profile_stage('update_index') as stage:
+            read, removed = update_index(connection, arguments.tmxpath)
+            stage.items = read
+        print(f'{read} files indexed, {removed} files removed')
+
+    else:
+        with common.profile_stage('search_index') as stage:
+            results = search_index(connection, arguments.text,
+                                   arguments.column, arguments.limit)
+            stage.items = len(results)
+        for project, translator, date, source, target in results:
+            print(f'{project}\t{translator}\t{date}\n'
+                  f'  {source}\n  {target}')
+
+    connection.close()
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+'''Merge many TMX files into a single memory without duplicates.
+
+This script is meant for the memories gathered by the
+"collect_omegat_project_data" script, which often overlap a great deal.
+Every input TMX file is read as a stream, and each translation unit is
+identified by a hash of its source and target languages, its normalized
+source text and, for alternative translations, its context (file, id,
+previous and next segment), so that memories in different language pairs
+can be consolidated together without mixing their translations.
+
+When several translation units share the same hash, whether identical or
+conflicting translations of the same source, only the most recent one
+according to its change date is kept. The target text is left out of the
+hash on purpose: with it, two different translations of the same source
+would never be compared, and both would end up in the consolidated memory
+as conflicting entries. Leaving it out removes the exact duplicates and
+resolves the conflicts in the same pass. With the --keep-conflicts option,
+the normalized target text is added to the hash, so that only identical
+translations are merged and every different translation of a source is
+kept.
+
+The hashes are kept in a temporary SQLite database rather than in memory,
+and the consolidated TMX file is written as a stream, so the amount of
+memory used does not depend on the size of the inputs.
+
+Usage example:
+
+    python consolidate_tmx.py merged.tmx /path/to/collected/projects
+
+Requires:
+  - Python 3.7 or higher
+  - lxml
+  - SQLite 3.24 or higher (included with most Python versions)
+'''
+
+###########################################################################
+#
+# Consolidate TMX
+# ---------------------------
+# Version 0.1
+# License: GPL3+
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+###########################################################################
+
+import argparse
+import hashlib
+import sqlite3
+import tempfile
+import unicodedata
+
+import common
+from tmxhelpers import (OmegaT_TMXWriter, find_tmx_files, get_segment_text,
+                        get_tuv_lang, iter_tus, read_tmx_header)
+
+# Constants
+BATCH_SIZE = 10000
+CONTEXT_PROPS = ('file', 'id', 'prev', 'next')
+
+
+def normalize(text):
+    '''Ignore differences in Unicode forms and spacing.'''
+
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def read_tu(tu, keep_conflicts=False):
+    '''Retrieve the hash, change date and type of a tu element.
+
+    The hash covers the languages, the normalized source text and the
+    context, and also the normalized target text when conflicts are
+    kept. Returns None
+    for tu elements without a translation.
+    '''
+
+    tuvs = tu.findall('tuv')
+    if len(tuvs) < 2:
+        return None
+
+    props = {prop.attrib.get('type'):prop.text for prop in tu.findall('prop')}
+    context = [props.get(prop_type) or '' for prop_type in CONTEXT_PROPS]
+    alternative = OmegaT_TMXWriter.is_alternative(tu)
+
+    languages = [(get_tuv_lang(tuv) or '').upper() for tuv in tuvs[:2]]
+    parts = languages + [normalize(get_segment_text(tuvs[0]))] + context
+    if keep_conflicts:
+        parts.append(normalize(get_segment_text(tuvs[1])))
+
+    tuhash = hashlib.blake2b('\0'.join(parts).encode('utf-8'),
+                             digest_size=16).digest()
+
+    translation = tuvs[1].attrib
+    changedate = translation.get('changedate',
+                                 translation.get('creationdate', ''))
+
+    return tuhash, changedate, alternative
+
+
+def iter_all_tus(tmxfiles, keep_conflicts=False):
+    '''Stream the tu elements of all the TMX files with their details.
+
+    Each tu is numbered by its position across all files, so that it
+    can be found again on the next pass over the files.
+    '''
+
+    position = 0
+    for tmxfile in tmxfiles:
+        for tu in iter_tus(tmxfile, remove_blank_text=True):
+            details = read_tu(tu, keep_conflicts)
+            if details is not None:
+                yield (position, tu) + details
+            position += 1
+
+
+def select_tus(connection, tmxfiles, keep_conflicts=False):
+    '''Record the most recent tu for each hash.
+
+    When two tu elements with the same hash have the same change date,
+    the first one is kept. Returns the number of tu elements read.
+    '''
+
+    connection.execute('''CREATE TABLE selected
+                          (hash BLOB PRIMARY KEY,
+                           changedate TEXT,
+                           position INTEGER,
+                           alternative INTEGER)
+                          WITHOUT ROWID''')
+
+    upsert = '''INSERT INTO selected VALUES (?, ?, ?, ?)
+                ON CONFLICT(hash) DO UPDATE
+                SET changedate = excluded.changedate,
+                    position = excluded.position,
+                    alternative = excluded.alternative
+                WHERE excluded.changedate > selected.changedate'''
+
+    count = 0
+    batch = []
+    tus = iter_all_tus(tmxfiles, keep_conflicts)
+    for position, _, tuhash, changedate, alternative in tus:
+        batch.append((tuhash, changedate, position, alternative))
+        count += 1
+        if len(batch) >= BATCH_SIZE:
+            connection.executemany(upsert, batch)
+            batch = []
+
+    connection.executemany(upsert, batch)
+    connection.execute('''CREATE INDEX selected_positions
+                          ON selected(alternative, position)''')
+    connection.commit()
+
+    return count
+
+
+def write_selected_tus(connection, tmxfiles, writer, alternative,
+                       keep_conflicts=False):
+    '''Write the selected tu elements of one type in their original order.
+
+    The positions of the selected tu elements are read in order from
+    the database while the files are read again, so that the list of
+    positions never needs to be held in memory.
+    '''
+
+    positions = connection.execute('''SELECT position FROM selected
+                                      WHERE alternative = ?
+                                      ORDER BY position''', (alternative,))
+    next_position = next(positions, None)
+
+    for position, tu, _, _, _ in iter_all_tus(tmxfiles, keep_conflicts):
+        if next_position is None:
+            break
+        if position == next_position[0]:
+            writer.add_tu(tu)
+            next_position = next(positions, None)
+
+
+def consolidate(tmxfiles, output, keep_conflicts=False, tempdir=None):
+    '''Merge TMX files into a single TMX file without duplicates.
+
+    Default translations are written first, followed by alternative
+    translations. The header of the first file is used for the output.
+    Returns the number of tu elements read and written.
+    '''
+
+    if not tmxfiles:
+        raise ValueError('no TMX files to consolidate')
+
+    header, version, doctype = read_tmx_header(tmxfiles[0])
+
+    with tempfile.TemporaryDirectory(dir=tempdir) as tempfolder:
+        connection = sqlite3.connect(common.Path(tempfolder, 'hashes.sqlite'))
+
+        try:
+            with common.profile_stage('select_tus') as stage:
+                read = select_tus(connection, tmxfiles, keep_conflicts)
+                stage.items = read
+
+            with common.profile_stage('write_selected_tus') as stage, \
+                 OmegaT_TMXWriter(output, header=header, version=version,
+                                  doctype=doctype) as writer:
+                for alternative in (False, True):
+                    write_selected_tus(connection, tmxfiles, writer,
+                                       alternative, keep_conflicts)
+                stage.items = writer.tu_count
+        finally:
+            connection.close()
+
+    return read, writer.tu_count
+
+
+def parse_arguments():
+    '''Read the command line arguments.'''
+
+    parser = argparse.ArgumentParser(description='Merge TMX files into a '
+                                                 'single file without '
+                                                 'duplicates.')
+    parser.add_argument('output', type=common.Path,
+                        help='consolidated TMX file to create')
+    parser.add_argument('inputs', nargs='+', type=common.Path,
+                        help='TMX files or folders containing TMX files')
+    parser.add_argument('--keep-conflicts', action='store_true',
+                        help='keep every different translation of a source')
+    parser.add_argument('--tempdir', type=common.Path,
+                        help='folder for the temporary database')
+    common.add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    arguments = parse_arguments()
+    common.start_profiling(arguments)
+
+    # Leave out the output file if it is in one of the input folders.
+    tmxfiles = [tmxfile for tmxfile in find_tmx_files(arguments.inputs)
+                if tmxfile.resolve() != arguments.output.resolve()]
+    if not tmxfiles:
+        raise SystemExit('No TMX files found in '
+                         + ', '.join(str(path) for path in arguments.inputs))
+
+    read, written = consolidate(tmxfiles, arguments.output,
+                                arguments.keep_conflicts, arguments.tempdir)
+    print(f'{read} translation units read from {len(tmxfiles)} files, '
+          f'{written} written to {arguments.output}')
@@ -10,8 +10,15 @@ The user name of each translator and the two letter code to identify that
 translator in the TMX file name must be entered in the "Translators" section
 of the "omegat-tools.conf" file.
 
+TMX files or folders containing team projects can also be passed on the
+command line, in which case all the files are processed in parallel.
+
+TMX files compressed with gzip, bzip2, xz or zstd (.gz, .bz2, .xz or .zst)
+are read as they are decompressed, and the translator files are compressed
+if the "compression" option of the "Files" section is set.
+
 Requires:
-  - Python 3.6 or higher (for f-strings)
+  - Python 3.7 or higher
   - lxml
 '''
 
@@ -32,7 +39,11 @@ Requires:
 #
 # The files can then be placed in the "tmx2source" subfolder of an OmegaT
 # project tm folder to show each translator's original translation immediately
-# below the source text during revision, for example.
+# below the source text during revision, for example. Once the project has
+# been revised, the "revision_diff" script marks the changes made to the
+# translations in these files, the "filter_segments" script extracts
+# segments based on other criteria, and the "review_export" script writes
+# each translator's translations as tables for review outside a CAT tool.
 #
 #
 # TODO:
@@ -40,19 +51,20 @@ Requires:
 #     project tmx file is selected.
 #   - Allow user selected individual TMX file names in addition to the
 #     "tmx2source" file name format.
-#   - Also accept a command line argument for the file to parse.
-#   - Improve the revision notes to mark the differences between the original
-#     and revised translations.
-#   - Allow batch processing of multiple files.
-#   - Enable the extraction of segments based on other criteria.
-#   - Optionally output to a form of two-column table for review
-#     outside a CAT tool.
 ###########################################################################
 
+import argparse
+import copy
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from functools import partial
+
 from lxml import etree
 
 import common
-from tmxhelpers import OmegaT_TMX
+from tmxhelpers import (OmegaT_TMX, OmegaT_TMXWriter, get_tuv_lang,
+                        iter_chunk_tus, map_tu_chunks, open_tmx,
+                        read_tmx_header)
 
 
 def set_tmxpath():
@@ -69,31 +81,59 @@ def set_tmxpath():
     return configpath
 
 
-def parse_tmx_tree(tmxfile=None):
-    '''Get the XML tree of the TMX file to parse'''
+def get_tmx_file():
+    '''Get the TMX file to process.'''
 
-    def get_tmx_file():
-        '''Get the TMX file to process.'''
+    tmxpath = set_tmxpath()
 
-        tmxpath = set_tmxpath()
+    patterns = ' '.join('*.tmx' + suffix for suffix
+                        in ('',) + common.COMPRESSION_SUFFIXES)
+    filetype=[('Translation memories', patterns)]
+    asktmx = 'Select TMX file'
+    tmxfile = common.select_file(tmxpath, filetype, asktmx)
 
-        filetype=[('Translation memories', '*.tmx')]
-        asktmx = 'Select TMX file'
-        tmxfile = common.select_file(tmxpath, filetype, asktmx)
+    return tmxfile
+
+
+def parse_tmx_tree(tmxfile=None):
+    '''Get the XML tree of the TMX file to parse'''
 
-        return tmxfile
-    
     # Ask the user to specify the file to parse if none was passed
     if tmxfile is None:
         tmxfile = get_tmx_file()
     
+    # The path is kept as the URL of the tree, since compressed files
+    # are parsed from the stream of the decompressor.
     tmxparser = etree.XMLParser(remove_blank_text=True)
-    tmxtree = etree.parse(tmxfile, tmxparser)
+    with open_tmx(tmxfile) as tf:
+        tmxtree = etree.parse(tf, tmxparser, base_url=str(tmxfile))
 
     return tmxtree
 
 
-def get_translator_list():
+def read_tmx_data(tmxtree):
+    '''Retrieve the main elements and information of a TMX tree.
+
+    Everything needed to create the individual files is kept together
+    in a single dictionary so that several files can be processed
+    independently of each other.
+    '''
+
+    tmxroot = tmxtree.getroot()
+    header, body = tmxroot.getchildren()
+
+    tmxdata = {'tree':tmxtree,
+               'header':header,
+               'body':body,
+               'doctype':tmxtree.docinfo.doctype,
+               'version':tmxroot.attrib.get('version'),
+               'translators':get_translator_list(body)
+              }
+
+    return tmxdata
+
+
+def get_translator_list(body):
     '''Read list of translators and identifiers.
 
     The parser for the config file returns a list of tuples,
@@ -106,7 +146,7 @@ def get_translator_list():
     # Identify project translators whose work needs to be revised
     # based on the premise that a revised translation will have
     # a changeid that is not in the list of translators to revise.
-    project_translators = set(BODY.xpath('//tuv/@changeid'))
+    project_translators = set(body.xpath('//tuv/@changeid'))
 
     # Set up a dictionary containing the name and code of each
     # translator in the configuration file involved in the project.
@@ -116,39 +156,44 @@ def get_translator_list():
     return translators
 
 
-def prepare_tmx_containers():
+def prepare_tmx_containers(tmxdata):
     '''Set up a dictionary to hold each of the TMX files to revise.'''
 
+    translators = tmxdata['translators']
+
     # Get the first two characters of the target language from the
     # translated tuv language attribute.
-    tgtlang = BODY.xpath('//tuv[2]/@*[local-name() = "lang"]')[0][:2]
+    body = tmxdata['body']
+    tgtlang = body.xpath('//tuv[2]/@*[local-name() = "lang"]')[0][:2]
     sorted_tmxes = {}
 
-    for translator in TRANSLATORS.keys():
-        code = tgtlang + '-'+ TRANSLATORS[translator]
-        sorted_tmxes[code] = OmegaT_TMX(header=HEADER.attrib,
-                                        version=VERSION)    
+    for translator in translators.keys():
+        code = tgtlang + '-'+ translators[translator]
+        sorted_tmxes[code] = OmegaT_TMX(header=tmxdata['header'].attrib,
+                                        version=tmxdata['version'])
     
     return sorted_tmxes
 
 
-def sort_unrevised_tus():
+def sort_unrevised_tus(tmxdata):
     '''Sort unrevised translations into separate lists for each translator'''
     
+    translators = tmxdata['translators']
+
     # Setup container for individual translator tmxes.
-    sorted_tmxes = prepare_tmx_containers()
+    sorted_tmxes = prepare_tmx_containers(tmxdata)
 
     # Retrieve all tuv elements containing a translation.
     # The translation is always in the second tuv element.
-    translations = BODY.xpath('//tuv[2]')
+    translations = tmxdata['body'].xpath('//tuv[2]')
 
     # Sort unrevised tuvs by translator
     for tuv in translations:
         creationid = tuv.attrib.get('creationid')
         changeid = tuv.attrib.get('changeid')
         
-        if creationid in TRANSLATORS.keys() and changeid == creationid:
-            translator = TRANSLATORS[changeid]
+        if creationid in translators.keys() and changeid == creationid:
+            translator = translators[changeid]
             code = [tmxid for tmxid in sorted_tmxes.keys()
                     if translator in tmxid].pop()
             tu = tuv.getparent()
@@ -157,12 +202,237 @@ def sort_unrevised_tus():
     return sorted_tmxes
 
 
-def finalize_tmxdoc(tmxname, tmxcontent):
+def stream_unrevised_tus(tmxfile):
+    '''Extract unrevised translations by translator in a single pass.
+
+    The TMX file is read with iterparse rather than loaded in full. The
+    target language and the translators involved in the project are
+    identified along the way, each unrevised tu is written to its
+    translator's file as soon as it has been parsed, and every tu is
+    discarded once processed, so memory use does not grow with the size
+    of the file. The files are saved in the folder of the TMX file.
+
+    The tu elements found before the first target tuv with a language
+    are kept until the language is known, since it is part of the name
+    of the files.
+    '''
+
+    translator_list = dict(common.config.items('Translators'))
+    tmxpath = common.Path(tmxfile).parent
+
+    version = None
+    header = None
+    doctype = None
+    tgtlang = None
+    project_translators = set()
+    tmxfiles = {}
+    pending = []
+    tu_count = 0
+
+    with ExitStack() as writers:
+        stage = writers.enter_context(
+            common.profile_stage('stream_unrevised_tus'))
+        tf = writers.enter_context(open_tmx(tmxfile))
+        context = etree.iterparse(tf, events=('start', 'end'),
+                                  tag=('tmx', 'header', 'tu'),
+                                  remove_blank_text=True)
+
+        def get_writer(code):
+            '''Open the file of a translator on first use.'''
+
+            if code not in tmxfiles:
+                tmxfile = common.add_compression_suffix(
+                    common.Path(tmxpath/code).with_suffix('.tmx'))
+                tmxfiles[code] = writers.enter_context(
+                    OmegaT_TMXWriter(tmxfile, header=header,
+                                     version=version, doctype=doctype))
+
+            return tmxfiles[code]
+
+        for event, element in context:
+
+            # The tmx and header attributes are complete as soon as
+            # the start tag has been read.
+            if event == 'start':
+                if element.tag == 'tmx':
+                    version = element.attrib.get('version')
+                    doctype = element.getroottree().docinfo.doctype
+                elif element.tag == 'header':
+                    header = dict(element.attrib)
+                continue
+
+            if element.tag != 'tu':
+                continue
+
+            tu_count += 1
+            tuvs = element.findall('tuv')
+            project_translators.update(tuv.attrib.get('changeid')
+                                       for tuv in tuvs)
+
+            # The translation is always in the second tuv element.
+            if len(tuvs) > 1:
+                translation = tuvs[1]
+                if tgtlang is None and get_tuv_lang(translation):
+                    tgtlang = get_tuv_lang(translation)[:2]
+                    for identifier, tu in pending:
+                        get_writer(tgtlang + '-' + identifier).add_tu(tu)
+                    pending = []
+
+                creationid = translation.attrib.get('creationid')
+                changeid = translation.attrib.get('changeid')
+
+                if creationid in translator_list and changeid == creationid:
+                    if tgtlang is None:
+                        pending.append((translator_list[changeid],
+                                        copy.deepcopy(element)))
+                    else:
+                        code = tgtlang + '-' + translator_list[changeid]
+                        get_writer(code).add_tu(element)
+
+            # Discard the tu and any processed elements before it.
+            element.clear()
+            body = element.getparent()
+            while element.getprevious() is not None:
+                del body[0]
+
+        if pending:
+            raise ValueError(f'{tmxfile}: no target language found')
+
+        # As in the tree-based extraction, create a file for every
+        # project translator, even those without unrevised translations.
+        if tgtlang is not None:
+            for name, identifier in translator_list.items():
+                if name in project_translators:
+                    get_writer(tgtlang + '-' + identifier)
+
+        stage.items = tu_count
+
+    return {code: writer.tmxfile for code, writer in tmxfiles.items()}
+
+
+def sort_chunk(translator_list, tmxfile, start, end):
+    '''Sort the unrevised translations of a chunk of a TMX file.
+
+    This runs in a worker process, so the tu elements are sent back
+    serialized, grouped by translator identifier in their original
+    order, along with whether each one is an alternative translation.
+    '''
+
+    tgtlang = None
+    project_translators = set()
+    sorted_tus = {}
+    tu_count = 0
+
+    for tu in iter_chunk_tus(tmxfile, start, end, remove_blank_text=True):
+        tu_count += 1
+        tuvs = tu.findall('tuv')
+        project_translators.update(tuv.attrib.get('changeid')
+                                   for tuv in tuvs)
+
+        # The translation is always in the second tuv element.
+        if len(tuvs) > 1:
+            translation = tuvs[1]
+            if tgtlang is None and get_tuv_lang(translation):
+                tgtlang = get_tuv_lang(translation)[:2]
+
+            creationid = translation.attrib.get('creationid')
+            changeid = translation.attrib.get('changeid')
+
+            if creationid in translator_list and changeid == creationid:
+                data = etree.tostring(tu, encoding='UTF-8',
+                                      pretty_print=True, with_tail=False)
+                sorted_tus.setdefault(translator_list[changeid], []).append(
+                    (OmegaT_TMXWriter.is_alternative(tu), data))
+
+    return {'tgtlang':tgtlang,
+            'translators':project_translators,
+            'tus':sorted_tus,
+            'tu_count':tu_count}
+
+
+def parallel_unrevised_tus(tmxfile, workers=None, chunk_size=None):
+    '''Extract unrevised translations by translator across processes.
+
+    The TMX file is split into chunks of whole tu elements, which are
+    parsed and sorted by a pool of worker processes, while the results
+    are written to each translator's file in the original order of the
+    tu elements. The output is the same as with stream_unrevised_tus,
+    and the chunks read before the target language is known are also
+    kept until it is.
+    '''
+
+    translator_list = dict(common.config.items('Translators'))
+    tmxpath = common.Path(tmxfile).parent
+    header, version, doctype = read_tmx_header(tmxfile)
+
+    workers = get_worker_count(workers)
+    if chunk_size is None:
+        chunk_size = get_chunk_size()
+
+    tgtlang = None
+    project_translators = set()
+    tmxfiles = {}
+    pending = []
+    tu_count = 0
+
+    with ExitStack() as writers:
+        stage = writers.enter_context(
+            common.profile_stage('parallel_unrevised_tus'))
+
+        def get_writer(code):
+            '''Open the file of a translator on first use.'''
+
+            if code not in tmxfiles:
+                tmxfile = common.add_compression_suffix(
+                    common.Path(tmxpath/code).with_suffix('.tmx'))
+                tmxfiles[code] = writers.enter_context(
+                    OmegaT_TMXWriter(tmxfile, header=header,
+                                     version=version, doctype=doctype))
+
+            return tmxfiles[code]
+
+        chunks = map_tu_chunks(tmxfile, partial(sort_chunk, translator_list),
+                               workers, chunk_size)
+
+        for chunk in chunks:
+            tu_count += chunk['tu_count']
+            project_translators.update(chunk['translators'])
+            if tgtlang is None:
+                tgtlang = chunk['tgtlang']
+
+            pending.append(chunk)
+            if tgtlang is None:
+                continue
+
+            for ready in pending:
+                for identifier, tus in ready['tus'].items():
+                    writer = get_writer(tgtlang + '-' + identifier)
+                    for alternative, data in tus:
+                        writer.add_serialized_tu(data, alternative)
+            pending = []
+
+        if any(chunk['tus'] for chunk in pending):
+            raise ValueError(f'{tmxfile}: no target language found')
+
+        # As in the tree-based extraction, create a file for every
+        # project translator, even those without unrevised translations.
+        if tgtlang is not None:
+            for name, identifier in translator_list.items():
+                if name in project_translators:
+                    get_writer(tgtlang + '-' + identifier)
+
+        stage.items = tu_count
+
+    return {code: writer.tmxfile for code, writer in tmxfiles.items()}
+
+
+def finalize_tmxdoc(tmxname, tmxcontent, tmxdata):
     '''Define the tmx tree for output to a file.'''
     
     # Set the full path and name for the TMX file.
-    tmxpath = common.Path(TMXTREE.docinfo.URL).parent
-    tmxfile = common.Path(tmxpath/tmxname).with_suffix('.tmx')
+    tmxpath = common.Path(tmxdata['tree'].docinfo.URL).parent
+    tmxfile = common.add_compression_suffix(
+        common.Path(tmxpath/tmxname).with_suffix('.tmx'))
     
     tmxcontent.insert_alt_comment()
     tmxdoc = etree.ElementTree(tmxcontent.tmx)
@@ -170,30 +440,226 @@ def finalize_tmxdoc(tmxname, tmxcontent):
     return (tmxfile, tmxdoc)
 
 
-def write_tmx(tmxfile, tmxdoc):
+def write_tmx(tmxfile, tmxdoc, doctype):
     '''Output a TMX document to a file.'''
 
-    tmxdoc.write(tmxfile, encoding='utf-8', pretty_print=True,
-                 xml_declaration=True, doctype=DOCTYPE)
+    with common.open_file(tmxfile, 'wb') as tf:
+        tmxdoc.write(tf, encoding='utf-8', pretty_print=True,
+                     xml_declaration=True, doctype=doctype)
 
 
-if __name__ == '__main__':
+def extract_translations(tmxfile, parallel=None, workers=None):
+    '''Create the individual translator files for a single TMX file.
+
+    Unless set, whether the file is parsed in parallel is read from the
+    configuration file. Returns the list of files written.
+    '''
+
+    if parallel is None:
+        parallel = common.config.getboolean('Extract', 'parallel',
+                                            fallback=False)
+    streaming = common.config.getboolean('Extract', 'streaming',
+                                         fallback=False)
+
+    # Compressed files cannot be split into chunks, but can be
+    # streamed from the decompressor.
+    if parallel and common.is_compressed(tmxfile):
+        parallel = False
+        streaming = True
+
+    if parallel:
+        # Parse chunks of the file in several processes at once.
+        tmxfiles = parallel_unrevised_tus(tmxfile, workers)
+        return list(tmxfiles.values())
+
+    if streaming:
+        # Write the translations out in a single pass without building
+        # the tree of the whole TMX file.
+        tmxfiles = stream_unrevised_tus(tmxfile)
+        return list(tmxfiles.values())
 
     # Parse the TMX file into an XML tree, and retrieve the main elements
     # and information needed to create the individual files.
-    TMXTREE = parse_tmx_tree()
-    TMXROOT = TMXTREE.getroot()
-    HEADER, BODY = TMXROOT.getchildren()
-    DOCTYPE = TMXTREE.docinfo.doctype
-    VERSION = TMXROOT.attrib.get('version')
-    
+    with common.profile_stage('parse_tmx_tree') as stage:
+        tmxdata = read_tmx_data(parse_tmx_tree(tmxfile))
+        stage.items = len(tmxdata['body'])
 
-    # Get the list of translators whose work will be revised
-    TRANSLATORS = get_translator_list()
-    
-    unrevised_translations = sort_unrevised_tus()
-    
-    for name, tmxcontent in unrevised_translations.items():
-        unrevised_file, unrevised_doc = finalize_tmxdoc(name, tmxcontent)
-        
-        write_tmx(unrevised_file, unrevised_doc)
\ No newline at end of file
+    with common.profile_stage('sort_unrevised_tus', len(tmxdata['body'])):
+        unrevised_translations = sort_unrevised_tus(tmxdata)
+
+    tmxfiles = []
+    with common.profile_stage('write_tmx') as stage:
+        for name, tmxcontent in unrevised_translations.items():
+            unrevised_file, unrevised_doc = finalize_tmxdoc(name, tmxcontent,
+                                                            tmxdata)
+            write_tmx(unrevised_file, unrevised_doc, tmxdata['doctype'])
+            tmxfiles.append(unrevised_file)
+        stage.items = len(tmxfiles)
+
+    return tmxfiles
+
+
+def extract_job(tmxfile):
+    '''Run the extraction of a single TMX file in a worker process.
+
+    Errors raised by lxml cannot be sent back from the worker process,
+    so every error is passed on as a plain exception with its message.
+    '''
+
+    # The files are already processed in parallel, so each one is
+    # read in a single process.
+    try:
+        return extract_translations(tmxfile, parallel=False)
+    except Exception as error:
+        raise RuntimeError(f'{type(error).__name__}: {error}') from None
+
+
+def find_tmx_files(paths):
+    '''Build the list of TMX files to process from files and folders.
+
+    Folders are searched recursively for project memories, compressed
+    or not, leaving out the copies in the ".repositories" folder of
+    team projects.
+    '''
+
+    memory = common.Path(common.config['Files']['main_memory']).name
+
+    tmxfiles = []
+    for path in map(common.Path, paths):
+        if path.is_dir():
+            tmxfiles.extend(sorted(
+                tmx for tmx in path.rglob(memory + '*')
+                if common.strip_compression_suffix(tmx).name == memory
+                and '.repositories' not in tmx.parts))
+        else:
+            tmxfiles.append(path)
+
+    return tmxfiles
+
+
+def get_worker_count(workers=None):
+    '''Read the number of worker processes from the configuration file,
+    unless a number was passed.'''
+
+    if workers is None:
+        workers = common.config.getint('Extract', 'workers', fallback=0)
+
+    return common.normalize_workers(workers)
+
+
+def get_chunk_size():
+    '''Read the size of the chunks parsed in parallel, in bytes.'''
+
+    megabytes = common.config.getint('Extract', 'chunk_size', fallback=64)
+
+    return max(megabytes, 1) * 1024 * 1024
+
+
+def batch_extract(tmxfiles, workers=None):
+    '''Create the individual translator files for several TMX files.
+
+    Each file is processed in a separate worker process, and a file
+    that cannot be processed is reported without stopping the others.
+    Returns a dictionary of the files written for each TMX file, and
+    a dictionary of the errors for those that failed.
+    '''
+
+    workers = get_worker_count(workers)
+
+    total = len(tmxfiles)
+    results = {}
+    failures = {}
+
+    # Worker processes load the same configuration file as this one.
+    with common.profile_stage('batch_extract', total), \
+         ProcessPoolExecutor(max_workers=workers,
+                             initializer=common.load_config,
+                             initargs=(common.config_file,)) as executor:
+        jobs = {executor.submit(extract_job, tmxfile):tmxfile
+                for tmxfile in tmxfiles}
+
+        for done, job in enumerate(as_completed(jobs), start=1):
+            tmxfile = jobs[job]
+            try:
+                results[tmxfile] = job.result()
+            except Exception as error:
+                failures[tmxfile] = error
+                print(f'[{done}/{total}] Failed {tmxfile}: {error}')
+            else:
+                print(f'[{done}/{total}] Processed {tmxfile}: '
+                      f'{len(results[tmxfile])} files written')
+
+    return results, failures
+
+
+def split_extract(tmxfiles, workers=None):
+    '''Create the individual translator files for several large TMX files.
+
+    The files are processed one at a time, each split between the worker
+    processes, and a file that cannot be processed is reported without
+    stopping the others. Returns the same dictionaries as batch_extract.
+    '''
+
+    total = len(tmxfiles)
+    results = {}
+    failures = {}
+
+    for done, tmxfile in enumerate(tmxfiles, start=1):
+        try:
+            results[tmxfile] = extract_translations(tmxfile, True, workers)
+        except Exception as error:
+            failures[tmxfile] = error
+            print(f'[{done}/{total}] Failed {tmxfile}: {error}')
+        else:
+            print(f'[{done}/{total}] Processed {tmxfile}: '
+                  f'{len(results[tmxfile])} files written')
+
+    return results, failures
+
+
+def parse_arguments(args=None):
+    '''Read the command line arguments.'''
+
+    parser = argparse.ArgumentParser(description='Create per translator TMX '
+                                                 'files from team project '
+                                                 'memories.')
+    parser.add_argument('paths', type=common.Path, nargs='*',
+                        help='TMX files or folders containing team projects')
+    parser.add_argument('--config', type=common.Path,
+                        help='configuration file to use')
+    parser.add_argument('--workers', type=int,
+                        help='number of worker processes')
+    parser.add_argument('--parallel', action='store_true', default=None,
+                        help='split each file between the worker processes')
+    common.add_profile_arguments(parser)
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    '''Process the files passed, or ask the user to select one.'''
+
+    arguments = parse_arguments(args)
+    common.start_profiling(arguments)
+    if arguments.config is not None:
+        common.load_config(arguments.config)
+
+    parallel = arguments.parallel
+    if parallel is None:
+        parallel = common.config.getboolean('Extract', 'parallel',
+                                            fallback=False)
+
+    # Process every file passed on the command line in parallel, either
+    # several files at once or one file at a time split between the
+    # worker processes, or ask the user to select a single file.
+    if arguments.paths:
+        extract = split_extract if parallel else batch_extract
+        results, failures = extract(find_tmx_files(arguments.paths),
+                                    arguments.workers)
+        print(f'{len(results)} TMX files processed, {len(failures)} failed')
+    else:
+        extract_translations(get_tmx_file(), parallel, arguments.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+
+'''Watch folder trees for changes to some of their files.
+
+Two watchers report the files that were created, changed or deleted in
+folder trees, leaving out the folders to prune, and only for the files
+accepted by a match function:
+
+  - InotifyWatcher is told of changes by the Linux kernel through inotify,
+    called with ctypes, so it does no work while nothing changes;
+  - PollingWatcher checks the folders and files at regular intervals, on
+    other systems or when inotify cannot be used. Only folders whose
+    modification time changed are listed again, so each check costs one
+    stat call per folder and per matching file.
+
+The folders to prune are either a set of names left out in every tree,
+or a dictionary of such sets by root, for trees that need different ones.
+
+Both have a wait method that returns the set of paths changed, which is
+empty if nothing changed before the timeout. A path of None means that
+some changes may have been missed, and that everything should be checked
+again. The iter_changes function groups the bursts of changes made when a
+file is saved or a folder copied into a single set.
+'''
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+import common
+
+# inotify constants, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = os.O_CLOEXEC if hasattr(os, 'O_CLOEXEC') else 0
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_ONLYDIR)
+EVENT = struct.Struct('iIII')
+EVENT_BUFFER_SIZE = 64 * 1024
+
+# Constants
+DEFAULT_INTERVAL = 5.0
+
+
+def match_all(path):
+    '''Accept every file.'''
+
+    return True
+
+
+def get_prune_sets(roots, prune):
+    '''Pair each root with the set of folder names to prune in it.'''
+
+    if isinstance(prune, dict):
+        return [(str(root), frozenset(prune.get(root, ()))) for root in roots]
+
+    return [(str(root), frozenset(prune)) for root in roots]
+
+
+def load_inotify():
+    '''Load the inotify functions of the C library.
+
+    Raises OSError if inotify is not available on this system.
+    '''
+
+    library = ctypes.util.find_library('c')
+    if library is None:
+        raise OSError('The C library was not found')
+
+    libc = ctypes.CDLL(library, use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError('inotify is not available on this system')
+
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                       ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+    return libc
+
+
+class InotifyWatcher():
+    '''Class to watch folder trees with inotify.
+
+    Every folder of the trees has a watch, and folders created or moved
+    into the trees later are watched as soon as they are reported, with
+    the matching files they already hold reported as changed. The names
+    of the matching files of each folder are kept, so that the files of
+    a folder moved out of the trees can be reported as changed too.
+    '''
+
+    def __init__(self, roots, prune=(), match=match_all):
+        self.match = match
+        self.libc = load_inotify()
+        self.watches = {}
+        self.files = {}
+
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            self.raise_error()
+
+        try:
+            for root, root_prune in get_prune_sets(roots, prune):
+                self.add_tree(root, root_prune)
+        except OSError:
+            self.close()
+            raise
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        '''Remove every watch.'''
+
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+            self.watches = {}
+            self.files = {}
+
+
+    def raise_error(self, path=None):
+        '''Raise the error set by the last failed inotify call.'''
+
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error), path)
+
+
+    def add_tree(self, root, prune):
+        '''Watch a folder and its subfolders.
+
+        Returns the matching files found in the folders, which are all
+        new to the watcher.
+        '''
+
+        found = set()
+
+        for folder, subfolders, files in os.walk(root):
+            subfolders[:] = [subfolder for subfolder in subfolders
+                             if subfolder not in prune]
+
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder),
+                                             WATCH_MASK)
+            if wd < 0:
+                # Running out of watches is an error, but a folder
+                # deleted in the meantime is not.
+                if ctypes.get_errno() in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                self.raise_error(folder)
+            self.watches[wd] = (folder, prune)
+
+            names = {name for name in files
+                     if self.match(common.Path(folder, name))}
+            self.files.setdefault(folder, set()).update(names)
+            found.update(common.Path(folder, name) for name in names)
+
+        return found
+
+
+    def remove_tree(self, root):
+        '''Stop watching a folder moved out of the trees.
+
+        Returns the matching files that were in the folders, which are
+        gone from the trees.
+        '''
+
+        removed = set()
+        prefix = os.path.join(root, '')
+
+        for wd, (folder, _) in list(self.watches.items()):
+            if folder == root or folder.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+                removed.update(common.Path(folder, name)
+                               for name in self.files.pop(folder, ()))
+
+        return removed
+
+
+    def read_events(self):
+        '''Read the pending events and return the paths changed.'''
+
+        data = os.read(self.fd, EVENT_BUFFER_SIZE)
+        changes = set()
+        offset = 0
+
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length]
+            offset += EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                changes.add(None)
+                continue
+            if mask & IN_IGNORED:
+                watch = self.watches.pop(wd, None)
+                if watch is not None:
+                    changes.update(common.Path(watch[0], name) for name
+                                   in self.files.pop(watch[0], ()))
+                continue
+
+            if wd not in self.watches:
+                continue
+            folder, prune = self.watches[wd]
+
+            name = os.fsdecode(name.rstrip(b'\0'))
+            path = os.path.join(folder, name)
+
+            if mask & IN_ISDIR:
+                if name in prune:
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changes.update(self.add_tree(path, prune))
+                elif mask & IN_MOVED_FROM:
+                    changes.update(self.remove_tree(path))
+            elif self.match(common.Path(path)):
+                names = self.files.setdefault(folder, set())
+                if mask & (IN_DELETE | IN_MOVED_FROM):
+                    names.discard(name)
+                else:
+                    names.add(name)
+                changes.add(common.Path(path))
+
+        return changes
+
+
+    def wait(self, timeout=None):
+        '''Wait for changes, for at most timeout seconds if set.'''
+
+        while True:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if not ready:
+                return set()
+
+            changes = self.read_events()
+            if changes or timeout is not None:
+                return changes
+
+
+class PollingWatcher():
+    '''Class to watch folder trees by checking them at intervals.
+
+    The listing of each folder is kept along with its modification
+    time, which changes when a file or subfolder is added, removed or
+    renamed, and the size and modification time of each matching file.
+    '''
+
+    def __init__(self, roots, prune=(), match=match_all,
+                 interval=DEFAULT_INTERVAL):
+        self.roots = get_prune_sets(roots, prune)
+        self.match = match
+        self.interval = interval
+        self.folders = {}
+        self.files = {}
+
+        self.poll()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        '''Forget the state of the trees.'''
+
+        self.folders = {}
+        self.files = {}
+
+
+    def list_folder(self, folder, prune):
+        '''List the matching files and subfolders of a folder.'''
+
+        files = []
+        subfolders = []
+
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in prune:
+                        subfolders.append(entry.path)
+                elif self.match(common.Path(entry.path)):
+                    files.append(entry.path)
+
+        return files, subfolders
+
+
+    def poll(self):
+        '''Check the trees once, and return the paths changed.'''
+
+        folders = {}
+        files = {}
+        pending = list(self.roots)
+
+        while pending:
+            folder, prune = pending.pop()
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+                record = self.folders.get(folder)
+                if record is None or record[0] != mtime:
+                    record = (mtime,) + self.list_folder(folder, prune)
+            except OSError:
+                continue
+
+            folders[folder] = record
+            pending.extend((subfolder, prune) for subfolder in record[2])
+
+            for path in record[1]:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stat.st_size, stat.st_mtime_ns)
+
+        changes = {common.Path(path) for path in files.keys() | self.files.keys()
+                   if files.get(path) != self.files.get(path)}
+
+        self.folders = folders
+        self.files = files
+
+        return changes
+
+
+    def wait(self, timeout=None):
+        '''Wait for changes, for at most timeout seconds if set.'''
+
+        while True:
+            time.sleep(self.interval if timeout is None
+                       else min(timeout, self.interval))
+            changes = self.poll()
+            if changes or timeout is not None:
+                return changes
+
+
+def iter_changes(watcher, debounce=1.0, max_delay=None):
+    '''Yield the paths changed, grouped by bursts of changes.
+
+    The changes are only yielded once no new change has been reported
+    for debounce seconds, or max_delay seconds after the first change
+    of the burst, if set, so that files changing constantly are still
+    dealt with.
+    '''
+
+    while True:
+        changes = watcher.wait()
+        started = time.monotonic()
+
+        while True:
+            timeout = debounce
+            if max_delay is not None:
+                timeout = min(timeout,
+                              max_delay - (time.monotonic() - started))
+                if timeout <= 0:
+                    break
+
+            more = watcher.wait(timeout)
+            if not more:
+                break
+            changes.update(more)
+
+        yield changes
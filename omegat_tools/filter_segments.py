@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+'''Extract the translation units matching named filters from TMX files.
+
+The filters are defined in the configuration file, in sections named
+"Filter: " followed by the name of the filter, for example:
+
+    [Filter: Junior unrevised]
+    translator = Junior Translator
+    status = unrevised
+
+    [Filter: Manual 2024]
+    file = source/manual*.docx
+    since = 2024-01-01
+    until = 2024-12-31
+
+A translation unit matches a filter if it meets every condition of the
+filter. The available conditions are:
+
+  - translator: the last translator of the tu (changeid, or creationid if
+    the tu was never changed), or a comma-separated list of translators;
+  - creator: the original translator of the tu (creationid), or a list;
+  - status: "revised" (changed by someone else than its translator) or
+    "unrevised" (last changed by its own translator, as selected by the
+    "extract_segments" script); a tu without a changeid is neither;
+  - type: "default" or "alternative" translation;
+  - file: the source file of alternative translations, or a list of
+    patterns such as "source/*.docx";
+  - since, until: the range of dates of the last change (YYYY-MM-DD,
+    both included).
+
+Each TMX file is read only once, however many filters are applied, and
+every translation unit is written to the file of each filter it matches.
+The files are named after the TMX file and the filter unless an "output"
+option is set in the filter section, where "{stem}" stands for the name
+of the TMX file (without its compression suffix) and "{name}" for the
+name of the filter. The files written by the filters are left out when
+the same folders are filtered again.
+
+Usage examples:
+
+    python filter_segments.py /path/to/team_project/omegat/project_save.tmx
+    python filter_segments.py --filter "Manual 2024" /path/to/team_projects
+
+Requires:
+  - Python 3.7 or higher
+  - lxml
+'''
+
+###########################################################################
+#
+# Segment Filter
+# ---------------------------
+# Version 0.1
+# License: GPL3+
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+###########################################################################
+
+import argparse
+from contextlib import ExitStack
+from fnmatch import fnmatchcase
+
+import common
+from extract_segments import find_tmx_files
+from tmxhelpers import (OmegaT_TMXWriter, TranslationUnit, iter_tus,
+                        read_tmx_header)
+
+# Constants
+FILTER_PREFIX = 'Filter:'
+DEFAULT_OUTPUT = '{stem}-{name}.tmx'
+
+
+def split_list(value):
+    '''Split a comma-separated option into a list of values.'''
+
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def to_date(value):
+    '''Convert a YYYY-MM-DD date to the date part of TMX dates.'''
+
+    return value.strip().replace('-', '')
+
+
+def get_date(record):
+    '''Return the date part of the last change of a tu record.'''
+
+    return (record.changedate or record.creationdate or '')[:8]
+
+
+def match_translator(value):
+    '''Match the last translator of a tu.'''
+
+    names = set(split_list(value))
+    return lambda record: record.translator in names
+
+
+def match_creator(value):
+    '''Match the original translator of a tu.'''
+
+    names = set(split_list(value))
+    return lambda record: record.creationid in names
+
+
+def match_status(value):
+    '''Match revised or unrevised translations.
+
+    Unrevised translations follow the rule of extract_segments: the
+    changeid must be the same as the creationid.
+    '''
+
+    if value.strip() not in ('revised', 'unrevised'):
+        raise ValueError(f'unknown status "{value}"')
+    if value.strip() == 'revised':
+        return lambda record: record.is_revised
+    return lambda record: (record.changeid is not None
+                           and record.changeid == record.creationid)
+
+
+def match_type(value):
+    '''Match default or alternative translations.'''
+
+    if value.strip() not in ('default', 'alternative'):
+        raise ValueError(f'unknown type "{value}"')
+    alternative = value.strip() == 'alternative'
+    return lambda record: record.is_alternative == alternative
+
+
+def match_file(value):
+    '''Match the source file of alternative translations.'''
+
+    patterns = split_list(value)
+    return lambda record: any(fnmatchcase(record.get_prop('file') or '',
+                                          pattern)
+                              for pattern in patterns)
+
+
+def match_since(value):
+    '''Match translations changed on or after a date.'''
+
+    since = to_date(value)
+    return lambda record: get_date(record) >= since
+
+
+def match_until(value):
+    '''Match translations changed on or before a date.'''
+
+    until = to_date(value)
+    return lambda record: get_date(record) <= until
+
+
+# Functions building the check for each condition of a filter
+CONDITIONS = {'translator':match_translator,
+              'creator':match_creator,
+              'status':match_status,
+              'type':match_type,
+              'file':match_file,
+              'since':match_since,
+              'until':match_until
+             }
+
+
+def compile_filter(name, options):
+    '''Turn the conditions of a filter into a single predicate.
+
+    The predicate takes a TranslationUnit record, and returns whether
+    it meets every condition of the filter.
+    '''
+
+    checks = []
+    for option, value in options.items():
+        if option == 'output':
+            continue
+        if option not in CONDITIONS:
+            raise ValueError(f'Unknown condition "{option}" '
+                             f'in filter "{name}"')
+        try:
+            checks.append(CONDITIONS[option](value))
+        except ValueError as error:
+            raise ValueError(f'Filter "{name}": {error}') from None
+
+    def predicate(record):
+        return all(check(record) for check in checks)
+
+    return predicate
+
+
+def read_filters(names=None):
+    '''Read and compile the filters defined in the configuration file.
+
+    Only the filters named are returned if names are given. Returns a
+    dictionary of the output file template and predicate of each filter.
+    '''
+
+    filters = {}
+    for section in common.config.sections():
+        if not section.startswith(FILTER_PREFIX):
+            continue
+
+        name = section[len(FILTER_PREFIX):].strip()
+        if names is not None and name not in names:
+            continue
+
+        options = dict(common.config.items(section))
+        filters[name] = (options.get('output', DEFAULT_OUTPUT),
+                         compile_filter(name, options))
+
+    if names is not None:
+        missing = [name for name in names if name not in filters]
+        if missing:
+            raise ValueError('Filters not found in the configuration file: '
+                             + ', '.join(missing))
+
+    return filters
+
+
+def get_output_file(tmxfile, name, output):
+    '''Name the file of a filter for a TMX file, which may be compressed.'''
+
+    stem = common.strip_compression_suffix(tmxfile).stem
+
+    return tmxfile.parent/output.format(stem=stem, name=name)
+
+
+def list_filter_outputs(tmxfiles, filters):
+    '''List the files the filters write for a list of TMX files.
+
+    The files are saved next to the TMX files, so the files of a
+    previous run are found again when filtering the same folders, and
+    need to be left out.
+    '''
+
+    return {get_output_file(common.Path(tmxfile), name, output)
+            for tmxfile in tmxfiles
+            for name, (output, _) in filters.items()}
+
+
+def filter_tus(tmxfile, filters):
+    '''Write the tu elements matching each filter in a single pass.
+
+    The files are saved in the folder of the TMX file. Returns the
+    number of tu elements written to the file of each filter.
+    '''
+
+    tmxfile = common.Path(tmxfile)
+    header, version, doctype = read_tmx_header(tmxfile)
+
+    with ExitStack() as writers:
+        outputs = []
+        for name, (output, predicate) in filters.items():
+            output_file = get_output_file(tmxfile, name, output)
+            writer = writers.enter_context(
+                OmegaT_TMXWriter(output_file, header=header,
+                                 version=version, doctype=doctype))
+            outputs.append((writer, predicate))
+
+        with common.profile_stage('filter_tus') as stage:
+            tu_count = 0
+            for tu in iter_tus(tmxfile, remove_blank_text=True):
+                tu_count += 1
+                record = TranslationUnit.from_element(tu)
+                for writer, predicate in outputs:
+                    if predicate(record):
+                        writer.add_tu(tu)
+            stage.items = tu_count
+
+    return {writer.tmxfile:writer.tu_count for writer, _ in outputs}
+
+
+def parse_arguments():
+    '''Read the command line arguments.'''
+
+    parser = argparse.ArgumentParser(description='Extract the translation '
+                                                 'units matching filters '
+                                                 'from TMX files.')
+    parser.add_argument('paths', nargs='+', type=common.Path,
+                        help='TMX files or folders containing projects')
+    parser.add_argument('--filter', action='append', dest='filters',
+                        metavar='NAME',
+                        help='filter to apply (all filters by default)')
+    parser.add_argument('--config', type=common.Path,
+                        help='configuration file to use')
+    common.add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    arguments = parse_arguments()
+    common.start_profiling(arguments)
+    if arguments.config is not None:
+        common.load_config(arguments.config)
+
+    filters = read_filters(arguments.filters)
+    if not filters:
+        raise SystemExit('No filters defined in the configuration file.')
+
+    tmxfiles = find_tmx_files(arguments.paths)
+    outputs = list_filter_outputs(tmxfiles, filters)
+    for tmxfile in tmxfiles:
+        if tmxfile in outputs:
+            continue
+        for output_file, count in filter_tus(tmxfile, filters).items():
+            print(f'{count} translation units written to {output_file}')
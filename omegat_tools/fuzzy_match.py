@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+'''Find fuzzy matches for source segments in translation memories.
+
+This script looks up each segment of a source file in one or more TMX
+files, in a similar way to the fuzzy matches of a CAT tool, so that texts
+can be pre-translated or checked against existing memories outside OmegaT.
+
+Comparing each segment with every segment of a large memory one pair at a
+time would be far too slow, so the memory is first indexed by character
+trigrams. For each segment to look up, the number of trigrams shared with
+every segment of the memory is counted at once with NumPy, and only the
+segments with the highest trigram similarity are then compared exactly
+by edit distance to compute the match score.
+
+The segments to look up are split between several worker processes.
+
+Usage example:
+
+    python fuzzy_match.py --threshold 75 /path/to/memories source.txt
+
+The source file can be a TMX file, in which case its source segments are
+looked up, or a text file with one segment per line. The matches are
+written in tab-separated format, either to the console or to the file
+given with the --output option.
+
+Requires:
+  - Python 3.7 or higher
+  - lxml
+  - numpy
+'''
+
+###########################################################################
+#
+# Fuzzy Match
+# ---------------------------
+# Version 0.1
+# License: GPL3+
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+###########################################################################
+
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+try:
+    import numpy as np
+except ImportError as error:
+    raise ImportError('The fuzzy_match script requires the numpy module, '
+                      'which can be installed with "pip install numpy"'
+                      ) from error
+
+import common
+from tmxhelpers import (find_tmx_files, iter_translations,
+                        iter_translations_parallel)
+
+# Constants
+GRAM_SIZE = 3
+DEFAULT_THRESHOLD = 70
+DEFAULT_TOP = 3
+CANDIDATES = 30
+CHUNK_SIZE = 200
+
+
+def normalize(text):
+    '''Ignore case and spacing differences when comparing segments.'''
+
+    return ' '.join(text.casefold().split())
+
+
+def make_grams(text):
+    '''Split a segment into the set of its character trigrams.
+
+    The segment is padded with spaces so that single characters and
+    the beginning and end of the segment also produce trigrams.
+    '''
+
+    padded = f' {normalize(text)} '
+
+    return {padded[start:start+GRAM_SIZE]
+            for start in range(len(padded) - GRAM_SIZE + 1)}
+
+
+def edit_distance(first, second):
+    '''Compute the Levenshtein distance between two strings.'''
+
+    if len(first) < len(second):
+        first, second = second, first
+
+    previous = list(range(len(second) + 1))
+
+    for row, first_char in enumerate(first, start=1):
+        current = [row]
+        for column, second_char in enumerate(second, start=1):
+            current.append(min(previous[column] + 1,
+                               current[column-1] + 1,
+                               previous[column-1] + (first_char != second_char)))
+        previous = current
+
+    return previous[-1]
+
+
+def match_score(first, second):
+    '''Express the similarity of two segments as a percentage.'''
+
+    first = normalize(first)
+    second = normalize(second)
+    longest = max(len(first), len(second))
+
+    if longest == 0:
+        return 100
+
+    return round(100 * (1 - edit_distance(first, second) / longest))
+
+
+class FuzzyIndex():
+    '''Class for a trigram index of the source segments of memories.
+
+    The index is stored as NumPy arrays: for each trigram, the list of
+    segments containing it, and for each segment, its number of distinct
+    trigrams.
+    '''
+
+    def __init__(self, translations):
+        '''Build the index from (source, target) pairs.'''
+
+        # Keep a single copy of identical translations.
+        translations = list(dict.fromkeys(translations))
+        self.sources = [source for source, _ in translations]
+        self.targets = [target for _, target in translations]
+
+        self.vocabulary = {}
+        add_gram = self.vocabulary.setdefault
+        gram_ids = []
+        lengths = []
+
+        for source in self.sources:
+            grams = make_grams(source)
+            lengths.append(len(grams))
+            gram_ids.extend([add_gram(gram, len(self.vocabulary))
+                             for gram in grams])
+
+        self.lengths = np.array(lengths, dtype=np.int32)
+        gram_ids = np.array(gram_ids, dtype=np.int64)
+        segment_ids = np.repeat(np.arange(len(self.sources), dtype=np.int32),
+                                self.lengths)
+
+        # Group the segment numbers by trigram, with the start of the
+        # list of each trigram given by the offsets.
+        order = np.argsort(gram_ids, kind='stable')
+        self.postings = segment_ids[order]
+        self.offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(gram_ids, minlength=len(self.vocabulary)),
+                  out=self.offsets[1:])
+
+
+    def __len__(self):
+        return len(self.sources)
+
+
+    def find_candidates(self, segment, count=CANDIDATES):
+        '''Find the segments with the most trigrams in common.
+
+        The trigram similarity (Dice coefficient) of every segment of
+        the memory is computed at once, and the best ones are returned
+        with their similarity, most similar first.
+        '''
+
+        grams = make_grams(segment)
+        gram_ids = [self.vocabulary[gram] for gram in grams
+                    if gram in self.vocabulary]
+
+        if not gram_ids:
+            return np.array([], dtype=np.int64), np.array([])
+
+        # Count the trigrams each segment shares with the query by
+        # gathering the segment lists of all its trigrams.
+        postings = np.concatenate([self.postings[self.offsets[gram_id]:
+                                                 self.offsets[gram_id+1]]
+                                   for gram_id in gram_ids])
+        shared = np.bincount(postings, minlength=len(self))
+        similarity = 2 * shared / (self.lengths + len(grams))
+
+        count = min(count, len(self))
+        best = np.argpartition(similarity, -count)[-count:]
+        best = best[np.argsort(similarity[best])[::-1]]
+
+        return best, similarity[best]
+
+
+    def match(self, segment, threshold=DEFAULT_THRESHOLD, top=DEFAULT_TOP):
+        '''Find the best matches of a segment in the memory.
+
+        Only the candidates whose trigram similarity could reach the
+        threshold are scored exactly. Returns a list of (score, source,
+        target) tuples, best match first.
+        '''
+
+        candidates, similarity = self.find_candidates(segment)
+        matches = []
+
+        for segment_id, dice in zip(candidates, similarity):
+            # Trigram similarity is only an estimate of the match score,
+            # so leave some margin before discarding a candidate.
+            if dice * 100 < threshold / 2:
+                break
+
+            score = match_score(segment, self.sources[segment_id])
+            if score >= threshold:
+                matches.append((score, self.sources[segment_id],
+                                self.targets[segment_id]))
+
+        matches.sort(key=lambda match: match[0], reverse=True)
+
+        return matches[:top]
+
+
+# Index shared by the segments processed in a worker process
+worker_index = None
+
+
+def set_worker_index(index):
+    '''Make the memory index available to a worker process.'''
+
+    global worker_index
+    worker_index = index
+
+
+def match_chunk(segments, threshold, top):
+    '''Find the matches of a list of segments in a worker process.'''
+
+    return [worker_index.match(segment, threshold, top)
+            for segment in segments]
+
+
+def match_segments(index, segments, threshold=DEFAULT_THRESHOLD,
+                   top=DEFAULT_TOP, workers=None):
+    '''Find the matches of many segments across several processes.
+
+    The index is sent once to each worker process, and the segments
+    are handed out in chunks. Returns the list of matches of each
+    segment, in the order of the segments.
+    '''
+
+    chunks = [segments[start:start+CHUNK_SIZE]
+              for start in range(0, len(segments), CHUNK_SIZE)]
+    results = []
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=set_worker_index,
+                             initargs=(index,)) as executor:
+        for matches in executor.map(match_chunk, chunks,
+                                    [threshold] * len(chunks),
+                                    [top] * len(chunks)):
+            results.extend(matches)
+
+    return results
+
+
+def load_index(memories, workers=None):
+    '''Build the index of the source segments of the memories.
+
+    With several workers, each memory is split into chunks that are
+    parsed in parallel.
+    '''
+
+    if workers is not None and workers > 1:
+        read = partial(iter_translations_parallel, workers=workers)
+    else:
+        read = iter_translations
+
+    translations = ((source, target) for memory in memories
+                    for source, target, _ in read(memory))
+
+    return FuzzyIndex(translations)
+
+
+def read_source_segments(source_file):
+    '''Read the segments to look up from a TMX or text file.
+
+    Either file can be compressed.
+    '''
+
+    if common.strip_compression_suffix(source_file).suffix.lower() == '.tmx':
+        return [source for source, _, _ in iter_translations(source_file)]
+
+    with common.open_file(source_file, 'rt', encoding='utf-8') as sf:
+        return [line.rstrip('\n') for line in sf if line.strip()]
+
+
+def write_matches(segments, results, output):
+    '''Write each segment and its matches in tab-separated format.'''
+
+    mwriter = csv.writer(output, delimiter='\t')
+    mwriter.writerow(['segment', 'score', 'match source', 'match target'])
+
+    for segment, matches in zip(segments, results):
+        if not matches:
+            mwriter.writerow([segment, '', '', ''])
+        for score, source, target in matches:
+            mwriter.writerow([segment, score, source, target])
+
+
+def parse_arguments():
+    '''Read the command line arguments.'''
+
+    parser = argparse.ArgumentParser(description='Find fuzzy matches in '
+                                                 'translation memories.')
+    parser.add_argument('memories', nargs='+', type=common.Path,
+                        help='TMX files or folders to search')
+    parser.add_argument('source_file', type=common.Path,
+                        help='TMX or text file with the segments to look up')
+    parser.add_argument('--threshold', type=int, default=DEFAULT_THRESHOLD,
+                        help='minimum match score (percentage)')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP,
+                        help='maximum number of matches per segment')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('--output', type=common.Path,
+                        help='file to write the matches to')
+    parser.add_argument('--config', type=common.Path,
+                        help='configuration file to use')
+    common.add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    arguments = parse_arguments()
+    common.start_profiling(arguments)
+    if arguments.config is not None:
+        common.load_config(arguments.config)
+    arguments.workers = common.normalize_workers(arguments.workers)
+
+    with common.profile_stage('load_index') as stage:
+        index = load_index(find_tmx_files(arguments.memories),
+                           arguments.workers)
+        stage.items = len(index)
+
+    segments = read_source_segments(arguments.source_file)
+
+    with common.profile_stage('match_segments', len(segments)):
+        results = match_segments(index, segments, arguments.threshold,
+                                 arguments.top, arguments.workers)
+
+    if arguments.output is None:
+        write_matches(segments, results, sys.stdout)
+    else:
+        with open(arguments.output, 'w', encoding='utf-8', newline='') as mf:
+            write_matches(segments, results, mf)
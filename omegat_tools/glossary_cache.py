@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+'''Cache the parsed entries of glossary files between merges.
+
+The cache is a small SQLite database saved in the glossary folder. For each
+glossary file, it records the path relative to that folder, the size, the
+modification time and a hash of the contents, along with the entries read
+from the file, stored as a pickle.
+
+When glossaries are merged again, only the files that are new or whose size
+or modification time changed are read again, and files with the same hash
+as before are simply marked as up to date. Records of files that no longer
+exist are removed.
+'''
+
+import pickle
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+import common
+
+# Constants
+CACHE_NAME = '.glossary_cache.sqlite'
+
+
+class GlossaryCache():
+    '''Class for the cache of parsed glossary entries in a folder.'''
+
+    def __init__(self, glossary_path, parse):
+        '''Open the cache of a glossary folder.
+
+        The parse function is used to read the entries of files that
+        are not in the cache or have changed since they were cached.
+        '''
+
+        self.glossary_path = common.Path(glossary_path)
+        self.cache_file = common.Path(self.glossary_path, CACHE_NAME)
+        self.parse = parse
+
+        self.connection = sqlite3.connect(self.cache_file)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS glossaries
+                                   (path TEXT PRIMARY KEY,
+                                    size INTEGER,
+                                    mtime INTEGER,
+                                    hash TEXT,
+                                    entries BLOB)''')
+
+        self.parsed = []
+        self.removed = []
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        '''Close the connection to the cache database.'''
+
+        self.connection.close()
+
+
+    def get_key(self, glossary_file):
+        '''Identify a glossary file by its path in the glossary folder.'''
+
+        relative_path = common.Path(glossary_file).relative_to(self.glossary_path)
+
+        return relative_path.as_posix()
+
+
+    def find_changes(self, glossary_list):
+        '''Identify the glossary files that need to be read again.
+
+        Files with the same size and modification time as the last time
+        are assumed unchanged. Other files are hashed, and those whose
+        contents did not change only have their record updated.
+        '''
+
+        records = {path:(size, mtime, filehash) for path, size, mtime, filehash
+                   in self.connection.execute('''SELECT path, size, mtime, hash
+                                                 FROM glossaries''')}
+        changed = []
+
+        for glossary_file in glossary_list:
+            key = self.get_key(glossary_file)
+            stat = glossary_file.stat()
+
+            if key in records:
+                size, mtime, filehash = records[key]
+                if (size, mtime) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                if common.hash_file(glossary_file) == filehash:
+                    self.connection.execute('''UPDATE glossaries
+                                               SET size = ?, mtime = ?
+                                               WHERE path = ?''',
+                                            (stat.st_size, stat.st_mtime_ns,
+                                             key))
+                    continue
+
+            changed.append(glossary_file)
+
+        return changed
+
+
+    def remove_deleted(self, glossary_list):
+        '''Remove the records of files that are no longer in the folder.'''
+
+        current = {self.get_key(glossary_file)
+                   for glossary_file in glossary_list}
+        cached = [path for path, in
+                  self.connection.execute('SELECT path FROM glossaries')]
+
+        self.removed = [path for path in cached if path not in current]
+        self.connection.executemany('DELETE FROM glossaries WHERE path = ?',
+                                    [(path,) for path in self.removed])
+
+
+    def update(self, glossary_list, workers=None):
+        '''Bring the cache up to date with the glossary files.
+
+        The files that changed are read in parallel, and their entries
+        are saved as soon as they are available.
+        '''
+
+        changed = self.find_changes(glossary_list)
+
+        if changed:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for glossary_file, entries in zip(changed,
+                                                  executor.map(self.parse,
+                                                               changed)):
+                    self.store(glossary_file, entries)
+
+        self.parsed = changed
+        self.remove_deleted(glossary_list)
+        self.connection.commit()
+
+
+    def store(self, glossary_file, entries):
+        '''Save the entries of a glossary file to the cache.'''
+
+        stat = glossary_file.stat()
+        self.connection.execute('''INSERT OR REPLACE INTO glossaries
+                                   VALUES (?, ?, ?, ?, ?)''',
+                                (self.get_key(glossary_file), stat.st_size,
+                                 stat.st_mtime_ns,
+                                 common.hash_file(glossary_file),
+                                 pickle.dumps(entries,
+                                              pickle.HIGHEST_PROTOCOL)))
+
+
+    def get_entries(self, glossary_file):
+        '''Retrieve the cached entries of a glossary file.'''
+
+        row = self.connection.execute('''SELECT entries FROM glossaries
+                                         WHERE path = ?''',
+                                      (self.get_key(glossary_file),)).fetchone()
+
+        return pickle.loads(row[0])
+
+
+    def read_glossaries(self, glossary_list, workers=None):
+        '''Retrieve the entries of each glossary file through the cache.
+
+        The entries are returned file by file, in the order of the
+        glossary list.
+        '''
+
+        self.update(glossary_list, workers)
+
+        for glossary_file in glossary_list:
+            yield from self.get_entries(glossary_file)
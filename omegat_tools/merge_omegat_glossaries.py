@@ -8,6 +8,10 @@ This script collects all entries from every OmegaT text format glossary in the s
 The OmegaT glossary is simply a text file containing up to three fields: source term, target term and, optionally, additional notes or comments.
 
 Entries are considered duplicates if they have identical source and target terms (including capitalization, hyphenation, and spacing). Entries with only a source term are discarded. However, entries with a source term and a note are retained even if they have no target term. If two entries have identical source and target terms, but one also has a supplementary note, the latter is preferred.
+
+Optionally, near-duplicates, whose terms only differ in capitalization, hyphenation, spacing, or full-width and half-width characters, can also be found. Entries are grouped by the terms normalized in this way, and only the entries of the same group are compared, so that the glossary is not compared entry by entry. The clusters of near-duplicates found are either written to a file for review, or collapsed following the same rule as for duplicates.
+
+Glossary files compressed with gzip, bzip2, xz or zstd (such as "glossary.txt.gz") are merged like the others, and the merged glossary is compressed if its name ends with one of these suffixes.
 '''
 
 ###########################################################################
@@ -24,14 +28,28 @@ Entries are considered duplicates if they have identical source and target terms
 # overlapping content.
 #
 # TODO:
-#   - Allow path to be passed as a command line argument
 #   - Check that the files are valid glossary files
 #
 ###########################################################################
 
+import argparse
 import csv
+import heapq
+import os
+import tempfile
+import unicodedata
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+from itertools import groupby
 
 import common
+from glossary_cache import GlossaryCache
+
+# Hyphens and dashes ignored when looking for near-duplicates
+HYPHENS = dict.fromkeys(map(ord, '-\u2010\u2011\u2012\u2013\u2014\u2212'))
+CLUSTER_COLUMNS = ['cluster', 'source', 'target', 'notes']
+NEAR_DUPLICATE_MODES = ('no', 'review', 'collapse')
 
 
 def get_glossary_settings():
@@ -39,12 +57,45 @@ def get_glossary_settings():
 
     settings = {'configpath':common.config['Paths']['glossaries'],
                 'main':common.config['Files']['main_glossary'],
-                'extensions':common.config['Files']['glossary_files'].replace(',', '')
+                'extensions':common.config['Files']['glossary_files'].replace(',', ''),
+                'workers':common.config.getint('Merge', 'workers', fallback=0),
+                'external':common.config.getboolean('Merge', 'external_merge',
+                                                    fallback=False),
+                'run_size':common.config.getint('Merge', 'run_size',
+                                                fallback=1000000),
+                'cache':common.config.getboolean('Merge', 'cache',
+                                                 fallback=False),
+                'near_duplicates':common.config.get('Merge',
+                                                    'near_duplicates',
+                                                    fallback='no'),
+                'similarity':common.config.getfloat('Merge', 'similarity',
+                                                    fallback=0.85)
                }
+
+    # Use every available core unless a positive number was set.
+    if settings['workers'] < 1:
+        settings['workers'] = os.cpu_count() or 1
     
     return settings
 
 
+def check_glossary_settings(settings):
+    '''Reject unknown settings, and settings that cannot go together.
+
+    Near-duplicates are looked for in the whole merged glossary at once,
+    which would undo the fixed amount of memory of external merging.
+    '''
+
+    if settings['near_duplicates'] not in NEAR_DUPLICATE_MODES:
+        raise ValueError(f'Unknown near_duplicates setting '
+                         f'"{settings["near_duplicates"]}", use '
+                         + ', '.join(NEAR_DUPLICATE_MODES))
+    if settings['near_duplicates'] != 'no' and settings['external']:
+        raise ValueError('Near-duplicates cannot be looked for with '
+                         'external merging, which keeps the merged '
+                         'glossary out of memory')
+
+
 def set_base_glossary_path():
     '''Assign the default path for glossary files'''
 
@@ -60,9 +111,12 @@ def get_glossary_list(glossary_path):
     # Syntax to retrieve more than one extension inspired by
     # this Stack Overflow answer: https://stackoverflow.com/a/57893015/8123921
     
+    # Compressed glossaries are recognized by the extension before
+    # their compression suffix.
     extensions = glossary_settings['extensions']
-    glossary_list = (g for g in glossary_path.rglob('*')
-                     if g.suffix in extensions)
+    glossary_list = sorted(g for g in glossary_path.rglob('*')
+                           if common.strip_compression_suffix(g).suffix
+                           in extensions)
 
     return glossary_list
 
@@ -75,7 +129,8 @@ def get_glossary_entries(glossary_file):
 
     entries = []
 
-    with open(glossary_file, 'r', encoding='utf-8', newline='') as gf:
+    with common.open_file(glossary_file, 'rt', encoding='utf-8',
+                          newline='') as gf:
         greader = csv.DictReader(gf, fieldnames=fields, delimiter='\t')
 
         for line in greader:
@@ -91,49 +146,268 @@ def get_glossary_entries(glossary_file):
     return entries
 
 
+def read_glossaries(glossary_list, workers):
+    '''Read the entries of several glossary files in parallel.
+
+    The files are parsed by a pool of worker processes, but the entries
+    are returned file by file in the order of the glossary list. Only a
+    few files are handed out ahead of the one being returned, so that
+    the entries waiting to be processed do not pile up in memory.
+    '''
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+
+        for glossary_file in glossary_list:
+            pending.append(executor.submit(get_glossary_entries,
+                                           glossary_file))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+
+
 def remove_redundant_pairs(entries):
     '''Retain term pairs with a note if the exact same pair
        exists both with and without a note'''
 
-    # Build list of duplicates differentiated only by the presence of a note.
-    def find_duplicates(entries):
+    # Count the occurrences of each source and target pair, so that
+    # finding duplicates is a dictionary lookup rather than a search
+    # through a list.
+    pair_counts = Counter((entry[0], entry[1]) for entry in entries)
+
+    # Discard the entries without a note whose pair appears more than
+    # once, keeping the original order of the other entries.
+    glossary = [entry for entry in entries
+                if entry[2] != '' or pair_counts[(entry[0], entry[1])] == 1]
+
+    return glossary
+
+
+def write_sorted_run(entries, run_folder, run_number):
+    '''Sort a batch of entries and save it to a temporary file.'''
+
+    run_file = common.Path(run_folder, f'run{run_number:05}.tsv')
+
+    with open(run_file, 'w', encoding='utf-8', newline='') as rf:
+        rwriter = csv.writer(rf, delimiter='\t')
+        rwriter.writerows(sorted(set(entries)))
+
+    return run_file
 
-        pairs = [(term[0], term[1]) for term in entries]
-        duplicates = []
-        found = set()
-        
-        for pair in pairs:
-            if pair in found:
-                duplicates.append(pair)
-            else:
-                found.add(pair)
-        
-        return duplicates
-    
-    
-    # Identify duplicate pairs that have no notes and should be discarded.
-    def identify_discards(duplicates):
 
-        discard = []
+def read_sorted_run(run_file):
+    '''Read back the entries of a sorted run.'''
+
+    with open(run_file, 'r', encoding='utf-8', newline='') as rf:
+        for line in csv.reader(rf, delimiter='\t'):
+            yield tuple(line)
+
+
+def remove_redundant_sorted_pairs(entries):
+    '''Apply the deduplication rules to entries sorted by source and target.
+
+    Since identical entries and entries with the same pair are next to
+    each other, each group of entries can be dealt with on its own
+    without keeping the other entries in memory.
+    '''
+
+    for _, group in groupby(entries, key=lambda entry: entry[:2]):
+        # Remove exact duplicates, which follow each other.
+        unique = [entry for entry, _ in groupby(group)]
+
+        # Retain the pairs with a note if the same pair exists
+        # both with and without a note.
+        if len(unique) > 1:
+            unique = [entry for entry in unique if entry[2] != '']
+
+        yield from unique
+
+
+def external_merge(entries, run_size):
+    '''Merge glossary entries without holding all of them in memory.
+
+    The entries are split into sorted runs of at most run_size entries,
+    which are saved to temporary files and then merged back together
+    while applying the deduplication rules. The merged entries are
+    sorted by source and target terms.
+    '''
+
+    with tempfile.TemporaryDirectory(prefix='glossary_merge_') as run_folder:
+        run_files = []
+        batch = []
 
         for entry in entries:
-            pair = (entry[0], entry[1])
+            batch.append(entry)
+            if len(batch) >= run_size:
+                run_files.append(write_sorted_run(batch, run_folder,
+                                                  len(run_files)))
+                batch = []
 
-            if pair in duplicates:
-                if entry[2] == '':
-                    discard.append(entry)
-        
-        return discard
-    
-    # Main function code starts here
-    discard = identify_discards(find_duplicates(entries))
-    glossary = [entry for entry in entries if not entry in discard]
+        if batch:
+            run_files.append(write_sorted_run(batch, run_folder,
+                                              len(run_files)))
+            batch = []
 
-    return glossary
+        runs = [read_sorted_run(run_file) for run_file in run_files]
+        yield from remove_redundant_sorted_pairs(heapq.merge(*runs))
+
+
+def merge_entries(all_entries):
+    '''Remove duplicates and redundant pairs from the glossary entries.'''
+
+    if glossary_settings['external']:
+        # Merge the entries through sorted runs saved to disk. The runs
+        # are only read and written as the merged glossary is written.
+        merged_glossary = external_merge(all_entries,
+                                         glossary_settings['run_size'])
+    else:
+        # Remove exact duplicates and any remaining redundant pairs,
+        # keeping the entries in the order they were read.
+        with common.profile_stage('read_glossaries') as stage:
+            all_entries = list(dict.fromkeys(all_entries))
+            stage.items = len(all_entries)
+
+        with common.profile_stage('remove_redundant_pairs',
+                                  len(all_entries)):
+            merged_glossary = remove_redundant_pairs(all_entries)
+
+    return merged_glossary
+
+
+def normalize_term(term):
+    '''Reduce a term to the form it shares with its near-duplicates.
+
+    Full-width and half-width characters are unified, capitals are
+    lowered, and hyphens, dashes and spaces are removed.
+    '''
+
+    term = unicodedata.normalize('NFKC', term).casefold()
+
+    return ''.join(term.translate(HYPHENS).split())
+
+
+def get_blocking_key(entry):
+    '''Group an entry with the entries that may be near-duplicates.'''
 
+    return (normalize_term(entry[0]), normalize_term(entry[1]))
 
-def write_glossary(glossary):
-    '''Write the final merged glossary to a new file.'''
+
+def get_similarity(entry, other):
+    '''Compare the terms of two entries of the same group.
+
+    Only the width and case of the characters are ignored, so that
+    entries whose terms differ by too many hyphens or spaces for their
+    length are not considered near-duplicates.
+    '''
+
+    ratios = (SequenceMatcher(None,
+                              unicodedata.normalize('NFKC', term).casefold(),
+                              unicodedata.normalize('NFKC', other_term).casefold()
+                             ).ratio()
+              for term, other_term in zip(entry[:2], other[:2]))
+
+    return min(ratios)
+
+
+def find_near_duplicates(entries, threshold):
+    '''Find the clusters of near-duplicate entries.
+
+    The entries are grouped by blocking key, and only the entries of
+    the same group are compared, each one joining the first cluster
+    with a similar entry. Clusters of entries that only differ in
+    their notes are left to the duplicate rule. Returns the clusters
+    as lists of positions in the entries, in the order of the entries.
+    '''
+
+    blocks = {}
+    for position, entry in enumerate(entries):
+        blocks.setdefault(get_blocking_key(entry), []).append(position)
+
+    clusters = []
+    for positions in blocks.values():
+        if len(positions) < 2:
+            continue
+
+        groups = []
+        for position in positions:
+            for group in groups:
+                if any(get_similarity(entries[position], entries[member])
+                       >= threshold for member in group):
+                    group.append(position)
+                    break
+            else:
+                groups.append([position])
+
+        clusters.extend(group for group in groups
+                        if len({entries[member][:2] for member in group}) > 1)
+
+    return sorted(clusters)
+
+
+def collapse_near_duplicates(entries, clusters):
+    '''Keep a single entry of each cluster, unless several have notes.
+
+    As for duplicates, the entries with a note are preferred, and the
+    first entry of the cluster is kept if none has one.
+    '''
+
+    dropped = set()
+    for cluster in clusters:
+        kept = [position for position in cluster
+                if entries[position][2] != ''] or cluster[:1]
+        dropped.update(set(cluster).difference(kept))
+
+    return [entry for position, entry in enumerate(entries)
+            if position not in dropped]
+
+
+def cluster_near_duplicates(glossary):
+    '''Find the near-duplicates of the merged glossary.
+
+    The near-duplicates are collapsed if set. Returns the glossary and
+    the clusters found in it.
+    '''
+
+    glossary = list(glossary)
+
+    with common.profile_stage('find_near_duplicates', len(glossary)):
+        clusters = find_near_duplicates(glossary,
+                                        glossary_settings['similarity'])
+
+    if glossary_settings['near_duplicates'] == 'collapse':
+        glossary = collapse_near_duplicates(glossary, clusters)
+
+    return glossary, clusters
+
+
+def write_clusters(glossary, clusters, cluster_file):
+    '''Save the clusters of near-duplicates for review.
+
+    The file is tab-separated, but does not use one of the extensions of
+    glossary files, so that it is not merged with them the next time.
+    '''
+
+    with open(cluster_file, 'w', encoding='utf-8', newline='') as cf:
+        cwriter = csv.writer(cf, delimiter='\t')
+
+        cwriter.writerow(CLUSTER_COLUMNS)
+        for number, cluster in enumerate(clusters, start=1):
+            cwriter.writerows((number,) + glossary[position]
+                              for position in cluster)
+
+
+def write_glossary(glossary, merged_file=None):
+    '''Write the final merged glossary to a new file.
+
+    The user is asked for the name of the file if none was passed.
+    Returns the name of the file written.
+    '''
+
+    if merged_file is not None:
+        save_glossary(glossary, merged_file)
+        return merged_file
 
     title = 'Enter name of file to save'
     glossary_files = [('Glossary file', glossary_settings['extensions'])]
@@ -142,36 +416,128 @@ def write_glossary(glossary):
                                             title)
     merged_file = common.Path(glossary_path/merged_name)
 
+    save_glossary(glossary, merged_file)
+
+    return merged_file
+
+
+def save_glossary(glossary, merged_file):
+    '''Save the merged glossary entries to a file.'''
+
     glossary_header=['# Glossary in tab-separated format -*- coding: utf-8 -*-']
 
-    with open(merged_file, 'w', encoding='utf-8', newline='') as mf:
+    with common.profile_stage('write_glossary') as stage, \
+         common.open_file(merged_file, 'wt', encoding='utf-8',
+                          newline='') as mf:
         gwriter = csv.writer(mf, delimiter='\t')
 
         gwriter.writerow(glossary_header)
-        gwriter.writerows(glossary)
-
 
-if __name__ == '__main__':
+        # The glossary may be a generator, so count the entries written.
+        entry_count = 0
+        for entry in glossary:
+            gwriter.writerow(entry)
+            entry_count += 1
+        stage.items = entry_count
+
+
+def parse_arguments(args=None):
+    '''Read the command line arguments.'''
+
+    parser = argparse.ArgumentParser(description='Merge OmegaT glossaries '
+                                                 'without duplicates.')
+    parser.add_argument('glossary_path', type=common.Path, nargs='?',
+                        help='folder with the glossary files to merge')
+    parser.add_argument('-o', '--output', type=common.Path,
+                        help='merged glossary file to write')
+    parser.add_argument('--config', type=common.Path,
+                        help='configuration file to use')
+    parser.add_argument('--cache', action='store_true', default=None,
+                        help='reuse the entries of unchanged glossaries')
+    parser.add_argument('--external', action='store_true', default=None,
+                        help='merge through sorted temporary files')
+    parser.add_argument('--workers', type=int,
+                        help='number of worker processes')
+    parser.add_argument('--near-duplicates', dest='near_duplicates',
+                        choices=NEAR_DUPLICATE_MODES,
+                        help='list near-duplicate entries for review, or '
+                             'collapse them')
+    common.add_profile_arguments(parser)
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    '''Merge the glossaries, asking for any path not passed.'''
+
+    global glossary_settings, glossary_path
+
+    arguments = parse_arguments(args)
+    common.start_profiling(arguments)
+    if arguments.config is not None:
+        common.load_config(arguments.config)
 
     # Retrieve configuration information for glossaries
     glossary_settings = get_glossary_settings()
+    for setting in ('cache', 'external', 'workers', 'near_duplicates'):
+        if getattr(arguments, setting) is not None:
+            glossary_settings[setting] = getattr(arguments, setting)
+
+    try:
+        check_glossary_settings(glossary_settings)
+    except ValueError as error:
+        raise SystemExit(error)
+
+    # As in the configuration file, 0 uses every available core.
+    if glossary_settings['workers'] < 1:
+        glossary_settings['workers'] = os.cpu_count() or 1
 
     # Retrieve list of glossaries to merge
-    askfolder = 'Select folder with glossary files'
-    glossary_path = common.select_folder(set_base_glossary_path(), askfolder)
+    if arguments.glossary_path is None:
+        askfolder = 'Select folder with glossary files'
+        glossary_path = common.select_folder(set_base_glossary_path(),
+                                             askfolder)
+    else:
+        glossary_path = arguments.glossary_path
 
     glossary_list = get_glossary_list(glossary_path)
 
-    # Build list of all entries from each glossary
-    all_entries = []
-
-    for glossary_file in glossary_list:
-        entries = get_glossary_entries(glossary_file)
-        all_entries.extend(entries)
-    
-    # Remove exact duplicates and any remaining redundant pairs
-    all_entries = list(set(all_entries))
-    merged_glossary = remove_redundant_pairs(all_entries)
+    # Read the entries from each glossary, going through the cache
+    # of previously read entries if it is enabled.
+    if glossary_settings['cache']:
+        cache = GlossaryCache(glossary_path, get_glossary_entries)
+        all_entries = cache.read_glossaries(glossary_list,
+                                            glossary_settings['workers'])
+    else:
+        cache = None
+        all_entries = read_glossaries(glossary_list,
+                                      glossary_settings['workers'])
+
+    merged_glossary = merge_entries(all_entries)
+
+    clusters = None
+    if glossary_settings['near_duplicates'] != 'no':
+        merged_glossary, clusters = cluster_near_duplicates(merged_glossary)
     
     # Write merged glossary to a file
-    write_glossary(merged_glossary)
+    merged_file = write_glossary(merged_glossary, arguments.output)
+
+    if clusters is not None and glossary_settings['near_duplicates'] == 'review':
+        merged_name = common.strip_compression_suffix(merged_file)
+        cluster_file = merged_file.with_name(merged_name.stem
+                                             + '-clusters.tab')
+        write_clusters(merged_glossary, clusters, cluster_file)
+        print(f'{len(clusters)} clusters of near-duplicates listed in '
+              f'{cluster_file}')
+    elif clusters is not None:
+        print(f'{len(clusters)} clusters of near-duplicates collapsed')
+
+    if cache is not None:
+        print(f'{len(cache.parsed)} glossary files read, '
+              f'{len(glossary_list) - len(cache.parsed)} taken from the cache, '
+              f'{len(cache.removed)} removed from the cache')
+        cache.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+
+'''Keep a catalog of OmegaT projects in a SQLite database.
+
+This script finds the OmegaT projects in a folder in the same way as the
+"collect_omegat_project_data" script, and records the root folder, memory
+and glossary files, source and target languages, translators, number of
+translation units, and date of the latest change of each project in an
+indexed SQLite database.
+
+Updating the catalog only reads the projects that were added or changed
+since the last update, and removes the projects that no longer exist.
+The catalog can then be queried by language pair, translator or date of
+the latest change, and the projects found can be collected, have their
+glossaries merged, or have their memories split by translator without
+searching and reading the whole folder tree again.
+
+Usage examples:
+
+    python project_catalog.py update ~/Documents/OmegaT_Projects
+    python project_catalog.py query --source EN --target JA --since 2024-03-01
+    python project_catalog.py collect --target JA /path/to/destination
+    python project_catalog.py merge --target JA /path/to/merged_glossary.txt
+    python project_catalog.py extract --translator "Translator A"
+
+Requires:
+  - Python 3.7 or higher
+  - lxml
+'''
+
+###########################################################################
+#
+# OmegaT Project Catalog
+# ---------------------------
+# Version 0.1
+# License: GPL3+
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+###########################################################################
+
+import argparse
+import sqlite3
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from lxml import etree
+
+import common
+import collect_omegat_project_data as collect
+import extract_segments as extract
+import merge_omegat_glossaries as merge
+
+# Constants
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS projects
+    (id INTEGER PRIMARY KEY,
+     name TEXT,
+     root TEXT UNIQUE,
+     memory TEXT,
+     glossary TEXT,
+     source_lang TEXT,
+     target_lang TEXT,
+     tu_count INTEGER,
+     last_change TEXT,
+     project_mtime INTEGER,
+     memory_size INTEGER,
+     memory_mtime INTEGER);
+CREATE TABLE IF NOT EXISTS translators
+    (project_id INTEGER REFERENCES projects(id) ON DELETE CASCADE,
+     name TEXT,
+     tu_count INTEGER,
+     PRIMARY KEY (project_id, name));
+CREATE INDEX IF NOT EXISTS project_languages
+    ON projects(source_lang, target_lang);
+CREATE INDEX IF NOT EXISTS project_changes ON projects(last_change);
+CREATE INDEX IF NOT EXISTS translator_projects ON translators(name);
+'''
+
+
+def get_catalog_file():
+    '''Read the path of the catalog database from the configuration file.'''
+
+    if common.config.has_option('Paths', 'catalog'):
+        return common.Path(common.config['Paths']['catalog'])
+
+    return None
+
+
+def open_catalog(catalog_file):
+    '''Open the catalog database, creating it if necessary.'''
+
+    connection = sqlite3.connect(catalog_file)
+    connection.execute('PRAGMA foreign_keys = ON')
+    connection.executescript(SCHEMA)
+
+    return connection
+
+
+def get_stat(filepath):
+    '''Retrieve the size and modification time of a file, if it exists.'''
+
+    try:
+        stat = filepath.stat()
+    except OSError:
+        return (None, None)
+
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def read_project_languages(project_file):
+    '''Read the source and target languages from an OmegaT project file.'''
+
+    try:
+        project = etree.parse(str(project_file)).getroot()
+    except (OSError, etree.XMLSyntaxError):
+        return (None, None)
+
+    return (project.findtext('project/source_lang'),
+            project.findtext('project/target_lang'))
+
+
+def read_memory_stats(memory):
+    '''Count the translation units of each translator in a memory.
+
+    The memory is read in a single pass, and returns the total number
+    of translation units, the number of units last changed by each
+    translator, and the date of the latest change. Compressed memories
+    are decompressed as they are read.
+    '''
+
+    tu_count = 0
+    translators = Counter()
+    last_change = None
+
+    if not memory.exists():
+        return tu_count, translators, last_change
+
+    with common.open_file(memory) as mf:
+        for _, tu in etree.iterparse(mf, tag='tu'):
+            tu_count += 1
+            tuvs = tu.findall('tuv')
+
+            # The translation is always in the second tuv element.
+            if len(tuvs) > 1:
+                translation = tuvs[1].attrib
+                translator = translation.get('changeid',
+                                             translation.get('creationid'))
+                if translator is not None:
+                    translators[translator] += 1
+
+                changedate = translation.get('changedate',
+                                             translation.get('creationdate'))
+                if changedate is not None and (last_change is None
+                                               or changedate > last_change):
+                    last_change = changedate
+
+            # Discard the tu and any processed elements before it.
+            tu.clear()
+            while tu.getprevious() is not None:
+                del tu.getparent()[0]
+
+    return tu_count, translators, last_change
+
+
+def read_project(project, memory, glossary, project_file):
+    '''Gather the catalog information of a single project.
+
+    Returns only the root of the project and the error if its memory
+    cannot be read.
+    '''
+
+    source_lang, target_lang = read_project_languages(project_file)
+    try:
+        tu_count, translators, last_change = read_memory_stats(memory)
+    except (OSError, EOFError, etree.XMLSyntaxError) as error:
+        return {'root':str(project), 'error':str(error)}
+
+    return {'name':project.name,
+            'root':str(project),
+            'memory':str(memory),
+            'glossary':str(glossary),
+            'source_lang':source_lang,
+            'target_lang':target_lang,
+            'tu_count':tu_count,
+            'last_change':last_change,
+            'project_mtime':get_stat(project_file)[1],
+            'memory_size':get_stat(memory)[0],
+            'memory_mtime':get_stat(memory)[1],
+            'translators':dict(translators)
+           }
+
+
+def store_project(connection, project):
+    '''Save or replace the catalog information of a project.'''
+
+    connection.execute('DELETE FROM projects WHERE root = ?',
+                       (project['root'],))
+    cursor = connection.execute('''INSERT INTO projects
+                                   (name, root, memory, glossary, source_lang,
+                                    target_lang, tu_count, last_change,
+                                    project_mtime, memory_size, memory_mtime)
+                                   VALUES (:name, :root, :memory, :glossary,
+                                           :source_lang, :target_lang,
+                                           :tu_count, :last_change,
+                                           :project_mtime, :memory_size,
+                                           :memory_mtime)''', project)
+
+    connection.executemany('''INSERT INTO translators
+                              VALUES (?, ?, ?)''',
+                           [(cursor.lastrowid, name, count) for name, count
+                            in project['translators'].items()])
+
+
+def update_catalog(connection, searchpath, workers=None):
+    '''Bring the catalog up to date with the projects in a folder.
+
+    Projects whose project file and memory have not changed since the
+    last update are left as they are, the others are read again in
+    parallel, and projects that no longer exist are removed. Projects
+    whose memory cannot be read are reported and left as they are.
+    The paths are saved as absolute paths, whatever the search path.
+
+    Returns the number of projects read and removed.
+    '''
+
+    PROJECT = collect.project_settings['project_file']
+    MEMORY = collect.project_settings['main_memory']
+    GLOSSARY = collect.project_settings['main_glossary']
+
+    searchpath = common.Path(searchpath).resolve()
+    projects = collect.make_project_list(searchpath)
+
+    records = {root:(project_mtime, memory_size, memory_mtime)
+               for root, project_mtime, memory_size, memory_mtime
+               in connection.execute('''SELECT root, project_mtime,
+                                               memory_size, memory_mtime
+                                        FROM projects''')}
+
+    changed = []
+    read = 0
+    for project in projects:
+        project_file = common.Path(project, PROJECT)
+        memory = common.Path(project, MEMORY)
+        glossary = common.Path(project, GLOSSARY)
+        current = (get_stat(project_file)[1],) + get_stat(memory)
+
+        if records.get(str(project)) != current:
+            changed.append((project, memory, glossary, project_file))
+
+    if changed:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for project in executor.map(read_project, *zip(*changed)):
+                if 'error' in project:
+                    print('Failed to read '+project['root']+': '
+                          +project['error'])
+                    continue
+                store_project(connection, project)
+                read += 1
+
+    # Remove the projects that were not found under the search path.
+    found = {str(project) for project in projects}
+    searchroot = str(searchpath)
+    removed = [root for root in records if root not in found
+               and common.is_inside(root, searchroot)]
+    connection.executemany('DELETE FROM projects WHERE root = ?',
+                           [(root,) for root in removed])
+
+    connection.commit()
+
+    return read, len(removed)
+
+
+def to_tmx_date(date):
+    '''Convert a YYYY-MM-DD date to the date format used in TMX files.'''
+
+    return date.replace('-', '') + 'T000000Z'
+
+
+def query_projects(connection, source=None, target=None, since=None,
+                   translator=None):
+    '''Find the projects matching the criteria given.
+
+    Languages match on their beginning, so that "EN" matches both "EN-US"
+    and "EN-GB", for example. The date is in YYYY-MM-DD format, and matches
+    the projects with a change on or after that date.
+    '''
+
+    conditions = []
+    parameters = []
+
+    if source is not None:
+        conditions.append('upper(source_lang) LIKE ?')
+        parameters.append(source.upper() + '%')
+    if target is not None:
+        conditions.append('upper(target_lang) LIKE ?')
+        parameters.append(target.upper() + '%')
+    if since is not None:
+        conditions.append('last_change >= ?')
+        parameters.append(to_tmx_date(since))
+    if translator is not None:
+        conditions.append('''id IN (SELECT project_id FROM translators
+                                    WHERE name = ?)''')
+        parameters.append(translator)
+
+    query = 'SELECT * FROM projects'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY root'
+
+    connection.row_factory = sqlite3.Row
+    rows = connection.execute(query, parameters).fetchall()
+    connection.row_factory = None
+
+    return rows
+
+
+def get_project_data(rows):
+    '''Link project names to their memory and glossary files.
+
+    The result has the same format as collate_project_data in the
+    "collect_omegat_project_data" script.
+    '''
+
+    return {row['name']:(common.Path(row['memory']),
+                         common.Path(row['glossary']))
+            for row in rows}
+
+
+def get_memories(rows):
+    '''List the memories of projects that exist.'''
+
+    return [common.Path(row['memory']) for row in rows
+            if common.Path(row['memory']).exists()]
+
+
+def get_glossaries(rows):
+    '''List the glossaries of projects that exist.'''
+
+    return [common.Path(row['glossary']) for row in rows
+            if common.Path(row['glossary']).exists()]
+
+
+def print_projects(rows):
+    '''Output the projects found to the console.'''
+
+    for row in rows:
+        print(f"{row['name']}\t{row['source_lang']}\t{row['target_lang']}\t"
+              f"{row['tu_count']}\t{row['last_change']}\t{row['root']}")
+
+
+def parse_arguments():
+    '''Read the command line arguments.'''
+
+    parser = argparse.ArgumentParser(description='Keep and query a catalog '
+                                                 'of OmegaT projects.')
+    parser.add_argument('--catalog', type=common.Path,
+                        help='catalog database file (default: set in the '
+                             'configuration file)')
+    parser.add_argument('--config', type=common.Path,
+                        help='configuration file to use')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    update = commands.add_parser('update', help='update the catalog')
+    update.add_argument('searchpath', type=common.Path, nargs='?',
+                        help='folder to search for projects')
+
+    for command, helptext in (('query', 'list the matching projects'),
+                              ('collect', 'collect the project data'),
+                              ('merge', 'merge the project glossaries'),
+                              ('extract', 'split the project memories by '
+                                          'translator')):
+        subparser = commands.add_parser(command, help=helptext)
+        subparser.add_argument('--source', help='source language')
+        subparser.add_argument('--target', help='target language')
+        subparser.add_argument('--since', help='date of the latest change '
+                                               '(YYYY-MM-DD)')
+        subparser.add_argument('--translator', help='translator name')
+
+        if command == 'collect':
+            subparser.add_argument('destination', type=common.Path,
+                                   help='destination folder')
+        elif command == 'merge':
+            subparser.add_argument('merged_file', type=common.Path,
+                                   help='merged glossary file')
+
+    common.add_profile_arguments(parser)
+
+    arguments = parser.parse_args()
+    if arguments.config is not None:
+        common.load_config(arguments.config)
+    if arguments.catalog is None:
+        arguments.catalog = get_catalog_file()
+    if arguments.catalog is None:
+        parser.error('no catalog set in the configuration file, '
+                     'use --catalog')
+
+    return arguments
+
+
+if __name__ == '__main__':
+
+    arguments = parse_arguments()
+    common.start_profiling(arguments)
+    collect.project_settings = collect.get_project_settings()
+    connection = open_catalog(arguments.catalog)
+
+    if arguments.command == 'update':
+        searchpath = arguments.searchpath
+        if searchpath is None:
+            configpath = collect.project_settings['configpath']
+            searchpath = common.set_basepath(configpath)
+
+        with common.profile_stage('update_catalog') as stage:
+            read, removed = update_catalog(connection, searchpath)
+            stage.items = read
+        print(f'{read} projects read, {removed} projects removed')
+
+    else:
+        with common.profile_stage('query_projects') as stage:
+            rows = query_projects(connection, arguments.source,
+                                  arguments.target, arguments.since,
+                                  arguments.translator)
+            stage.items = len(rows)
+
+        if arguments.command == 'query':
+            print_projects(rows)
+
+        elif arguments.command == 'collect':
+            collect.copy_project_data(get_project_data(rows),
+                                      arguments.destination)
+
+        elif arguments.command == 'merge':
+            merge.glossary_settings = merge.get_glossary_settings()
+            entries = merge.read_glossaries(get_glossaries(rows),
+                                            merge.glossary_settings['workers'])
+            merge.save_glossary(merge.merge_entries(entries),
+                                arguments.merged_file)
+
+        elif arguments.command == 'extract':
+            extract.batch_extract(get_memories(rows))
+
+    connection.close()
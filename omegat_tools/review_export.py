@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+
+'''Export the translations of each translator as tables for review.
+
+The translations of an OmegaT team project memory are sorted by original
+translator, as with the "extract_segments" script, and written as rows of
+source text, translation, translator and date to CSV files, Excel
+workbooks or HTML pages, which reviewers can read outside a CAT tool.
+
+When the original translations are passed (such as the files of the
+"tmx2source" folder of the project), a last column shows the changes made
+by the reviser to each revised translation, marked as in the
+"revision_diff" script.
+
+The TMX file is read as a stream and the rows are written in batches as
+it is read, so memory use does not grow with the size of the project.
+When changes are shown, only the original translations are kept in
+memory, and the changes of each batch are compared (or read from the
+cache file) just before it is written. The
+rows of each translator are split into files of a set number of rows
+("JA-TA-001.csv", "JA-TA-002.csv", and so on), set by the "chunk_size"
+option of the "Review" section of the configuration file.
+
+Usage examples:
+
+    python review_export.py project_save.tmx
+    python review_export.py --format html --status revised --originals tmx2source/ project_save.tmx
+
+Requires:
+  - Python 3.7 or higher
+  - lxml
+  - openpyxl (for Excel workbooks only)
+'''
+
+###########################################################################
+#
+# Review Export
+# ---------------------------
+# Version 0.1
+# License: GPL3+
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+###########################################################################
+
+import argparse
+import csv
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from html import escape
+
+import common
+from extract_segments import get_worker_count
+from filter_segments import match_status
+from revision_diff import (DiffCache, get_context, get_pair_key,
+                           load_originals, mark_pairs, parse_changes)
+from tmxhelpers import TranslationUnit, find_tmx_files, iter_tus
+
+try:
+    # Only needed to write Excel workbooks.
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+# Constants
+COLUMNS = ['source', 'target', 'translator', 'date']
+DIFF_COLUMN = 'changes'
+CHANGE_TAGS = {'delete': 'del', 'insert': 'ins'}
+DEFAULT_CHUNK_SIZE = 50000
+ROW_BATCH_SIZE = 10000
+HTML_HEADER = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+table {{border-collapse: collapse; width: 100%;}}
+th, td {{border: 1px solid #ccc; padding: 4px; vertical-align: top;}}
+th {{background: #eee; position: sticky; top: 0;}}
+del {{color: #b00;}}
+ins {{color: #070;}}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+'''
+HTML_FOOTER = '''</body>
+</html>
+'''
+
+
+def format_date(date):
+    '''Convert a TMX date such as 20240101T120000Z to a readable one.'''
+
+    if not date or len(date) < 15:
+        return date or ''
+
+    return (f'{date[0:4]}-{date[4:6]}-{date[6:8]} '
+            f'{date[9:11]}:{date[11:13]}:{date[13:15]}')
+
+
+def format_changes(markup):
+    '''Show the changes marked in a translation with HTML tags.'''
+
+    html = []
+    for operation, text in parse_changes(markup):
+        text = escape(text, quote=False)
+        tag = CHANGE_TAGS.get(operation)
+        if tag is not None:
+            text = f'<{tag}>{text}</{tag}>'
+        html.append(text)
+
+    return ''.join(html)
+
+
+class CSVPage():
+    '''Class for a single CSV file of an export.'''
+
+    suffix = '.csv'
+
+    def __init__(self, path, columns, title, number):
+        # The byte order mark lets Excel recognize UTF-8 files.
+        self.file = open(path, 'w', encoding='utf-8-sig', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+
+    def write_row(self, row):
+        self.writer.writerow(row)
+
+
+    def close(self, next_path=None):
+        self.file.close()
+
+
+class XLSXPage():
+    '''Class for a single Excel workbook of an export.
+
+    The workbook is created in write-only mode, in which rows are
+    written to a temporary file as they are added instead of being
+    kept in memory.
+    '''
+
+    suffix = '.xlsx'
+
+    def __init__(self, path, columns, title, number):
+        if Workbook is None:
+            raise RuntimeError('The openpyxl module is needed to write '
+                               'Excel workbooks.')
+
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(title[:31])
+        self.sheet.append(columns)
+
+
+    def write_row(self, row):
+        self.sheet.append(row)
+
+
+    def close(self, next_path=None):
+        self.workbook.save(self.path)
+
+
+class HTMLPage():
+    '''Class for a single page of an HTML export.
+
+    Each page links to the previous and next pages of the export. The
+    link to the next page is only added once it is known to exist.
+    '''
+
+    suffix = '.html'
+
+    def __init__(self, path, columns, title, number):
+        self.path = path
+        self.previous = None
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write(HTML_HEADER.format(title=escape(f'{title} '
+                                                        f'({number})')))
+        self.diff = DIFF_COLUMN in columns
+        self.file.write('<table>\n<tr>'
+                        + ''.join(f'<th>{escape(column)}</th>'
+                                  for column in columns)
+                        + '</tr>\n')
+
+
+    def write_row(self, row):
+        cells = [escape(value) for value in row]
+        if self.diff:
+            cells[-1] = format_changes(row[-1])
+        self.file.write('<tr>' + ''.join(f'<td>{cell}</td>' for cell in cells)
+                        + '</tr>\n')
+
+
+    def close(self, next_path=None):
+        links = []
+        if self.previous is not None:
+            links.append(f'<a href="{escape(self.previous.name)}">'
+                         'Previous</a>')
+        if next_path is not None:
+            links.append(f'<a href="{escape(next_path.name)}">Next</a>')
+
+        self.file.write('</table>\n')
+        if links:
+            self.file.write('<p>' + ' | '.join(links) + '</p>\n')
+        self.file.write(HTML_FOOTER)
+        self.file.close()
+
+
+# Classes writing each output format
+FORMATS = {'csv':CSVPage,
+           'xlsx':XLSXPage,
+           'html':HTMLPage
+          }
+
+
+class ChunkedExport():
+    '''Class to split the rows of an export into numbered files.
+
+    A new file is only started when a row is added to a full one, so
+    that the last file is never empty, and each file knows whether
+    another one follows it.
+    '''
+
+    def __init__(self, basepath, page_class, columns, chunk_size):
+        self.basepath = basepath
+        self.page_class = page_class
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.page = None
+        self.row_count = 0
+        self.files = []
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def new_page(self):
+        '''Close the current file, if any, and start the next one.'''
+
+        number = len(self.files) + 1
+        path = self.basepath.with_name(f'{self.basepath.name}-{number:03}'
+                                       + self.page_class.suffix)
+        if self.page is not None:
+            self.page.close(path)
+
+        page = self.page_class(path, self.columns, self.basepath.name,
+                               number)
+        page.previous = self.files[-1] if self.files else None
+        self.page = page
+        self.files.append(path)
+
+
+    def write_row(self, row):
+        '''Add a row to the current file, starting a new one if full.'''
+
+        if self.row_count % self.chunk_size == 0:
+            self.new_page()
+        self.page.write_row(row)
+        self.row_count += 1
+
+
+    def close(self):
+        '''Close the last file of the export.'''
+
+        if self.page is not None:
+            self.page.close()
+            self.page = None
+
+
+class ChangeFinder():
+    '''Class to mark the changes of revised translations as they are exported.
+
+    The original translations are loaded once, and the changes of each
+    batch of rows are compared by a pool of worker processes, unless
+    they are in the cache. Only the changes of the current batch are
+    kept in memory.
+    '''
+
+    def __init__(self, original_files, level='word', cache_file=None,
+                 workers=None):
+        self.originals = load_originals(original_files)
+        self.level = level
+        self.cache = DiffCache(cache_file)
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        '''Stop the worker processes and close the cache.'''
+
+        self.executor.shutdown()
+        self.cache.close()
+
+
+    def get_pair(self, record):
+        '''Return the original and revised translation of a record.
+
+        Returns None unless the translation was revised and its original
+        translation is known and different.
+        '''
+
+        if not record.is_revised:
+            return None
+
+        original = self.originals.get((record.creationid,)
+                                      + get_context(record))
+        if original is None or original == record.target:
+            return None
+
+        return original, record.target
+
+
+    def mark(self, pairs):
+        '''Return the changes of each pair, or "" where there is none.'''
+
+        keys = [None if pair is None else get_pair_key(*pair, self.level)
+                for pair in pairs]
+        revised = {key:pair for key, pair in zip(keys, pairs)
+                   if key is not None}
+
+        self.cache.clear()
+        with common.profile_stage('mark_changes') as stage:
+            compared = mark_pairs(revised, self.cache, self.level,
+                                  self.executor)
+            stage.items = compared
+
+        return ['' if key is None else self.cache.changes[key]
+                for key in keys]
+
+
+def write_rows(exports, rows, changes=None):
+    '''Write a batch of rows, adding the changes of each if given.
+
+    The rows are pairs of translator code and row, with the pair of
+    original and revised translations if changes are given.
+    '''
+
+    if changes is not None:
+        markups = changes.mark([pair for _, _, pair in rows])
+        for (_, row, _), markup in zip(rows, markups):
+            row.append(markup)
+
+    for code, row, _ in rows:
+        exports[code].write_row(row)
+
+    return len(rows)
+
+
+def get_chunk_size():
+    '''Read the number of rows written to each file.'''
+
+    chunk_size = common.config.getint('Review', 'chunk_size',
+                                      fallback=DEFAULT_CHUNK_SIZE)
+
+    return max(chunk_size, 1)
+
+
+def export_review(tmxfile, output_format='csv', status=None, changes=None,
+                  chunk_size=None):
+    '''Write the translations of each translator to review files.
+
+    The translations are sorted by original translator, for the
+    translators in the configuration file, and only those matching
+    the status are written if one is given. The changes marked in
+    revised translations are added as a last column if a ChangeFinder
+    is given. The files are saved in the folder of the TMX file.
+    Returns the list of files written for each translator code.
+
+    A translation without a language is named with the language of the
+    previous translations, and skipped if no language was found yet.
+    '''
+
+    translator_list = dict(common.config.items('Translators'))
+    tmxpath = common.Path(tmxfile).parent
+    page_class = FORMATS[output_format]
+    columns = COLUMNS + [DIFF_COLUMN] if changes is not None else COLUMNS
+    check_status = match_status(status) if status is not None else None
+
+    if chunk_size is None:
+        chunk_size = get_chunk_size()
+
+    exports = {}
+    tgtlang = None
+    skipped = 0
+
+    with ExitStack() as writers:
+        stage = writers.enter_context(common.profile_stage('export_review'))
+        row_count = 0
+        batch = []
+
+        for tu in iter_tus(tmxfile):
+            record = TranslationUnit.from_element(tu)
+            if record.creationid not in translator_list:
+                continue
+            if check_status is not None and not check_status(record):
+                continue
+
+            # Name the files as the per translator TMX files.
+            tgtlang = record.tgtlang or tgtlang
+            if tgtlang is None:
+                skipped += 1
+                continue
+            code = tgtlang[:2] + '-' + translator_list[record.creationid]
+            if code not in exports:
+                exports[code] = writers.enter_context(
+                    ChunkedExport(tmxpath/code, page_class, columns,
+                                  chunk_size))
+
+            row = [record.source, record.target, record.creationid,
+                   format_date(record.changedate or record.creationdate)]
+            pair = changes.get_pair(record) if changes is not None else None
+            batch.append((code, row, pair))
+
+            if len(batch) >= ROW_BATCH_SIZE:
+                row_count += write_rows(exports, batch, changes)
+                batch = []
+
+        row_count += write_rows(exports, batch, changes)
+        stage.items = row_count
+
+    if skipped:
+        print(f'{skipped} translations skipped in {tmxfile}: '
+              f'no target language found before them')
+
+    return {code:export.files for code, export in exports.items()}
+
+
+def parse_arguments():
+    '''Read the command line arguments.'''
+
+    parser = argparse.ArgumentParser(description='Export the translations '
+                                                 'of each translator for '
+                                                 'review.')
+    parser.add_argument('tmxfile', type=common.Path,
+                        help='memory of the team project')
+    parser.add_argument('--format', choices=FORMATS, dest='output_format',
+                        help='format of the files written (default: csv)')
+    parser.add_argument('--status', choices=('revised', 'unrevised'),
+                        help='only export revised or unrevised translations')
+    parser.add_argument('--originals', nargs='+', type=common.Path,
+                        help='TMX files or folders with the original '
+                             'translations, to show the changes made')
+    parser.add_argument('--level', choices=('word', 'char'), default='word',
+                        help='compare words or characters')
+    parser.add_argument('--cache', type=common.Path,
+                        help='file in which to keep the changes found')
+    parser.add_argument('--chunk-size', type=int,
+                        help='number of rows in each file')
+    parser.add_argument('--workers', type=int,
+                        help='number of worker processes')
+    parser.add_argument('--config', type=common.Path,
+                        help='configuration file to use')
+    common.add_profile_arguments(parser)
+
+    arguments = parser.parse_args()
+    if arguments.output_format == 'xlsx' and Workbook is None:
+        parser.error('the openpyxl module is needed to write Excel '
+                     'workbooks')
+
+    return arguments
+
+
+if __name__ == '__main__':
+
+    arguments = parse_arguments()
+    common.start_profiling(arguments)
+    if arguments.config is not None:
+        common.load_config(arguments.config)
+
+    output_format = arguments.output_format or \
+                    common.config.get('Review', 'format', fallback='csv')
+    if output_format not in FORMATS:
+        raise SystemExit(f'Unknown review format "{output_format}", use '
+                         + ', '.join(FORMATS))
+    if output_format == 'xlsx' and Workbook is None:
+        raise SystemExit('The openpyxl module is needed to write Excel '
+                         'workbooks.')
+
+    with ExitStack() as stack:
+        changes = None
+        if arguments.originals:
+            # Leave out the project memory if it is in one of the folders.
+            original_files = [tmx for tmx
+                              in find_tmx_files(arguments.originals)
+                              if tmx.resolve() != arguments.tmxfile.resolve()]
+            with common.profile_stage('load_originals'):
+                changes = stack.enter_context(
+                    ChangeFinder(original_files, arguments.level,
+                                 arguments.cache,
+                                 get_worker_count(arguments.workers)))
+
+        exports = export_review(arguments.tmxfile, output_format,
+                                arguments.status, changes,
+                                arguments.chunk_size)
+    for code, files in exports.items():
+        print(f'{code}: {len(files)} files written')
@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+
+'''Mark the changes made by revisers to each translator's translations.
+
+In an OmegaT team project, a translation revised by another translator
+keeps the name of its original translator as "creationid", but the
+"changeid" becomes that of the reviser, and the memory of the project only
+keeps the revised translation. The original translations are found in the
+files created by the "extract_segments" script before the revision (such
+as the files placed in the "tmx2source" folder of the project).
+
+This script pairs each revised translation of the project memory with the
+original translation by the same translator, and compares them word by
+word (or character by character), marking deleted text as [-deleted-] and
+inserted text as {+inserted+}. Brackets and backslashes already in the
+translations are escaped with a backslash, so that the markup can be read
+back without mistaking them for changes. The changes are written either
+as a note in a TMX file of the revised translations of each translator,
+or to a tab-separated file for review outside a CAT tool.
+
+The comparisons are run in parallel, and each different pair of original
+and revised translations is only compared once. The results can also be
+kept in a cache file, so that translations compared in a previous run are
+not compared again.
+
+Usage examples:
+
+    python revision_diff.py project_save.tmx tmx2source/
+    python revision_diff.py --sidecar changes.tsv --level char project_save.tmx JA-TA.tmx JA-TB.tmx
+
+Requires:
+  - Python 3.7 or higher
+  - lxml
+'''
+
+###########################################################################
+#
+# Revision Diff
+# ---------------------------
+# Version 0.1
+# License: GPL3+
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+###########################################################################
+
+import argparse
+import csv
+import difflib
+import hashlib
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+
+from lxml import etree
+
+import common
+from extract_segments import get_worker_count
+from tmxhelpers import (OmegaT_TMXWriter, TranslationUnit, TMXfile,
+                        find_tmx_files, get_tuv_lang, iter_tus,
+                        read_tmx_header)
+
+# Constants
+CONTEXT_PROPS = ('file', 'id', 'prev', 'next')
+WORD_PATTERN = re.compile(r'\w+|\s+|[^\w\s]')
+CHUNK_SIZE = 500
+REVISIONS_SUFFIX = '-revisions.tmx'
+SIDECAR_COLUMNS = ['source', 'original', 'revised', 'translator', 'reviser',
+                   'date', 'changes']
+MARKUP_ESCAPES = str.maketrans({'\\': '\\\\', '[': '\\[', ']': '\\]',
+                                '{': '\\{', '}': '\\}'})
+MARKUP_PATTERN = re.compile(r'\[-((?:\\.|[^\\\]])*)-\]'
+                            r'|\{\+((?:\\.|[^\\}])*)\+\}'
+                            r'|((?:\\.|[^\\\[{])+)', re.DOTALL)
+UNESCAPE_PATTERN = re.compile(r'\\(.)', re.DOTALL)
+
+
+def get_context(record):
+    '''Identify a translation by its source text and context properties.'''
+
+    return (record.source,) + tuple(record.get_prop(prop_type)
+                                    for prop_type in CONTEXT_PROPS)
+
+
+def load_originals(tmxfiles):
+    '''Read the original translations of each translator.
+
+    Only unrevised translations are kept, indexed by translator and
+    context. When a translation appears in several files, the last
+    one read is kept.
+    '''
+
+    originals = {}
+
+    for tmxfile in tmxfiles:
+        for record in TMXfile(tmxfile):
+            if not record.is_revised and record.creationid is not None:
+                originals[(record.creationid,) + get_context(record)] = \
+                    record.target
+
+    return originals
+
+
+def split_text(text, level='word'):
+    '''Split a translation into the units to compare.
+
+    At the word level, words, spaces and punctuation marks are separate
+    units. Languages written without spaces are better compared at the
+    character level.
+    '''
+
+    if level == 'char':
+        return list(text)
+
+    return WORD_PATTERN.findall(text)
+
+
+def get_changes(original, revised, level='word'):
+    '''Find the differences between an original and revised translation.
+
+    Returns a list of (operation, text) pairs, where the operation is
+    "equal", "delete" or "insert", with replaced text given as a
+    deletion followed by an insertion.
+    '''
+
+    original_units = split_text(original, level)
+    revised_units = split_text(revised, level)
+    matcher = difflib.SequenceMatcher(None, original_units, revised_units,
+                                      autojunk=False)
+    changes = []
+
+    for operation, start1, end1, start2, end2 in matcher.get_opcodes():
+        deleted = ''.join(original_units[start1:end1])
+        inserted = ''.join(revised_units[start2:end2])
+
+        if operation == 'equal':
+            changes.append(('equal', deleted))
+            continue
+        if deleted:
+            changes.append(('delete', deleted))
+        if inserted:
+            changes.append(('insert', inserted))
+
+    return changes
+
+
+def mark_changes(original, revised, level='word'):
+    '''Mark the differences between an original and revised translation.
+
+    Deleted text is shown as [-deleted-], and inserted text as
+    {+inserted+}, with replaced text shown as a deletion followed by an
+    insertion. Brackets and backslashes in the translations are escaped
+    with a backslash.
+    '''
+
+    markup = []
+
+    for operation, text in get_changes(original, revised, level):
+        text = text.translate(MARKUP_ESCAPES)
+        if operation == 'delete':
+            markup.append(f'[-{text}-]')
+        elif operation == 'insert':
+            markup.append(f'{{+{text}+}}')
+        else:
+            markup.append(text)
+
+    return ''.join(markup)
+
+
+def parse_changes(markup):
+    '''Read back the changes marked by mark_changes.
+
+    Returns a list of (operation, text) pairs, as get_changes does.
+    '''
+
+    changes = []
+
+    for match in MARKUP_PATTERN.finditer(markup):
+        deleted, inserted, equal = match.groups()
+        if deleted is not None:
+            changes.append(('delete', UNESCAPE_PATTERN.sub(r'\1', deleted)))
+        elif inserted is not None:
+            changes.append(('insert', UNESCAPE_PATTERN.sub(r'\1', inserted)))
+        else:
+            changes.append(('equal', UNESCAPE_PATTERN.sub(r'\1', equal)))
+
+    return changes
+
+
+def mark_changes_job(pair, level):
+    '''Mark the differences of a pair of translations in a worker.'''
+
+    return mark_changes(pair[0], pair[1], level)
+
+
+def get_pair_key(original, revised, level):
+    '''Hash a pair of translations to identify it in the cache.'''
+
+    pair = '\0'.join((level, original, revised)).encode('utf-8')
+
+    return hashlib.blake2b(pair, digest_size=16).digest()
+
+
+class DiffCache():
+    '''Class for the changes already marked between translations.
+
+    The changes are kept in memory by a hash of each pair of original
+    and revised translations, and can also be saved in a SQLite file
+    so that they are available to the next runs.
+    '''
+
+    def __init__(self, cache_file=None):
+        self.changes = {}
+        self.connection = None
+
+        if cache_file is not None:
+            self.connection = sqlite3.connect(cache_file)
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS changes
+                                       (hash BLOB PRIMARY KEY,
+                                        markup TEXT)
+                                       WITHOUT ROWID''')
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        '''Close the connection to the cache file, if any.'''
+
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+    def find_missing(self, keys):
+        '''Load the cached changes, and return the keys not found.'''
+
+        if self.connection is None:
+            return [key for key in keys if key not in self.changes]
+
+        missing = []
+        for key in keys:
+            if key in self.changes:
+                continue
+            row = self.connection.execute('''SELECT markup FROM changes
+                                             WHERE hash = ?''',
+                                          (key,)).fetchone()
+            if row is None:
+                missing.append(key)
+            else:
+                self.changes[key] = row[0]
+
+        return missing
+
+
+    def store(self, key, markup):
+        '''Save the changes of a pair of translations.'''
+
+        self.changes[key] = markup
+        if self.connection is not None:
+            self.connection.execute('INSERT OR REPLACE INTO changes '
+                                    'VALUES (?, ?)', (key, markup))
+
+
+    def clear(self):
+        '''Forget the changes kept in memory.
+
+        The changes saved to the cache file, if any, are read from it
+        again when needed.
+        '''
+
+        self.changes = {}
+
+
+    def commit(self):
+        '''Save the new changes to the cache file, if any.'''
+
+        if self.connection is not None:
+            self.connection.commit()
+
+
+def find_revisions(tmxfile, originals):
+    '''Pair the revised translations of a memory with their originals.
+
+    Yields each revised tu element, its record, and the original
+    translation, for the revised translations whose original was found
+    and differs from the revised translation.
+    '''
+
+    for tu in iter_tus(tmxfile, remove_blank_text=True):
+        record = TranslationUnit.from_element(tu)
+        if not record.is_revised:
+            continue
+
+        original = originals.get((record.creationid,) + get_context(record))
+        if original is not None and original != record.target:
+            yield tu, record, original
+
+
+def mark_revisions(tmxfile, originals, cache, level='word', workers=None):
+    '''Mark the changes of every revised translation of a memory.
+
+    Each different pair of translations is only compared once, and
+    only if its changes are not already in the cache. Returns the
+    number of pairs compared.
+    '''
+
+    pairs = {}
+    for _, record, original in find_revisions(tmxfile, originals):
+        pairs[get_pair_key(original, record.target, level)] = \
+            (original, record.target)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return mark_pairs(pairs, cache, level, executor)
+
+
+def mark_pairs(pairs, cache, level, executor):
+    '''Mark the changes of the pairs of translations not in the cache.
+
+    The pairs of original and revised translations are given by their
+    key, and compared by the pool of worker processes given. Returns the
+    number of pairs compared.
+    '''
+
+    missing = cache.find_missing(pairs)
+
+    if missing:
+        changes = executor.map(mark_changes_job,
+                               [pairs[key] for key in missing],
+                               [level] * len(missing),
+                               chunksize=CHUNK_SIZE)
+        for key, markup in zip(missing, changes):
+            cache.store(key, markup)
+
+        cache.commit()
+
+    return len(missing)
+
+
+def add_note(tu, text):
+    '''Add a note to a tu element, before its tuv elements.'''
+
+    note = etree.Element('note')
+    note.text = text
+
+    first_tuv = tu.find('tuv')
+    if first_tuv is None:
+        tu.append(note)
+    else:
+        first_tuv.addprevious(note)
+
+
+def write_revision_notes(tmxfile, originals, cache, level='word'):
+    '''Write the revised translations of each translator with notes.
+
+    The revised translations are saved to a TMX file for each original
+    translator, named after the code of the translator in the
+    configuration file, in the folder of the project memory. Each one
+    has a note marking the changes made by the reviser. Returns the
+    list of files written.
+
+    A translation without a language is saved with the language of the
+    previous translations, and skipped if no language was found yet.
+    '''
+
+    translator_list = dict(common.config.items('Translators'))
+    tmxpath = common.Path(tmxfile).parent
+    header, version, doctype = read_tmx_header(tmxfile)
+    tmxfiles = {}
+    tgtlang = None
+    skipped = 0
+
+    with ExitStack() as writers:
+        for tu, record, original in find_revisions(tmxfile, originals):
+            if record.creationid not in translator_list:
+                continue
+
+            tgtlang = get_tuv_lang(tu.findall('tuv')[1]) or tgtlang
+            if tgtlang is None:
+                skipped += 1
+                continue
+
+            code = tgtlang[:2] + '-' + translator_list[record.creationid]
+            if code not in tmxfiles:
+                tmxfiles[code] = writers.enter_context(
+                    OmegaT_TMXWriter(tmxpath/(code + REVISIONS_SUFFIX),
+                                     header=header, version=version,
+                                     doctype=doctype))
+
+            markup = cache.changes[get_pair_key(original, record.target,
+                                                level)]
+            add_note(tu, markup)
+            tmxfiles[code].add_tu(tu)
+
+    if skipped:
+        print(f'{skipped} revised translations skipped in {tmxfile}: '
+              f'no target language found before them')
+
+    return [writer.tmxfile for writer in tmxfiles.values()]
+
+
+def write_sidecar(tmxfile, originals, cache, sidecar, level='word'):
+    '''Write the revised translations and their changes to a TSV file.
+
+    Returns the number of revised translations written.
+    '''
+
+    count = 0
+
+    with open(sidecar, 'w', encoding='utf-8', newline='') as sf:
+        swriter = csv.writer(sf, delimiter='\t')
+        swriter.writerow(SIDECAR_COLUMNS)
+
+        for _, record, original in find_revisions(tmxfile, originals):
+            markup = cache.changes[get_pair_key(original, record.target,
+                                                level)]
+            swriter.writerow([record.source, original, record.target,
+                              record.creationid, record.changeid,
+                              record.changedate, markup])
+            count += 1
+
+    return count
+
+
+def parse_arguments():
+    '''Read the command line arguments.'''
+
+    parser = argparse.ArgumentParser(description='Mark the changes made by '
+                                                 'revisers to translations.')
+    parser.add_argument('tmxfile', type=common.Path,
+                        help='memory of the revised project')
+    parser.add_argument('originals', nargs='+', type=common.Path,
+                        help='TMX files or folders with the original '
+                             'translations')
+    parser.add_argument('--level', choices=('word', 'char'), default='word',
+                        help='compare words or characters')
+    parser.add_argument('--sidecar', type=common.Path,
+                        help='write the changes to a TSV file instead of '
+                             'TMX notes')
+    parser.add_argument('--cache', type=common.Path,
+                        help='file in which to keep the changes found')
+    parser.add_argument('--workers', type=int,
+                        help='number of worker processes')
+    parser.add_argument('--config', type=common.Path,
+                        help='configuration file to use')
+    common.add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    arguments = parse_arguments()
+    common.start_profiling(arguments)
+    if arguments.config is not None:
+        common.load_config(arguments.config)
+
+    workers = get_worker_count(arguments.workers)
+
+    # Leave out the project memory if it is in one of the folders.
+    original_files = [tmx for tmx in find_tmx_files(arguments.originals)
+                      if tmx.resolve() != arguments.tmxfile.resolve()]
+
+    with common.profile_stage('load_originals') as stage:
+        originals = load_originals(original_files)
+        stage.items = len(originals)
+
+    with DiffCache(arguments.cache) as cache:
+        with common.profile_stage('mark_revisions') as stage:
+            compared = mark_revisions(arguments.tmxfile, originals, cache,
+                                      arguments.level, workers)
+            stage.items = compared
+        print(f'{compared} revised translations compared')
+
+        with common.profile_stage('write_revisions'):
+            if arguments.sidecar is not None:
+                count = write_sidecar(arguments.tmxfile, originals, cache,
+                                      arguments.sidecar, arguments.level)
+                print(f'{count} revised translations written to '
+                      f'{arguments.sidecar}')
+            else:
+                for revisions in write_revision_notes(arguments.tmxfile,
+                                                      originals, cache,
+                                                      arguments.level):
+                    print(f'Revisions written to {revisions}')
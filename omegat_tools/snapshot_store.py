@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+
+'''Keep the project data collected at each run in a snapshot store.
+
+Instead of a full copy of every memory and glossary in a folder for each
+project, the store keeps each different file only once, compressed, under
+the hash of its contents, and records each collection run in a small
+manifest mapping the usual "project/project.tmx" names to those files:
+
+    store/
+        blobs/3f/3f2a...9c.zst
+        manifests/20240105T093000123456Z.json
+
+Files that did not change since the previous run are recognized by their
+size and modification time and neither read nor written again, and files
+that changed back to contents already stored are only read to be hashed.
+The files are compressed with zstd if the "zstandard" module is installed,
+and with gzip otherwise, unless the "store_compression" option of the
+"Collect" section of the configuration file names another compression,
+as the "compression" option of the "Files" section does.
+
+A run can be materialized as the usual tree of project folders, either
+with decompressed copies of the files, or with hard links to the stored
+files (which keeps their compression suffix, unless the store is not
+compressed). Stored files no longer used by any manifest are removed by
+garbage collection, after optionally forgetting the oldest runs. Files
+stored after the last manifest was written are left alone, as they may
+belong to a run still in progress.
+
+The collect_omegat_project_data script writes to a store when the "store"
+option of the "Collect" section of the configuration file is enabled, or
+with its --store option. This script manages the store:
+
+    python snapshot_store.py list /backup/store
+    python snapshot_store.py materialize /backup/store /tmp/restored --run 20240105T093000123456Z
+    python snapshot_store.py gc /backup/store --keep 30
+
+Requires:
+  - Python 3.7 or higher
+  - zstandard (optional, for zstd compression)
+'''
+
+###########################################################################
+#
+# Snapshot Store
+# ---------------------------
+# Version 0.1
+# License: GPL3+
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+###########################################################################
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import common
+
+# Constants
+BLOBS = 'blobs'
+MANIFESTS = 'manifests'
+RUN_FORMAT = '%Y%m%dT%H%M%S%fZ'
+COPY_BLOCK_SIZE = 1024 * 1024
+SUFFIXES = {'zst':'.zst', 'gz':'.gz', 'bz2':'.bz2', 'xz':'.xz', 'none':''}
+# Other names of the compressions, as first used by the store
+ALIASES = {'zstd':'zst', 'gzip':'gz', '':'none'}
+
+
+def get_compression(compression='auto'):
+    '''Choose the compression of new blobs.
+
+    The compressions are named as in the "Files" section of the
+    configuration file, and "zstd" and "gzip" are accepted as well.
+    With "auto", zstd is used if the zstandard module is installed,
+    and gzip otherwise.
+    '''
+
+    compression = compression.strip().lower().lstrip('.')
+    compression = ALIASES.get(compression, compression)
+    if compression == 'auto':
+        compression = 'zst' if common.zstandard is not None else 'gz'
+    if compression not in SUFFIXES:
+        raise ValueError(f'Unknown compression "{compression}"')
+    if compression == 'zst' and common.zstandard is None:
+        raise RuntimeError('The zstandard module is needed for zstd '
+                           'compression.')
+
+    return compression
+
+
+def open_blob_writer(blob, compression, level=None):
+    '''Open a file to write compressed data to.'''
+
+    return common.open_file(blob, 'wb', level,
+                            compression=SUFFIXES[compression])
+
+
+def open_blob_reader(blob):
+    '''Open a stored file to read its decompressed data.'''
+
+    return common.open_file(blob)
+
+
+class SnapshotStore():
+    '''Class for a content-addressed store of collected files.'''
+
+    def __init__(self, store_path, compression='auto', level=None):
+        self.store_path = common.Path(store_path)
+        self.blob_path = self.store_path/BLOBS
+        self.manifest_path = self.store_path/MANIFESTS
+        self.compression = compression
+        self.level = level
+        # Records of the last run added through this object, if any
+        self.files = None
+
+        self.blob_path.mkdir(parents=True, exist_ok=True)
+        self.manifest_path.mkdir(parents=True, exist_ok=True)
+
+
+    def list_runs(self):
+        '''List the names of the runs recorded, oldest first.'''
+
+        return sorted(manifest.stem for manifest
+                      in self.manifest_path.glob('*.json'))
+
+
+    def read_manifest(self, run=None):
+        '''Read the manifest of a run, or of the last run if none is given.
+
+        Returns an empty manifest if no run was recorded yet.
+        '''
+
+        if run is None:
+            runs = self.list_runs()
+            if not runs:
+                return {'run':None, 'files':{}}
+            run = runs[-1]
+
+        with open(self.manifest_path/f'{run}.json', 'r',
+                  encoding='utf-8') as mf:
+            return json.load(mf)
+
+
+    def write_manifest(self, files):
+        '''Record a new run, and return its name.'''
+
+        run = datetime.now(timezone.utc).strftime(RUN_FORMAT)
+        manifest = {'run':run, 'files':files}
+        manifest_file = self.manifest_path/f'{run}.json'
+        temp_file = manifest_file.with_suffix('.tmp')
+
+        with open(temp_file, 'w', encoding='utf-8') as mf:
+            json.dump(manifest, mf, indent=1, sort_keys=True)
+        os.replace(temp_file, manifest_file)
+
+        return run
+
+
+    def find_blob(self, filehash):
+        '''Return the stored file with a given hash, or None.'''
+
+        folder = self.blob_path/filehash[:2]
+        for suffix in SUFFIXES.values():
+            blob = folder/(filehash + suffix)
+            if blob.exists():
+                return blob
+
+        return None
+
+
+    def add_blob(self, data_file, filehash):
+        '''Store the contents of a file under its hash, unless present.
+
+        The file is compressed to a temporary file renamed once complete,
+        so that an interrupted run never leaves a partial blob.
+        '''
+
+        if self.find_blob(filehash) is not None:
+            return False
+
+        compression = get_compression(self.compression)
+        folder = self.blob_path/filehash[:2]
+        folder.mkdir(exist_ok=True)
+        blob = folder/(filehash + SUFFIXES[compression])
+
+        handle, temp_name = tempfile.mkstemp(prefix='.'+filehash,
+                                             suffix='.tmp', dir=folder)
+        os.close(handle)
+
+        try:
+            with open(data_file, 'rb') as df, \
+                 open_blob_writer(temp_name, compression, self.level) as bf:
+                shutil.copyfileobj(df, bf, COPY_BLOCK_SIZE)
+            shutil.copymode(data_file, temp_name)
+            os.replace(temp_name, blob)
+        except BaseException:
+            os.remove(temp_name)
+            raise
+
+        return True
+
+
+    def store_file(self, data_file, previous=None):
+        '''Store a file, and return its manifest record and status.
+
+        A file with the same path, size and modification time as in the
+        previous manifest is assumed unchanged and not read at all.
+        '''
+
+        stat = data_file.stat()
+        record = {'source':str(data_file),
+                  'size':stat.st_size,
+                  'mtime':stat.st_mtime_ns}
+
+        if previous is not None and \
+           all(previous.get(key) == record[key] for key in record) and \
+           self.find_blob(previous['hash']) is not None:
+            record['hash'] = previous['hash']
+            return record, 'skipped'
+
+        record['hash'] = common.hash_file(data_file)
+        status = 'stored' if self.add_blob(data_file, record['hash']) \
+                 else 'linked'
+
+        return record, status
+
+
+    def add_run(self, jobs, workers=None, update=False):
+        '''Store the files of a collection run and record its manifest.
+
+        The jobs are pairs of files and their names in the manifest,
+        which are processed by a pool of threads. Returns the name of
+        the run and a summary of the files stored, linked to contents
+        already stored, and skipped as unchanged.
+
+        With update enabled, the jobs only replace or add to the records
+        of the last run, which are kept in memory once a run was added
+        through this object, instead of making up the whole run.
+        '''
+
+        previous = self.files
+        if previous is None or not update:
+            previous = self.read_manifest()['files']
+        files = dict(previous) if update else {}
+
+        summary = {status:{'files':0, 'bytes':0}
+                   for status in ('stored', 'linked', 'skipped', 'failed')}
+        workers = common.normalize_workers(workers)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {name:executor.submit(self.store_file, data_file,
+                                            previous.get(name))
+                       for data_file, name in jobs}
+
+            for name, future in futures.items():
+                try:
+                    record, status = future.result()
+                except OSError as error:
+                    print('Failed to store '+name+': '+str(error))
+                    summary['failed']['files'] += 1
+                    files.pop(name, None)
+                    continue
+
+                files[name] = record
+                summary[status]['files'] += 1
+                summary[status]['bytes'] += record['size']
+
+        run = self.write_manifest(files)
+        self.files = files
+
+        return run, summary
+
+
+    def materialize(self, target, run=None, hardlink=False):
+        '''Recreate the tree of project files of a run in a folder.
+
+        With hardlink enabled, the files are hard links to the stored
+        files, which keep their compression suffix, rather than
+        decompressed copies. Returns the number of files written.
+        '''
+
+        target = common.Path(target)
+        manifest = self.read_manifest(run)
+
+        for name, record in manifest['files'].items():
+            blob = self.find_blob(record['hash'])
+            if blob is None:
+                raise FileNotFoundError(f'Missing stored file for {name}')
+
+            new_file = target/name
+            new_file.parent.mkdir(parents=True, exist_ok=True)
+
+            if hardlink:
+                link = new_file.with_name(new_file.name + blob.suffix)
+                if link.exists():
+                    link.unlink()
+                os.link(blob, link)
+                continue
+
+            with open_blob_reader(blob) as bf, open(new_file, 'wb') as nf:
+                shutil.copyfileobj(bf, nf, COPY_BLOCK_SIZE)
+            os.utime(new_file, ns=(record['mtime'], record['mtime']))
+
+        return len(manifest['files'])
+
+
+    def forget_runs(self, keep):
+        '''Remove the manifests of all but the last runs.
+
+        Returns the list of runs forgotten.
+        '''
+
+        runs = self.list_runs()
+        forgotten = runs[:-keep] if keep > 0 else runs
+
+        for run in forgotten:
+            (self.manifest_path/f'{run}.json').unlink()
+
+        return forgotten
+
+
+    def collect_garbage(self):
+        '''Remove the stored files that no manifest refers to.
+
+        Files stored since the last manifest was written are kept, as
+        they may belong to a run still in progress that has not recorded
+        them yet. Returns the number of files and bytes removed.
+        '''
+
+        referenced = set()
+        cutoff = None
+        for run in self.list_runs():
+            referenced.update(record['hash'] for record
+                              in self.read_manifest(run)['files'].values())
+            mtime = (self.manifest_path/f'{run}.json').stat().st_mtime_ns
+            cutoff = mtime if cutoff is None else max(cutoff, mtime)
+
+        removed = 0
+        freed = 0
+        for blob in self.blob_path.glob('*/*'):
+            filehash = blob.name.split('.')[0]
+            if filehash and filehash not in referenced:
+                if cutoff is not None and blob.stat().st_mtime_ns >= cutoff:
+                    continue
+                freed += blob.stat().st_size
+                blob.unlink()
+                removed += 1
+
+        return removed, freed
+
+
+def parse_arguments():
+    '''Read the command line arguments.'''
+
+    parser = argparse.ArgumentParser(description='Manage the snapshot store '
+                                                 'of collected OmegaT '
+                                                 'project data.')
+    parser.add_argument('--config', type=common.Path,
+                        help='configuration file to use')
+    common.add_profile_arguments(parser)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = commands.add_parser('list', help='list the runs recorded')
+    list_parser.add_argument('store', type=common.Path)
+
+    materialize_parser = commands.add_parser('materialize',
+                                             help='recreate the files of '
+                                                  'a run')
+    materialize_parser.add_argument('store', type=common.Path)
+    materialize_parser.add_argument('target', type=common.Path,
+                                    help='folder to write the files to')
+    materialize_parser.add_argument('--run',
+                                    help='run to recreate (default: last)')
+    materialize_parser.add_argument('--hardlink', action='store_true',
+                                    help='link to the stored files instead '
+                                         'of decompressing them')
+
+    gc_parser = commands.add_parser('gc', help='remove the stored files no '
+                                               'longer used')
+    gc_parser.add_argument('store', type=common.Path)
+    gc_parser.add_argument('--keep', type=int,
+                           help='only keep the last runs')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    arguments = parse_arguments()
+    common.start_profiling(arguments)
+    if arguments.config is not None:
+        common.load_config(arguments.config)
+
+    store = SnapshotStore(arguments.store,
+                          common.config.get('Collect', 'store_compression',
+                                            fallback='auto'),
+                          common.config.getint('Collect', 'store_level',
+                                               fallback=None))
+
+    if arguments.command == 'list':
+        for run in store.list_runs():
+            print(f"{run}: {len(store.read_manifest(run)['files'])} files")
+
+    elif arguments.command == 'materialize':
+        with common.profile_stage('materialize') as stage:
+            count = store.materialize(arguments.target, arguments.run,
+                                      arguments.hardlink)
+            stage.items = count
+        print(f'{count} files written to {arguments.target}')
+
+    elif arguments.command == 'gc':
+        if arguments.keep is not None:
+            for run in store.forget_runs(arguments.keep):
+                print(f'Forgot run {run}')
+        with common.profile_stage('collect_garbage') as stage:
+            removed, freed = store.collect_garbage()
+            stage.items = removed
+        print(f'Removed {removed} stored files, {freed} bytes')
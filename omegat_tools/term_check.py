@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+
+'''Check that the approved glossary terms are used in translations.
+
+The source terms of a glossary (such as the one written by the
+"merge_omegat_glossaries" script) are compiled into a single Aho-Corasick
+automaton, which finds every source term used in a segment in one pass
+over its text, however many terms the glossary has. A segment is reported
+when one of its source terms is found, but none of the target terms of
+that source term appear in its translation.
+
+Terms can be matched regardless of case, and only as whole words, which
+is useful for languages written with spaces between words.
+
+The TMX files are read as a stream, split into chunks that are checked at
+the same time by several worker processes. A single pool of workers checks
+the chunks of every file, so each worker compiles its copy of the automaton
+only once per run, and the chunks of the next files are handed out while
+those of the previous ones are still being checked. Compressed files,
+which cannot be split, are checked whole by a single worker.
+
+Usage examples:
+
+    python term_check.py glossary.txt project_save.tmx
+    python term_check.py --casefold --whole-words --output issues.tsv glossary.txt /path/to/projects
+
+Requires:
+  - Python 3.7 or higher
+  - lxml
+'''
+
+###########################################################################
+#
+# Term Check
+# ---------------------------
+# Version 0.1
+# License: GPL3+
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+###########################################################################
+
+import argparse
+import csv
+import sys
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+
+import common
+from extract_segments import get_chunk_size, get_worker_count
+from merge_omegat_glossaries import get_glossary_entries
+from tmxhelpers import (find_tmx_files, find_tu_chunks, iter_chunk_tus,
+                        iter_translations, read_translation)
+
+# Constants
+CHAR_BITS = 21
+REPORT_COLUMNS = ['file', 'term', 'expected', 'source', 'target',
+                  'translator']
+
+# Term checker of each worker process
+checker = None
+
+
+class TermAutomaton():
+    '''Class to find every occurrence of a set of terms in a text.
+
+    The transitions of the automaton are kept in a single dictionary
+    keyed by state and character, and the failure links in an array,
+    rather than in an object for each state, so that glossaries with
+    many terms fit in little memory.
+    '''
+
+    def __init__(self, terms):
+        self.terms = []
+        self.transitions = {}
+        self.outputs = {}
+
+        parents = array('l', [0])
+        chars = array('l', [0])
+        depths = array('l', [0])
+
+        for term in terms:
+            state = 0
+            for char in term:
+                key = (state << CHAR_BITS) | ord(char)
+                next_state = self.transitions.get(key)
+                if next_state is None:
+                    next_state = len(parents)
+                    self.transitions[key] = next_state
+                    parents.append(state)
+                    chars.append(ord(char))
+                    depths.append(depths[state] + 1)
+                state = next_state
+
+            if state:
+                self.outputs[state] = (len(self.terms),)
+                self.terms.append(term)
+
+        self.fail = array('l', [0]) * len(parents)
+        self.link_states(parents, chars, depths)
+
+
+    def link_states(self, parents, chars, depths):
+        '''Set the failure link and terms found at each state.
+
+        The states are linked in order of depth, so that the link of the
+        parent of a state is always set before that of the state.
+        '''
+
+        for state in sorted(range(1, len(parents)),
+                            key=depths.__getitem__):
+            parent = parents[state]
+            if parent == 0:
+                continue
+
+            code = chars[state]
+            link = self.fail[parent]
+            while True:
+                target = self.transitions.get((link << CHAR_BITS) | code)
+                if target is not None:
+                    break
+                if link == 0:
+                    target = 0
+                    break
+                link = self.fail[link]
+
+            self.fail[state] = target
+            inherited = self.outputs.get(target)
+            if inherited:
+                self.outputs[state] = self.outputs.get(state, ()) + inherited
+
+
+    def find(self, text):
+        '''Yield the start position and index of each term in a text.'''
+
+        transitions = self.transitions
+        fail = self.fail
+        outputs = self.outputs
+        state = 0
+
+        for position, char in enumerate(text):
+            code = ord(char)
+            while True:
+                next_state = transitions.get((state << CHAR_BITS) | code)
+                if next_state is not None:
+                    state = next_state
+                    break
+                if state == 0:
+                    break
+                state = fail[state]
+
+            found = outputs.get(state)
+            if found:
+                for index in found:
+                    yield position + 1 - len(self.terms[index]), index
+
+
+class TermChecker():
+    '''Class to check the terms used in the translations of segments.'''
+
+    def __init__(self, entries, casefold=False, whole_words=False):
+        self.casefold = casefold
+        self.whole_words = whole_words
+
+        # Keep every approved target term of each source term, and the
+        # source term as first written in the glossary.
+        expected = {}
+        labels = {}
+        for source, target, _ in entries:
+            if not source or not target:
+                continue
+            folded = self.fold(source)
+            labels.setdefault(folded, source)
+            expected.setdefault(folded, {}).setdefault(self.fold(target),
+                                                       target)
+
+        self.automaton = TermAutomaton(expected)
+        self.labels = [labels[term] for term in self.automaton.terms]
+        self.expected = [expected[term] for term in self.automaton.terms]
+
+
+    def fold(self, text):
+        '''Convert a text to the form in which terms are compared.'''
+
+        return text.casefold() if self.casefold else text
+
+
+    def is_whole_word(self, text, start, end):
+        '''Whether a term found in a text is not part of a longer word.'''
+
+        return ((start == 0 or not text[start - 1].isalnum()
+                 or not text[start].isalnum())
+                and (end == len(text) or not text[end].isalnum()
+                     or not text[end - 1].isalnum()))
+
+
+    def check(self, source, target):
+        '''Find the source terms whose target terms are missing.
+
+        Returns a list of each source term and its expected target
+        terms.
+        '''
+
+        source = self.fold(source)
+        target = self.fold(target)
+        missing = {}
+
+        for start, index in self.automaton.find(source):
+            if index in missing:
+                continue
+
+            end = start + len(self.automaton.terms[index])
+            if self.whole_words and not self.is_whole_word(source, start,
+                                                           end):
+                continue
+
+            targets = self.expected[index]
+            if not any(folded in target for folded in targets):
+                missing[index] = (self.labels[index],
+                                  ' | '.join(targets.values()))
+
+        return list(missing.values())
+
+
+def check_translation(translation, term_checker):
+    '''Check a single translation, as returned by read_translation.'''
+
+    source, target, attrib = translation
+    translator = attrib.get('changeid') or attrib.get('creationid') or ''
+
+    return [(term, expected, source, target, translator)
+            for term, expected in term_checker.check(source, target)]
+
+
+def load_checker(glossary_file, casefold, whole_words):
+    '''Compile the term checker of a worker process.'''
+
+    global checker
+    checker = TermChecker(get_glossary_entries(glossary_file), casefold,
+                          whole_words)
+
+
+def check_chunk(tmxfile, start, end):
+    '''Check the translations of a chunk of a TMX file in a worker.
+
+    Returns the number of translations checked and the issues found.
+    '''
+
+    count = 0
+    issues = []
+
+    for tu in iter_chunk_tus(tmxfile, start, end):
+        translation = read_translation(tu)
+        if translation is not None:
+            count += 1
+            issues.extend(check_translation(translation, checker))
+
+    return count, issues
+
+
+def check_file(tmxfile):
+    '''Check the translations of a whole TMX file in a worker.
+
+    Returns the number of translations checked and the issues found.
+    '''
+
+    count = 0
+    issues = []
+
+    for translation in iter_translations(tmxfile):
+        count += 1
+        issues.extend(check_translation(translation, checker))
+
+    return count, issues
+
+
+def submit_checks(executor, tmxfiles, chunk_size):
+    '''Hand out the chunks of each TMX file to the worker processes.
+
+    Yields each TMX file and the future of the check of each chunk, in
+    the order of the files. Compressed files are checked whole.
+    '''
+
+    for tmxfile in tmxfiles:
+        if common.is_compressed(tmxfile):
+            yield tmxfile, executor.submit(check_file, str(tmxfile))
+            continue
+
+        for start, end in find_tu_chunks(tmxfile, chunk_size):
+            yield tmxfile, executor.submit(check_chunk, str(tmxfile),
+                                           start, end)
+
+
+def check_tmx_files(tmxfiles, glossary_file, casefold=False,
+                    whole_words=False, workers=None, chunk_size=None):
+    '''Check the translations of several TMX files, chunk by chunk.
+
+    Yields each TMX file with the number of translations checked in one
+    of its chunks and the issues found, in the order of the files and of
+    the chunks. Each issue is a tuple of the source term, the expected
+    target terms, the source and target text, and the translator.
+
+    A single pool of worker processes checks the chunks of every file,
+    and only a few chunks are handed out ahead of the one being
+    returned, so that the results do not pile up in memory.
+    '''
+
+    workers = get_worker_count(workers)
+    if chunk_size is None:
+        chunk_size = get_chunk_size()
+
+    if workers == 1:
+        term_checker = TermChecker(get_glossary_entries(glossary_file),
+                                   casefold, whole_words)
+        for tmxfile in tmxfiles:
+            for translation in iter_translations(tmxfile):
+                yield tmxfile, 1, check_translation(translation,
+                                                    term_checker)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=load_checker,
+                             initargs=(glossary_file, casefold,
+                                       whole_words)) as executor:
+        pending = deque()
+
+        for job in submit_checks(executor, tmxfiles, chunk_size):
+            pending.append(job)
+            if len(pending) >= workers * 2:
+                tmxfile, future = pending.popleft()
+                yield (tmxfile,) + future.result()
+
+        while pending:
+            tmxfile, future = pending.popleft()
+            yield (tmxfile,) + future.result()
+
+
+def parse_arguments():
+    '''Read the command line arguments.'''
+
+    parser = argparse.ArgumentParser(description='Check that the glossary '
+                                                 'terms are used in '
+                                                 'translations.')
+    parser.add_argument('glossary', type=common.Path,
+                        help='glossary of the approved terms')
+    parser.add_argument('paths', nargs='+', type=common.Path,
+                        help='TMX files or folders containing projects')
+    parser.add_argument('--casefold', action='store_true',
+                        help='match the terms regardless of case')
+    parser.add_argument('--whole-words', action='store_true',
+                        help='only match source terms as whole words')
+    parser.add_argument('--output', type=common.Path,
+                        help='TSV file to write the issues to')
+    parser.add_argument('--workers', type=int,
+                        help='number of worker processes')
+    parser.add_argument('--config', type=common.Path,
+                        help='configuration file to use')
+    common.add_profile_arguments(parser)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    arguments = parse_arguments()
+    common.start_profiling(arguments)
+    if arguments.config is not None:
+        common.load_config(arguments.config)
+
+    with ExitStack() as files:
+        if arguments.output is not None:
+            report = files.enter_context(open(arguments.output, 'w',
+                                              encoding='utf-8', newline=''))
+        else:
+            report = sys.stdout
+
+        rwriter = csv.writer(report, delimiter='\t')
+        rwriter.writerow(REPORT_COLUMNS)
+
+        tmxfiles = find_tmx_files(arguments.paths)
+        totals = {tmxfile:[0, 0] for tmxfile in tmxfiles}
+
+        with common.profile_stage('check_tmx') as stage:
+            checked = 0
+            for tmxfile, count, issues in check_tmx_files(
+                    tmxfiles, arguments.glossary, arguments.casefold,
+                    arguments.whole_words, arguments.workers):
+                checked += count
+                totals[tmxfile][0] += count
+                totals[tmxfile][1] += len(issues)
+                for issue in issues:
+                    rwriter.writerow((tmxfile,) + issue)
+            stage.items = checked
+
+    for tmxfile, (checked, issue_count) in totals.items():
+        print(f'{checked} translations checked in {tmxfile}: '
+              f'{issue_count} issues found', file=sys.stderr)
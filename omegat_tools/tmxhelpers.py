@@ -1,7 +1,27 @@
 # -*- coding: utf-8 -*-
 
+import io
+import mmap
+import os
+import re
+import sys
+from array import array
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, nullcontext
+from pathlib import Path
+
 from lxml import etree
 
+import common
+
+# Constants
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+TU_START = re.compile(rb'<tu[\s>]')
+TU_END = b'</tu>'
+XML_ENCODING = re.compile(rb'''<\?xml[^>]*encoding=["']([A-Za-z0-9._-]+)["']''')
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
 class TMX:
     '''Base class to define and manipulate simple TMX documents.'''
 
@@ -68,5 +88,614 @@ class OmegaT_TMX(TMX):
             self.body.append(self.alt_trans)
 
 
+class OmegaT_TMXWriter():
+    '''Class to write OmegaT-specific TMX documents incrementally.
+
+    Unlike OmegaT_TMX, the document is never built in memory. The header
+    is written when the file is opened, each tu is written out as soon as
+    it is added, and the "Alternative translations" comment is inserted
+    before the first alternative translation as it goes by.
+    '''
+
+    # Properties that follow the "file" property in alternative translations
+    alt_prop_types = ('id', 'prev', 'next')
+
+
+    def __init__(self, tmxfile, header=TMX.default_header,
+                 version=TMX.default_version, doctype=TMX.default_doctype):
+        self.tmxfile = tmxfile
+        # Files without a header or a version still get valid ones.
+        self.header = header if header is not None else {}
+        self.version = version if version is not None else TMX.default_version
+        self.doctype = doctype
+        self.tu_count = 0
+        self.alt_inserted = False
+        self._file = None
+        self._xf = None
+        self._body = None
+        self._stack = None
+
+
+    def __enter__(self):
+        self.open()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def open(self):
+        '''Create the file and write everything up to the first tu.'''
+
+        self._file = common.open_file(self.tmxfile, 'wb')
+        self._stack = ExitStack()
+        self._xf = self._stack.enter_context(etree.xmlfile(self._file,
+                                                           encoding='UTF-8'))
+
+        self._xf.write_declaration()
+        if self.doctype:
+            self._xf.write_doctype(self.doctype)
+
+        self._stack.enter_context(self._xf.element('tmx',
+                                                   version=self.version))
+        self._xf.write('\n  ')
+        self._xf.write(etree.Element('header', dict(self.header)))
+        self._xf.write('\n  ')
+
+        self._body = self._xf.element('body')
+        self._body.__enter__()
+        self._xf.write('\n')
+        self._xf.write(etree.Comment('Default translations'),
+                       pretty_print=True)
+
+
+    @classmethod
+    def is_alternative(cls, tu):
+        '''Check whether a tu element is an alternative translation.'''
+
+        file_prop = tu.find('prop[@type="file"]')
+        if file_prop is None:
+            return False
+
+        next_prop = file_prop.getnext()
+        return (next_prop is not None
+                and next_prop.attrib.get('type') in cls.alt_prop_types)
+
+
+    def add_tu(self, tu):
+        '''Write a tu element to the TMX file.'''
+
+        if not self.alt_inserted and self.is_alternative(tu):
+            self.insert_alt_comment()
+
+        self._xf.write(tu, pretty_print=True, with_tail=False)
+        self.tu_count += 1
+
+
+    def add_serialized_tu(self, data, alternative=False):
+        '''Write a tu element already serialized to UTF-8 bytes.
+
+        This is used for tu elements processed in worker processes, which
+        cannot send lxml elements back. The data must be serialized with
+        etree.tostring(tu, encoding='UTF-8', pretty_print=True,
+        with_tail=False), which gives the same output as add_tu.
+        '''
+
+        if not self.alt_inserted and alternative:
+            self.insert_alt_comment()
+
+        # Write out anything still held by lxml before adding the bytes.
+        self._xf.flush()
+        self._file.write(data)
+        self.tu_count += 1
+
+
+    def insert_alt_comment(self):
+        '''Write the alternative translation comment to the TMX file.'''
+
+        self._xf.write(etree.Comment('Alternative translations'),
+                       pretty_print=True)
+        self.alt_inserted = True
+
+
+    def close(self):
+        '''Close the body and root elements, and the file itself.'''
+
+        if self._stack is None:
+            return
+
+        # Like OmegaT_TMX, place the comment at the end of the body
+        # if the document has no alternative translations.
+        if not self.alt_inserted:
+            self.insert_alt_comment()
+
+        self._body.__exit__(None, None, None)
+        self._xf.write('\n')
+
+        # Closing the stack writes the end tag of the tmx element,
+        # after which the file can be finalized.
+        self._stack.close()
+        self._stack = None
+
+        self._file.write(b'\n')
+        self._file.close()
+
+
+def get_tuv_lang(tuv):
+    '''Return the language of a tuv element.
+
+    TMX 1.4 uses "xml:lang", but older versions use a plain "lang"
+    attribute, so both are checked.
+    '''
+
+    return tuv.attrib.get(XML_LANG, tuv.attrib.get('lang'))
+
+
+def get_segment_text(tuv):
+    '''Retrieve the text of a tuv segment, leaving out inline tags.'''
+
+    seg = tuv.find('seg')
+    if seg is None:
+        return ''
+
+    return ''.join(seg.itertext())
+
+
+def find_tmx_files(paths):
+    '''List the TMX files in the files and folders given.
+
+    Folders are searched recursively, for plain and compressed TMX
+    files, leaving out the copies in the ".repositories" folder of team
+    projects.
+    '''
+
+    tmxfiles = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            tmxfiles.extend(sorted(
+                tmx for tmx in path.rglob('*.tmx*')
+                if common.strip_compression_suffix(tmx).suffix == '.tmx'
+                and '.repositories' not in tmx.parts))
+        else:
+            tmxfiles.append(path)
+
+    return tmxfiles
+
+
+def open_tmx(tmxfile):
+    '''Open a TMX file for lxml to parse.
+
+    Plain files are passed by name, since libxml2 reads them faster
+    than through a Python file object, and compressed files are parsed
+    from the stream of the decompressor.
+    '''
+
+    if common.is_compressed(tmxfile):
+        return common.open_file(tmxfile)
+
+    return nullcontext(str(tmxfile))
+
+
+def read_tmx_header(tmxfile):
+    '''Retrieve the header attributes, version and doctype of a TMX file.
+
+    Only the beginning of the file is read.
+    '''
+
+    version = None
+    doctype = None
+
+    with open_tmx(tmxfile) as tf:
+        for _, element in etree.iterparse(tf, events=('start',),
+                                          tag=('tmx', 'header')):
+            if element.tag == 'tmx':
+                version = element.attrib.get('version')
+                doctype = element.getroottree().docinfo.doctype
+            else:
+                return dict(element.attrib), version, doctype
+
+    return {}, version, doctype
+
+
+def iter_tus(tmxfile, remove_blank_text=False):
+    '''Stream the tu elements of a TMX file without loading it in full.
+
+    Each tu is discarded once the next one is requested, so it must be
+    copied if it needs to be kept. Blank text between elements can be
+    removed so that the tu elements are indented properly when written
+    out again. Compressed files are parsed as they are decompressed.
+    '''
+
+    with open_tmx(tmxfile) as tf:
+        yield from iter_parsed_tus(etree.iterparse(tf, tag='tu',
+                                                   remove_blank_text=remove_blank_text))
+
+
+def iter_parsed_tus(context):
+    '''Pass on the tu elements parsed by an iterparse context.
+
+    Each tu, and any processed element before it, is discarded once the
+    next one is requested.
+    '''
+
+    for _, tu in context:
+        yield tu
+
+        tu.clear()
+        while tu.getprevious() is not None:
+            del tu.getparent()[0]
+
+
+def read_translation(tu):
+    '''Retrieve the source text, target text and target attributes of a tu.
+
+    The translation is always in the second tuv element. Returns None
+    for tu elements without a translation.
+    '''
+
+    tuvs = tu.findall('tuv')
+    if len(tuvs) < 2:
+        return None
+
+    return (get_segment_text(tuvs[0]), get_segment_text(tuvs[1]),
+            dict(tuvs[1].attrib))
+
+
+def iter_translations(tmxfile):
+    '''Stream the translations of a TMX file without loading it in full.
+
+    Yields the source text, target text and attributes of the target tuv
+    of each tu, as returned by read_translation.
+    '''
+
+    for tu in iter_tus(tmxfile):
+        translation = read_translation(tu)
+        if translation is not None:
+            yield translation
+
+
+def read_xml_encoding(data):
+    '''Read the encoding from the XML declaration at the start of a file.
+
+    Files with a byte order mark or declared in UTF-16 or UTF-32 are
+    rejected, since their tu elements cannot be found by scanning bytes.
+    '''
+
+    encoding = 'UTF-8'
+    declaration = XML_ENCODING.match(data)
+    if declaration is not None:
+        encoding = declaration.group(1).decode('ascii')
+
+    if (data[:2] in (b'\xff\xfe', b'\xfe\xff')
+            or encoding.upper().startswith(('UTF-16', 'UTF-32'))):
+        raise ValueError(f'TMX files in {encoding} cannot be split by tu')
+
+    return encoding
+
+
+def find_tu_chunks(tmxfile, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''Split the tu elements of a TMX file into ranges of bytes.
+
+    The file is divided in ranges of about the chunk size, each moved
+    forward to the start of the next tu, so that every range holds whole
+    tu elements only. Only the bytes around each boundary are read.
+    Returns a list of (start, end) byte offsets.
+
+    Compressed files cannot be split without decompressing them in
+    full, so they must be read with iter_tus instead.
+    '''
+
+    if common.is_compressed(tmxfile):
+        raise ValueError(f'{tmxfile}: compressed TMX files cannot be split '
+                         'into chunks')
+
+    with open(tmxfile, 'rb') as tf, \
+         mmap.mmap(tf.fileno(), 0, access=mmap.ACCESS_READ) as tmxmap:
+        read_xml_encoding(tmxmap[:200])
+
+        first = TU_START.search(tmxmap)
+        if first is None:
+            return []
+        last = tmxmap.rfind(TU_END) + len(TU_END)
+
+        boundaries = [first.start()]
+        while True:
+            match = TU_START.search(tmxmap, boundaries[-1] + chunk_size)
+            if match is None or match.start() >= last:
+                break
+            boundaries.append(match.start())
+
+    boundaries.append(last)
+
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def iter_chunk_tus(tmxfile, start, end, remove_blank_text=False):
+    '''Stream the tu elements in a range of bytes of a TMX file.
+
+    The range must be one found by find_tu_chunks. Its tu elements are
+    parsed on their own, inside a body element, and discarded as they go
+    as in iter_tus.
+    '''
+
+    with open(tmxfile, 'rb') as tf, \
+         mmap.mmap(tf.fileno(), 0, access=mmap.ACCESS_READ) as tmxmap:
+        encoding = read_xml_encoding(tmxmap[:200])
+        chunk = b'<body>' + tmxmap[start:end] + b'</body>'
+
+    yield from iter_parsed_tus(etree.iterparse(io.BytesIO(chunk), tag='tu',
+                                               encoding=encoding,
+                                               remove_blank_text=remove_blank_text))
+
+
+def map_tu_chunks(tmxfile, function, workers=None,
+                  chunk_size=DEFAULT_CHUNK_SIZE, initializer=None,
+                  initargs=()):
+    '''Process the chunks of a TMX file in parallel.
+
+    The function is called in a worker process with the path of the
+    file and the start and end of a chunk, and must return something
+    that can be sent back, rather than lxml elements. The results are
+    returned in the order of the chunks in the file, and only a few
+    chunks are handed out ahead of the one being returned, so that the
+    results do not pile up in memory. Data needed by every chunk can be
+    set up once in each worker process by an initializer.
+    '''
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+                             initargs=initargs) as executor:
+        pending = deque()
+
+        for start, end in find_tu_chunks(tmxfile, chunk_size):
+            pending.append(executor.submit(function, str(tmxfile),
+                                           start, end))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_chunk_translations(tmxfile, start, end):
+    '''Read the translations of a chunk of a TMX file in a worker.'''
+
+    translations = (read_translation(tu)
+                    for tu in iter_chunk_tus(tmxfile, start, end))
+
+    return [translation for translation in translations
+            if translation is not None]
+
+
+def iter_translations_parallel(tmxfile, workers=None,
+                               chunk_size=DEFAULT_CHUNK_SIZE):
+    '''Read the translations of a TMX file across several processes.
+
+    Yields the same results in the same order as iter_translations.
+    Compressed files are read in this process, as they cannot be split.
+    '''
+
+    if common.is_compressed(tmxfile):
+        yield from iter_translations(tmxfile)
+        return
+
+    for translations in map_tu_chunks(tmxfile, read_chunk_translations,
+                                      workers, chunk_size):
+        yield from translations
+
+
+class TranslationUnit(namedtuple('TranslationUnit',
+                                  ['source', 'target', 'srclang', 'tgtlang',
+                                   'creationid', 'creationdate', 'changeid',
+                                   'changedate', 'props'])):
+    '''Compact record of the contents of a tu element.
+
+    The record is a plain tuple without any per-instance dictionary, and
+    the translator names, languages and property types are interned, so
+    that the many records sharing them all point to a single string. The
+    properties are kept as a tuple of (type, value) pairs.
+    '''
+
+    __slots__ = ()
+
+    @classmethod
+    def from_element(cls, tu):
+        '''Create the record of a tu element.
+
+        The translation is always in the second tuv element.
+        '''
+
+        tuvs = tu.findall('tuv')
+        source = tuvs[0] if tuvs else None
+        target = tuvs[1] if len(tuvs) > 1 else None
+        attrib = target.attrib if target is not None else {}
+
+        props = tuple((intern(prop.attrib.get('type')), intern(prop.text))
+                      for prop in tu.iterfind('prop'))
+
+        return cls(get_segment_text(source) if source is not None else '',
+                   get_segment_text(target) if target is not None else '',
+                   intern(get_tuv_lang(source)) if source is not None else None,
+                   intern(get_tuv_lang(target)) if target is not None else None,
+                   intern(attrib.get('creationid')),
+                   attrib.get('creationdate'),
+                   intern(attrib.get('changeid')),
+                   attrib.get('changedate'),
+                   props or NO_PROPS)
+
+
+    @property
+    def translator(self):
+        '''Name of the last translator of the tu.'''
+
+        return self.changeid or self.creationid
+
+
+    @property
+    def is_revised(self):
+        '''Whether the translation was changed by another translator.'''
+
+        return self.changeid is not None and self.changeid != self.creationid
+
+
+    @property
+    def is_alternative(self):
+        '''Whether the tu is an alternative translation.'''
+
+        types = [prop_type for prop_type, _ in self.props]
+        if 'file' not in types:
+            return False
+
+        position = types.index('file') + 1
+        return (position < len(types)
+                and types[position] in OmegaT_TMXWriter.alt_prop_types)
+
+
+    def get_prop(self, prop_type, default=None):
+        '''Return the value of the first property of a given type.'''
+
+        for current_type, value in self.props:
+            if current_type == prop_type:
+                return value
+
+        return default
+
+
+# Shared by all the records without properties
+NO_PROPS = ()
+
+
+def intern(text):
+    '''Keep a single copy of strings repeated across many tu elements.'''
+
+    return sys.intern(text) if text is not None else None
+
+
 class TMXfile():
-    pass
\ No newline at end of file
+    '''Class to read the translation units of a TMX file as compact records.
+
+    When the file is opened, it is mapped in memory and scanned once for
+    the byte offsets at which each tu element starts and ends, without
+    parsing it. Any tu can then be read on its own by its position in the
+    file, and the whole file can be read as a stream of TranslationUnit
+    records, which take far less memory than the lxml elements.
+
+    The offsets can only be found in files saved in an ASCII-compatible
+    encoding such as UTF-8, which is what OmegaT uses. Compressed files
+    cannot be mapped, so they are decompressed in memory instead.
+    '''
+
+    def __init__(self, tmxfile):
+        self.tmxfile = Path(tmxfile)
+        self.header, self.version, self.doctype = read_tmx_header(tmxfile)
+        self.encoding = 'UTF-8'
+        self.starts = array('Q')
+        self.ends = array('Q')
+        self._file = None
+        self._map = None
+        self._parser = None
+
+
+    def __enter__(self):
+        self.open()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def __len__(self):
+        return len(self.starts)
+
+
+    def __getitem__(self, position):
+        '''Read the record of a single tu by its position.'''
+
+        return TranslationUnit.from_element(self.get_element(position))
+
+
+    def __iter__(self):
+        '''Stream the records of all the tu elements in order.'''
+
+        for tu in iter_tus(self.tmxfile):
+            yield TranslationUnit.from_element(tu)
+
+
+    def open(self):
+        '''Map the file in memory and build the index of tu elements.'''
+
+        if common.is_compressed(self.tmxfile):
+            with common.open_file(self.tmxfile) as tf:
+                self._map = tf.read()
+        else:
+            self._file = open(self.tmxfile, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+        try:
+            self.encoding = read_xml_encoding(self._map[:200])
+        except ValueError:
+            self.close()
+            raise
+
+        self._parser = etree.XMLParser(encoding=self.encoding)
+        self.build_index()
+
+
+    def close(self):
+        '''Release the memory map and close the file.'''
+
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+    def build_index(self):
+        '''Record the byte offsets of the start and end of each tu.
+
+        The "<tu" string can only appear at the start of a tu element,
+        since the "<" character is always escaped in the text.
+        '''
+
+        self.starts = array('Q')
+        self.ends = array('Q')
+        position = 0
+
+        while True:
+            match = TU_START.search(self._map, position)
+            if match is None:
+                break
+
+            end = self._map.find(TU_END, match.end())
+            if end < 0:
+                raise ValueError(f'{self.tmxfile}: unclosed tu element '
+                                 f'at byte {match.start()}')
+
+            position = end + len(TU_END)
+            self.starts.append(match.start())
+            self.ends.append(position)
+
+
+    def get_bytes(self, position):
+        '''Return the XML source of a single tu by its position.'''
+
+        return self._map[self.starts[position]:self.ends[position]]
+
+
+    def get_element(self, position):
+        '''Parse a single tu by its position into an lxml element.'''
+
+        return etree.fromstring(self.get_bytes(position), self._parser)
+
+
+    def read_all(self):
+        '''Read the records of all the tu elements into a list.'''
+
+        return list(self)
\ No newline at end of file
@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+
+'''Keep collected project data and merged glossaries up to date.
+
+A long-running script that watches the folder of OmegaT projects and the
+folder of glossaries, and does the work of the "collect_omegat_project_data"
+and "merge_omegat_glossaries" scripts again as soon as something changes,
+instead of leaving the results out of date until the next scheduled run:
+
+  - when the memory or glossary of a project changes, or a new project
+    appears, only the files of that project are copied again; when the
+    "store" option of the "Collect" section is enabled, only the files
+    of that project are added to the snapshot store, and the new run
+    keeps the records of the other projects from the last one, which
+    are held in memory; files removed from the projects stay in the
+    runs recorded until the folder is collected again in full;
+  - when a glossary file changes, is added or is deleted, only that file
+    is read again, and the merged glossary is written again from the
+    entries of the other files already in memory.
+
+Changes are reported by inotify on Linux, and found by checking the
+folders at regular intervals elsewhere. Changes made within a short time
+of each other, such as the several writes of a file being saved, are
+dealt with together.
+
+Usage examples:
+
+    python watch_omegat_data.py --collect ~/OmegaT_Projects /backup
+    python watch_omegat_data.py --merge ~/glossaries merged.txt --polling
+
+Press Ctrl+C to stop watching.
+
+Requires:
+  - Python 3.7 or higher
+'''
+
+###########################################################################
+#
+# Watch OmegaT Data
+# ---------------------------
+# Version 0.1
+# License: GPL3+
+# https://www.gnu.org/licenses/gpl-3.0.en.html
+#
+###########################################################################
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+import collect_omegat_project_data as collect
+import common
+import merge_omegat_glossaries as merge
+from file_watch import InotifyWatcher, PollingWatcher, iter_changes
+from glossary_cache import GlossaryCache
+
+
+class ProjectCollector():
+    '''Class to copy the data of the projects that changed.'''
+
+    def __init__(self, searchpath, destination):
+        self.searchpath = searchpath
+        self.destination = destination
+        self.settings = collect.project_settings
+        self.store = None
+        if self.settings['store']:
+            self.store = collect.SnapshotStore(destination,
+                                               self.settings['compression'],
+                                               self.settings['level'])
+        self.names = {common.Path(self.settings['main_memory']).name,
+                      common.Path(self.settings['main_glossary']).name,
+                      self.settings['project_file']}
+
+
+    def match(self, path):
+        '''Check whether a file is one that identifies or is copied
+        from a project.'''
+
+        return (path.name in self.names
+                and common.is_inside(path, self.searchpath))
+
+
+    def find_project(self, path):
+        '''Find the root folder of the project holding a file.
+
+        Returns None if the file is not in a project, or is in one of
+        the folders to prune, such as the copy of the project in the
+        ".repositories" folder of team projects.
+        '''
+
+        relative_path = path.relative_to(self.searchpath)
+        if any(part in self.settings['prune'] for part in relative_path.parts):
+            return None
+
+        for folder in path.parents:
+            if (folder/self.settings['project_file']).is_file():
+                return folder
+            if folder == self.searchpath:
+                break
+
+        return None
+
+
+    def sync_all(self):
+        '''Copy the data of every project that changed since last time.
+
+        With the store enabled, the data is added to the snapshot store
+        as a new run instead. Returns the summary of the files processed.
+        '''
+
+        projects = collect.make_project_list(self.searchpath)
+        project_data = collect.collate_project_data(projects)
+
+        if self.store is not None:
+            return collect.store_project_data(project_data, self.destination,
+                                              self.settings['workers'],
+                                              self.store)
+
+        return collect.sync_project_data(project_data, self.destination,
+                                         self.settings['workers'])
+
+
+    def sync_changes(self, paths):
+        '''Copy the data of the projects holding the files changed.
+
+        Returns the number of files copied.
+        '''
+
+        projects = {self.find_project(path) for path in paths
+                    if self.match(path)}
+        projects.discard(None)
+
+        project_data = collect.collate_project_data(sorted(projects))
+
+        if self.store is not None:
+            # The new run takes the records of the other projects from
+            # the last run added, so only the changed files are read.
+            if not projects:
+                return 0
+            summary = collect.store_project_data(project_data,
+                                                 self.destination,
+                                                 self.settings['workers'],
+                                                 self.store, update=True)
+            return summary['stored']['files'] + summary['linked']['files']
+
+        copied = 0
+
+        for data_file, new_file in collect.list_copy_jobs(project_data,
+                                                          self.destination):
+            try:
+                status, _ = collect.sync_file(data_file, new_file)
+            except OSError as error:
+                print('Failed to copy '+str(data_file)+': '+str(error))
+                continue
+
+            if status == 'copied':
+                print('Copied '+str(data_file)+' to '+str(new_file))
+                copied += 1
+
+        return copied
+
+
+class GlossaryMerger():
+    '''Class to merge the glossaries again when one of them changes.
+
+    The entries of each glossary file are kept in memory, so that only
+    the files that changed are read again. With the cache enabled, they
+    are also read from and saved to the glossary cache, so that the
+    first merge only reads the files that changed while not watching.
+    '''
+
+    def __init__(self, glossary_path, merged_file):
+        self.glossary_path = glossary_path
+        self.merged_file = merged_file.resolve()
+        self.settings = merge.glossary_settings
+        self.entries = {}
+
+        self.cache = None
+        if self.settings['cache']:
+            self.cache = GlossaryCache(glossary_path,
+                                       merge.get_glossary_entries)
+
+
+    def close(self):
+        '''Close the glossary cache, if any.'''
+
+        if self.cache is not None:
+            self.cache.close()
+
+
+    def match(self, path):
+        '''Check whether a file is a glossary to merge.'''
+
+        suffix = common.strip_compression_suffix(path).suffix
+
+        return (suffix != ''
+                and suffix in self.settings['extensions']
+                and common.is_inside(path, self.glossary_path)
+                and path.resolve() != self.merged_file)
+
+
+    def read(self, glossary_files):
+        '''Read the entries of glossary files, through the cache if any.'''
+
+        if self.cache is not None:
+            # The cache stats every file, but only reads those that
+            # changed since they were cached.
+            self.cache.update(sorted(self.entries.keys()
+                                     | set(glossary_files)),
+                              self.settings['workers'])
+            return {glossary_file:self.cache.get_entries(glossary_file)
+                    for glossary_file in glossary_files}
+
+        with ProcessPoolExecutor(max_workers=self.settings['workers']) \
+             as executor:
+            return dict(zip(glossary_files,
+                            executor.map(merge.get_glossary_entries,
+                                         glossary_files)))
+
+
+    def merge_all(self):
+        '''Read every glossary file and write the merged glossary.'''
+
+        glossary_files = [glossary_file for glossary_file
+                          in merge.get_glossary_list(self.glossary_path)
+                          if self.match(glossary_file)]
+        self.entries = self.read(glossary_files)
+        self.write()
+
+
+    def merge_changes(self, paths):
+        '''Read the glossary files changed and write the merged glossary.
+
+        Returns the number of glossary files read again.
+        '''
+
+        changed = {path for path in paths if self.match(path)}
+        if not changed:
+            return 0
+
+        for glossary_file in changed:
+            self.entries.pop(glossary_file, None)
+
+        existing = sorted(path for path in changed if path.is_file())
+        self.entries.update(self.read(existing))
+        self.write()
+
+        return len(existing)
+
+
+    def write(self):
+        '''Write the merged glossary from the entries in memory.'''
+
+        all_entries = chain.from_iterable(self.entries[glossary_file]
+                                          for glossary_file
+                                          in sorted(self.entries))
+        merge.save_glossary(merge.merge_entries(all_entries),
+                            self.merged_file)
+        print(f'Merged {len(self.entries)} glossaries into '
+              f'{self.merged_file}')
+
+
+def get_watch_settings():
+    '''Load the watch settings from the configuration file.'''
+
+    return {'debounce':common.config.getfloat('Watch', 'debounce',
+                                              fallback=2.0),
+            'max_delay':common.config.getfloat('Watch', 'max_delay',
+                                               fallback=30.0),
+            'interval':common.config.getfloat('Watch', 'poll_interval',
+                                              fallback=5.0),
+            'polling':common.config.getboolean('Watch', 'polling',
+                                               fallback=False)
+           }
+
+
+def make_watcher(roots, prune, match, settings):
+    '''Watch the folders with inotify, or by polling if unavailable.'''
+
+    if not settings['polling']:
+        try:
+            return InotifyWatcher(roots, prune, match)
+        except OSError as error:
+            print(f'Cannot use inotify ({error}), checking the folders '
+                  f'every {settings["interval"]} seconds instead')
+
+    return PollingWatcher(roots, prune, match, settings['interval'])
+
+
+def parse_arguments():
+    '''Read the command line arguments.'''
+
+    parser = argparse.ArgumentParser(description='Keep collected OmegaT '
+                                                 'project data and merged '
+                                                 'glossaries up to date.')
+    parser.add_argument('--collect', nargs=2, type=common.Path,
+                        metavar=('SEARCHPATH', 'DESTINATION'),
+                        help='watch a folder of projects and copy their '
+                             'data to the destination')
+    parser.add_argument('--merge', nargs=2, type=common.Path,
+                        metavar=('GLOSSARY_PATH', 'OUTPUT'),
+                        help='watch a folder of glossaries and merge them '
+                             'into the output file')
+    parser.add_argument('--polling', action='store_true', default=None,
+                        help='check the folders at intervals instead of '
+                             'using inotify')
+    parser.add_argument('--debounce', type=float,
+                        help='seconds without changes to wait for before '
+                             'dealing with them')
+    parser.add_argument('--config', type=common.Path,
+                        help='configuration file to use')
+    common.add_profile_arguments(parser)
+
+    arguments = parser.parse_args()
+    if arguments.collect is None and arguments.merge is None:
+        parser.error('nothing to watch, use --collect or --merge')
+
+    return arguments
+
+
+if __name__ == '__main__':
+
+    arguments = parse_arguments()
+    common.start_profiling(arguments)
+    if arguments.config is not None:
+        common.load_config(arguments.config)
+
+    settings = get_watch_settings()
+    for setting in ('polling', 'debounce'):
+        if getattr(arguments, setting) is not None:
+            settings[setting] = getattr(arguments, setting)
+
+    handlers = []
+    roots = []
+    prune = {}
+
+    if arguments.collect is not None:
+        collect.project_settings = collect.get_project_settings()
+        searchpath, destination = (path.resolve()
+                                   for path in arguments.collect)
+        collector = ProjectCollector(searchpath, destination)
+        collector.sync_all()
+        handlers.append((collector.match, collector.sync_changes,
+                         collector.sync_all))
+        roots.append(searchpath)
+        prune[searchpath] = collect.project_settings['prune']
+
+    merger = None
+    if arguments.merge is not None:
+        merge.glossary_settings = merge.get_glossary_settings()
+        try:
+            merge.check_glossary_settings(merge.glossary_settings)
+        except ValueError as error:
+            raise SystemExit(error)
+        glossary_path, merged_file = (path.resolve()
+                                      for path in arguments.merge)
+        merger = GlossaryMerger(glossary_path, merged_file)
+        merger.merge_all()
+        handlers.append((merger.match, merger.merge_changes,
+                         merger.merge_all))
+        roots.append(glossary_path)
+
+    def match(path):
+        return any(handler_match(path) for handler_match, _, _ in handlers)
+
+    watcher = make_watcher(roots, prune, match, settings)
+    print('Watching for changes, press Ctrl+C to stop')
+
+    try:
+        for changes in iter_changes(watcher, settings['debounce'],
+                                    settings['max_delay']):
+            with common.profile_stage('watch_changes', len(changes)):
+                for _, handle_changes, handle_all in handlers:
+                    # Changes may have been missed, so check everything.
+                    if None in changes:
+                        handle_all()
+                    else:
+                        handle_changes(changes)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        if merger is not None:
+            merger.close()